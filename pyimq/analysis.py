@@ -0,0 +1,170 @@
+"""
+File:        analysis.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Functions for post-processing the image quality parameters that are
+saved in the directory mode output files of the PyImageQuality
+software. The parameters are normalized to the highest value of
+every given variable, and the dataset can then be sorted according
+to a selected ranking variable.
+
+When several channels are analyzed in a single run, every quality
+parameter column has a channel suffix (e.g. tEntropy_c1). The
+functions below then work on one channel at a time.
+"""
+
+import re
+
+from pyimq.cascade import Cascade
+
+
+# Names of the quality parameter columns in the directory mode output
+quality_parameters = ["tEntropy", "tBrenner", "fMoments", "fMean", "fSTD", "fEntropy",
+                      "fTh", "fMaxPw", "Skew", "Kurtosis", "MeanBin"]
+
+# Additional gradient based focus measures, that are only calculated when
+# they are selected with the --metrics option
+gradient_parameters = ["tBrenner2D", "tTenengrad", "tLaplacian"]
+
+# The ranking variables that can be selected with the --result option,
+# and the normalized columns that they are based on.
+result_columns = {
+    "average": "Average",
+    "fskew": "SkewNorm",
+    "fentropy": "SpectEntNorm",
+    "ientropy": "SpatEntNorm",
+    "icv": "SpatEntNorm",
+    "fstd": "SpectSTDNorm",
+    "fkurtosis": "KurtosisNorm",
+    "fpw": "SpectHighPowerNorm",
+    "fmean": "SpectHighPowerNorm",
+    "meanbin": "MeanBinNorm"
+}
+
+# The quality parameters that every ranking variable is calculated from
+result_parameters = {
+    "average": ["tEntropy", "fSTD"],
+    "fskew": ["Skew"],
+    "fentropy": ["fEntropy"],
+    "ientropy": ["tEntropy"],
+    "icv": ["tEntropy"],
+    "fstd": ["fSTD"],
+    "fkurtosis": ["Kurtosis"],
+    "fpw": ["fMaxPw"],
+    "fmean": ["fMaxPw"],
+    "meanbin": ["MeanBin"]
+}
+
+
+def get_channel_suffix(channel):
+    """
+    Returns the column name suffix for a channel. None stands for a
+    single channel analysis, without a suffix.
+    """
+    return "" if channel is None else "_c%i" % channel
+
+
+def get_channel_suffixes(csv_data):
+    """
+    Find out which channels are present in a results table.
+
+    :param csv_data:    A pandas DataFrame
+    :return:            A list of column name suffixes, e.g. ["_c0", "_c1"],
+                        or [""] for single channel results.
+    """
+    suffixes = []
+    for column in csv_data.columns:
+        match = re.match(r"^(%s)((_c\d+)?)$" % "|".join(quality_parameters + gradient_parameters),
+                         column)
+        if match is not None and match.group(2) not in suffixes:
+            suffixes.append(match.group(2))
+    return suffixes
+
+
+def calculate_normalized_parameters(csv_data, suffix=""):
+    """
+    Normalize the quality parameters to the highest value of every given
+    variable. In addition some new parameters are calculated. The new
+    columns are added to the DataFrame.
+
+    :param csv_data:    A pandas DataFrame with the directory mode results
+    :param suffix:      Channel suffix of the column names
+    :return:            The DataFrame
+    """
+    def column(name):
+        return csv_data[name + suffix]
+
+    def available(*names):
+        return all(name + suffix in csv_data.columns for name in names)
+
+    # Only some of the parameters may have been calculated (see the
+    # --metrics option), so the new columns are added when possible.
+    if available("fSTD", "fMean"):
+        csv_data["cv" + suffix] = column("fSTD")/column("fMean")
+    if available("tEntropy"):
+        csv_data["SpatEntNorm" + suffix] = column("tEntropy")/column("tEntropy").max()
+    if available("fMean"):
+        csv_data["SpectMean" + suffix] = column("fMean")/column("fMean").max()
+    if available("fSTD"):
+        csv_data["SpectSTDNorm" + suffix] = column("fSTD")/column("fSTD").max()
+        csv_data["InvSpectSTDNorm" + suffix] = 1 - column("SpectSTDNorm")
+    if available("fEntropy"):
+        csv_data["SpectEntNorm" + suffix] = column("fEntropy")/column("fEntropy").max()
+    if available("Skew"):
+        csv_data["SkewNorm" + suffix] = 1 - abs(column("Skew"))/abs(column("Skew")).max()
+    if available("Kurtosis"):
+        csv_data["KurtosisNorm" + suffix] = abs(column("Kurtosis"))/abs(column("Kurtosis")).max()
+    if available("fMaxPw"):
+        csv_data["SpectHighPowerNorm" + suffix] = column("fMaxPw")/column("fMaxPw").max()
+    if available("MeanBin"):
+        csv_data["MeanBinNorm" + suffix] = column("MeanBin")/column("MeanBin").max()
+    if available("tBrenner"):
+        csv_data["BrennerNorm" + suffix] = column("tBrenner")/column("tBrenner").max()
+    if available("fMoments"):
+        csv_data["SpectMomentsNorm" + suffix] = column("fMoments")/column("fMoments").max()
+    return csv_data
+
+
+# The order of the cascade stages in a ranking: the images that were
+# accepted by the coarse measure are ranked above the fully analyzed ones,
+# and the rejected ones below them. The resolved images have no values for
+# the full quality parameters.
+stage_order = {Cascade.ACCEPT: 0, Cascade.FULL: 1, Cascade.REJECT: 2}
+
+
+def sort_by_result(csv_data, result, suffix=""):
+    """
+    Sort the dataset according to the desired ranking variable, best
+    images first. With cascade results the images are sorted by the
+    cascade stage first (see stage_order), and by the ranking variable
+    within every stage. The sorting is done in place.
+
+    :param csv_data:    A pandas DataFrame with normalized parameters
+    :param result:      One of the --result option values
+    :param suffix:      Channel suffix of the column names
+    :return:            The DataFrame
+    """
+    if result not in result_columns:
+        raise NotImplementedError("Unknown results sorting method %s" % result)
+    missing = [name for name in result_parameters[result] if name + suffix not in csv_data.columns]
+    if missing:
+        raise ValueError("Sorting by %s requires the %s parameters, that were not "
+                         "calculated" % (result, ", ".join(missing)))
+    if result == "average":
+        csv_data["Average" + suffix] = csv_data[
+            ["InvSpectSTDNorm" + suffix, "SpatEntNorm" + suffix]].mean(axis=1)
+    column = result_columns[result] + suffix
+    if "Stage" + suffix in csv_data.columns:
+        order = csv_data["Stage" + suffix].map(stage_order).fillna(stage_order[Cascade.FULL])
+        csv_data["StageOrder" + suffix] = order
+        # The resolved images are ordered by the coarse measure
+        keys = ["StageOrder" + suffix, column]
+        if "cScore" + suffix in csv_data.columns:
+            keys.append("cScore" + suffix)
+        csv_data.sort_values(by=keys, ascending=[True] + [False] * (len(keys) - 1),
+                             inplace=True)
+        del csv_data["StageOrder" + suffix]
+    else:
+        csv_data.sort_values(by=column, ascending=False, inplace=True)
+    return csv_data
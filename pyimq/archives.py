@@ -0,0 +1,196 @@
+"""
+File:        archives.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Reading images directly from zip and tar archives, and from the frames
+of multi-frame images, without extracting them to disk. The images are
+addressed with virtual paths:
+
+-   archive member:     /data/plate1.zip/A01/field1.tif
+-   frame of an image:  /data/timelapse.tif/frame-00012
+-   frame of a member:  /data/plate1.zip/stack.gif/frame-00003
+
+The virtual paths are used as the image names everywhere (e.g. in the
+Filename column of the output file). The members are read into memory
+buffers, that the decoders open like files.
+
+Every archive is opened once per process, and the members are read with
+a lock, so several decoder threads can share it (the decoding itself
+happens outside the lock). Zip archives allow random access. In
+compressed tar archives the members can only be read efficiently in the
+archive order; the members that are skipped over while seeking forward
+are kept in a small buffer, as the decoder threads may request nearby
+members slightly out of order.
+"""
+
+import collections
+import io
+import os
+import re
+import tarfile
+import threading
+import zipfile
+
+
+archive_extensions = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+# The extensions of the images that can contain several frames
+frame_extensions = (".tif", ".tiff", ".gif")
+
+frame_pattern = re.compile(r"^(.+)/frame-(\d+)$")
+
+
+def is_archive(path):
+    return path.lower().endswith(archive_extensions)
+
+
+def get_frame_path(path, index):
+    return "%s/frame-%05i" % (path, index)
+
+
+def split_frame(path):
+    """
+    Split a virtual frame path into the path of the image, and the frame
+    index.
+
+    :return:    A (path, index) tuple. The index is None, if the path does
+                not refer to a frame.
+    """
+    match = frame_pattern.match(path)
+    if match is None or not match.group(1).lower().endswith(frame_extensions) or \
+            os.path.exists(path):
+        return path, None
+    return match.group(1), int(match.group(2))
+
+
+def split_path(path):
+    """
+    Split a virtual path into the path of an archive, and the name of a
+    member in it.
+
+    :return:    An (archive path, member name) tuple, or None if the path
+                does not refer to an archive member
+    """
+    if os.path.isfile(path):
+        return None
+    parts = path.replace(os.sep, "/").split("/")
+    for i in range(1, len(parts)):
+        prefix = os.sep.join(parts[:i])
+        if is_archive(prefix) and os.path.isfile(prefix):
+            return prefix, "/".join(parts[i:])
+    return None
+
+
+class ArchiveReader(object):
+    """
+    Reads the members of a zip or tar archive.
+    """
+
+    # Number of skipped members that are kept in memory, when seeking
+    # forward in a compressed tar archive
+    buffer_size = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if zipfile.is_zipfile(path):
+            self.zip = zipfile.ZipFile(path)
+            self.tar = None
+            self.members = [info.filename for info in self.zip.infolist() if not info.is_dir()]
+        else:
+            self.zip = None
+            self.tar = tarfile.open(path, "r:*")
+            self.infos = [info for info in self.tar.getmembers() if info.isfile()]
+            self.positions = dict((info.name, i) for i, info in enumerate(self.infos))
+            self.members = [info.name for info in self.infos]
+            self.sequential = path.lower().endswith(archive_extensions[2:])
+            self.next = 0
+            self.skipped = collections.OrderedDict()
+        self.names = frozenset(self.members)
+
+    def read(self, name):
+        """
+        Returns the contents of a member as bytes
+        """
+        with self.lock:
+            if self.zip is not None:
+                return self.zip.read(name)
+            if name in self.skipped:
+                return self.skipped.pop(name)
+            position = self.positions[name]
+            if self.sequential and position > self.next:
+                for skipped in self.infos[max(self.next, position - self.buffer_size):position]:
+                    self.skipped[skipped.name] = self.tar.extractfile(skipped).read()
+                while len(self.skipped) > self.buffer_size:
+                    self.skipped.popitem(last=False)
+            self.next = position + 1
+            return self.tar.extractfile(self.infos[position]).read()
+
+    def close(self):
+        with self.lock:
+            (self.zip or self.tar).close()
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_reader(path):
+    """
+    Returns the (shared) reader of an archive.
+    """
+    with _readers_lock:
+        if path not in _readers:
+            _readers[path] = ArchiveReader(path)
+        return _readers[path]
+
+
+def list_members(path):
+    """
+    Returns the names of the files in an archive, in the archive order.
+    """
+    return list(get_reader(path).members)
+
+
+def open_source(path):
+    """
+    Open an image for reading. A regular file path is returned as it is; an
+    archive member is read into a memory buffer.
+
+    :return:    A path or a file-like object, that the image libraries can open
+    """
+    if os.path.isfile(path):
+        return path
+    member = split_path(path)
+    if member is None:
+        raise IOError("No such file or archive member: %s" % path)
+    return io.BytesIO(get_reader(member[0]).read(member[1]))
+
+
+def exists(path):
+    """
+    Check whether a (virtual) path refers to a file, an archive member or
+    the frame of one.
+    """
+    path = split_frame(path)[0]
+    if os.path.isfile(path):
+        return True
+    member = split_path(path)
+    return member is not None and member[1] in get_reader(member[0]).names
+
+
+def get_source_key(path):
+    """
+    Returns the regular file that contains an image, and the rest of the
+    virtual path (empty for regular files).
+    """
+    path = path.replace(os.sep, "/")
+    container = split_path(split_frame(path)[0])
+    if container is None:
+        container = split_frame(path)[0]
+        if container == path:
+            return path, ""
+    else:
+        container = container[0]
+    return container, path[len(container):]
@@ -0,0 +1,445 @@
+"""
+File:        batch.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Parallel image scoring for the directory mode of the PyImageQuality
+software. The images are decoded in the main process (possibly in
+several decoder threads, see --decode-workers), and scored in a pool
+of worker processes.
+
+The decoded images are not pickled into the workers, which would copy
+every (possibly very large) image twice. Instead the main process owns
+a ring of shared memory slots (multiprocessing.shared_memory). Every
+image is copied into a free slot, and only the slot index, the shape
+and the data type are sent to a worker, which wraps the slot into a
+MyImage without copying. The slot is released when the results of the
+image come back. When all the slots are in use, the main process waits
+for results before it decodes more images (back-pressure), which also
+limits the memory use. Images that do not fit in a slot are pickled and
+sent to the workers with the task.
+
+The results are returned in the same order as the images were submitted,
+so the output file is identical to the one of a serial run.
+
+Every worker has a connection (a pipe) of its own. A worker that exceeds
+the time limit of an image (--image-timeout) is killed and replaced with
+a new one, as is a worker that crashes. The failed images are retried
+(--retries) and then returned with the error, see the faults module.
+
+Both scorers keep count of the time that the workers spend scoring
+images (busy_time), for the worker utilisation in the progress module.
+"""
+
+import argparse
+import collections
+import multiprocessing
+import time
+import traceback
+import weakref
+from multiprocessing import connection, shared_memory
+
+import numpy
+
+from pyimq import cascade, faults
+from pyimq.myimage import MyImage
+
+
+def get_options(parser):
+    """
+    Command-line options for the parallel scoring
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Parallel scoring", "Options for scoring the images in worker processes"
+    )
+    group.add_argument(
+        "--score-workers",
+        dest="score_workers",
+        type=int,
+        default=1,
+        help="Number of worker processes that score the images in the "
+             "directory mode. With 1 the images are scored in the main process."
+    )
+    group.add_argument(
+        "--shm-slots",
+        dest="shm_slots",
+        type=int,
+        default=0,
+        help="Number of shared memory slots for passing the decoded images to "
+             "the workers. By default two per worker."
+    )
+    group.add_argument(
+        "--shm-slot-size",
+        dest="shm_slot_size",
+        type=float,
+        default=64,
+        help="Size of a shared memory slot (MB). Larger images are pickled "
+             "and sent to the workers with the task."
+    )
+    return parser
+
+
+def score_image(image, channels, graph, screen=None):
+    """
+    Score the channels of an image.
+
+    :param image:       A MyImage object
+    :param channels:    A list of the channel indexes that are scored from an
+                        RGB image
+    :param graph:       A metrics.MetricGraph
+    :param screen:      A cascade.Cascade, or None
+    :return:            A list of the results (the quality parameters, and the
+                        cascade score and stage of every channel), and a list
+                        of the cascade stages. The stages are not counted here.
+    """
+    results = []
+    stages = []
+    for channel in channels:
+        channel_image = image.get_channel(channel) if image.is_rgb() else image
+        if screen is not None:
+            score = screen.coarse_score(channel_image)
+            stage = screen.classify(score)
+            if stage == cascade.Cascade.FULL:
+                results += graph.evaluate(channel_image)
+            else:
+                results += [float("nan")] * len(graph.metrics)
+            results += [score, stage]
+            stages.append(stage)
+        else:
+            results += graph.evaluate(channel_image)
+    return results, stages
+
+
+class SerialScorer(object):
+    """
+    Scores the images in the calling process. Has the same interface as
+    the SharedMemoryScorer.
+    """
+
+    def __init__(self, graph, screen=None, timeout=0, retries=0, fail_fast=True):
+        self.graph = graph
+        self.screen = screen
+        self.timeout = timeout
+        self.retries = retries
+        self.fail_fast = fail_fast
+        self.worker_count = 1
+        self.busy_time = 0.0
+
+    def submit(self, key, image, channels):
+        """
+        Score an image.
+
+        :return:    A list of (key, results, stages, error) tuples. The
+                    error is None, if the image was scored successfully.
+        """
+        started = time.time()
+        try:
+            return self.score(key, image, channels)
+        finally:
+            self.busy_time += time.time() - started
+
+    def score(self, key, image, channels):
+        if self.fail_fast:
+            with faults.time_limit(self.timeout):
+                results, stages = score_image(image, channels, self.graph, self.screen)
+            return [(key, results, stages, None)]
+
+        for attempt in range(self.retries + 1):
+            try:
+                with faults.time_limit(self.timeout):
+                    results, stages = score_image(image, channels, self.graph, self.screen)
+                return [(key, results, stages, None)]
+            except Exception as error:
+                failure = error
+        return [(key, None, None, failure)]
+
+    def close(self):
+        return []
+
+
+def attach_shared_memory(name):
+    """
+    Attach to a shared memory block that is owned by another process.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Before Python 3.13 also the attached blocks are registered with the
+    # resource tracker, which would unlink them when the worker exits. The
+    # registration is skipped, as the main process owns the blocks.
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def run_worker(pipe, slot_names, graph, screen):
+    """
+    The scoring worker process. Scores the images that are received from
+    the pipe, until None is received.
+    """
+    slots = [attach_shared_memory(name) for name in slot_names]
+    try:
+        while True:
+            try:
+                task = pipe.recv()
+            except EOFError:
+                break
+            if task is None:
+                break
+            index, slot, data, shape, dtype, spacing, channels = task
+            if slot is not None:
+                data = numpy.ndarray(shape, dtype=dtype, buffer=slots[slot].buf)
+            try:
+                image = MyImage(data, spacing, copy=False)
+                pipe.send((index,) + score_image(image, channels, graph, screen) + (None,))
+            except Exception:
+                pipe.send((index, None, None, traceback.format_exc()))
+            finally:
+                # The view must be released before the slot is reused
+                image = data = None
+    finally:
+        for block in slots:
+            block.close()
+
+
+class Worker(object):
+    """
+    A scoring worker process, the connection to it and the image that it is
+    currently scoring.
+    """
+
+    def __init__(self, slot_names, graph, screen):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=run_worker, args=(child, slot_names, graph, screen))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.index = None
+        self.started = None
+
+    def send(self, index, task):
+        self.connection.send(task)
+        self.index = index
+        self.started = time.time()
+
+    def stop(self, timeout=10):
+        """
+        Ask the worker to stop, and kill it if it does not.
+        """
+        try:
+            self.connection.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+def _release(workers, slots):
+    """
+    Stop the workers and free the shared memory.
+    """
+    for worker in workers:
+        worker.stop()
+    for block in slots:
+        block.close()
+        block.unlink()
+    del slots[:]
+
+
+class SharedMemoryScorer(object):
+    """
+    Scores the images in a pool of worker processes, that receive the
+    images through shared memory. Every worker has its own connection,
+    so that a worker that exceeds the time limit, or crashes, can be
+    replaced without affecting the others.
+    """
+
+    # How often the time limits are checked (seconds)
+    poll_interval = 0.5
+
+    def __init__(self, graph, screen=None, workers=2, slots=0, slot_bytes=64 * 1024 * 1024,
+                 timeout=0, retries=0, fail_fast=True):
+        assert workers > 0
+        slots = slots if slots > 0 else 2 * workers
+        self.graph = graph
+        self.screen = screen
+        self.timeout = timeout
+        self.retries = retries
+        self.fail_fast = fail_fast
+        self.slot_bytes = int(slot_bytes)
+        self.slots = [shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+                      for i in range(slots)]
+        self.free = collections.deque(range(slots))
+        self.workers = [Worker(self.get_slot_names(), graph, screen) for i in range(workers)]
+        self.worker_count = workers
+        self.busy_time = 0.0
+
+        # Submitted images: index -> (key, slot), in the order of submission
+        self.pending = collections.OrderedDict()
+        # The tasks of the images that are being scored, and the tasks that
+        # wait for a free worker
+        self.tasks = {}
+        self.attempts = collections.Counter()
+        self.queued = collections.deque()
+        self.finished = {}
+        self.count = 0
+        self.finalizer = weakref.finalize(self, _release, self.workers, self.slots)
+
+    def get_slot_names(self):
+        return [block.name for block in self.slots]
+
+    def dispatch(self):
+        """
+        Send the queued tasks to the idle workers.
+        """
+        for worker in self.workers:
+            if worker.index is None and self.queued:
+                index = self.queued.popleft()
+                self.attempts[index] += 1
+                worker.send(index, self.tasks[index])
+
+    def restart(self, worker):
+        """
+        Kill a worker, and start a new one in its place.
+        """
+        worker.kill()
+        self.workers[self.workers.index(worker)] = Worker(
+            self.get_slot_names(), self.graph, self.screen)
+
+    def complete(self, index, results, stages, error):
+        """
+        Handle the results of an image. A failed image is queued again,
+        until it has been tried 1 + retries times.
+        """
+        key, slot = self.pending[index]
+        if error is not None and self.fail_fast:
+            raise RuntimeError("Scoring %s failed:\n%s" % (key, error))
+        if error is not None and self.attempts[index] <= self.retries:
+            self.queued.append(index)
+            return
+        if slot is not None:
+            self.free.append(slot)
+        del self.tasks[index]
+        self.finished[index] = (key, results, stages, error)
+
+    def receive(self):
+        """
+        Wait until the scoring of at least one image has finished or failed.
+        """
+        while True:
+            self.dispatch()
+            busy = [worker for worker in self.workers if worker.index is not None]
+            assert busy, "No images are being scored"
+            poll_interval = self.poll_interval
+            if self.timeout > 0:
+                poll_interval = min(poll_interval, self.timeout / 4.0)
+            ready = connection.wait([worker.connection for worker in busy], timeout=poll_interval)
+            done = False
+            for worker in busy:
+                index = worker.index
+                elapsed = time.time() - worker.started
+                if worker.connection in ready:
+                    self.busy_time += elapsed
+                    try:
+                        message = worker.connection.recv()
+                    except EOFError:
+                        self.restart(worker)
+                        message = (index, None, None, "The worker process died (exit code %s)"
+                                   % worker.process.exitcode)
+                    worker.index = None
+                    self.complete(*message)
+                    done = True
+                elif self.timeout > 0 and elapsed > self.timeout:
+                    self.busy_time += elapsed
+                    self.restart(worker)
+                    self.complete(index, None, None, faults.ImageTimeout(
+                        "Timeout after %g s" % self.timeout))
+                    done = True
+            if done:
+                return
+
+    def get_ready(self):
+        """
+        Returns the finished results that are next in the submission order.
+        """
+        ready = []
+        while self.pending:
+            index = next(iter(self.pending))
+            if index not in self.finished:
+                break
+            del self.pending[index]
+            ready.append(self.finished.pop(index))
+        return ready
+
+    def submit(self, key, image, channels):
+        """
+        Send an image to the workers. Waits for a free slot, if all of them
+        are in use.
+
+        :param key:         A name for the image (e.g. the path)
+        :param image:       A MyImage object
+        :param channels:    The channels to score, see score_image()
+        :return:            A list of (key, results, stages, error) tuples of
+                            the images, that have been scored so far
+        """
+        data = image.get_array()
+        slot = None
+        if data.nbytes <= self.slot_bytes:
+            while not self.free:
+                self.receive()
+            slot = self.free.popleft()
+            view = numpy.ndarray(data.shape, dtype=data.dtype, buffer=self.slots[slot].buf)
+            view[...] = data
+            del view
+            data = None
+        else:
+            # Too large for a slot, the image is pickled instead. The number
+            # of images in flight is still limited to the number of slots.
+            while len(self.pending) - len(self.finished) >= len(self.slots):
+                self.receive()
+
+        self.tasks[self.count] = (self.count, slot, data, image.get_dimensions(),
+                                  image.get_array().dtype, image.get_spacing(), channels)
+        self.queued.append(self.count)
+        self.pending[self.count] = (key, slot)
+        self.count += 1
+        self.dispatch()
+        return self.get_ready()
+
+    def close(self):
+        """
+        Wait for the rest of the results, and stop the workers.
+
+        :return:    A list of (key, results, stages, error) tuples
+        """
+        try:
+            while len(self.pending) > len(self.finished):
+                self.receive()
+            return self.get_ready()
+        finally:
+            self.finalizer()
+
+
+def get_scorer(graph, screen, options):
+    """
+    Returns a scorer according to the command line options.
+    """
+    if options.score_workers <= 1:
+        return SerialScorer(graph, screen, options.image_timeout, options.retries,
+                            options.fail_fast)
+    return SharedMemoryScorer(graph, screen, options.score_workers, options.shm_slots,
+                              options.shm_slot_size * 1024 * 1024, options.image_timeout,
+                              options.retries, options.fail_fast)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- python -*-
+"""
+File: evaluate.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+
+An evaluation harness for choosing the image quality analysis
+configuration. The images in the working directory are analyzed in
+every configuration (radial vs. additive power spectrum, masked vs.
+full image entropy, float32 vs. float64 data and downsampled vs. full
+resolution images), and the rank correlation (Spearman) of the quality
+parameters with the subjective scores, that were collected with the
+subjective.py script, is calculated. The analysis time is recorded
+for every configuration; the image decoding is not included, as it is
+the same in all the configurations. The configurations are first all
+run once without timing, and then timed --repeats times, in a random
+order.
+
+The results are saved in a csv file, one row per configuration. The
+configurations that are Pareto optimal in terms of the analysis time
+and the rank correlation of the --result ranking variable are marked,
+and printed on the screen, fastest first.
+"""
+import sys
+import os
+import copy
+import datetime
+import itertools
+import time
+
+import numpy
+import pandas
+from scipy import stats
+
+from .. import script_options, analysis, resize, kernels, metrics
+from ..myimage import MyImage
+
+
+configuration_names = ["Averaging", "Mask", "Dtype", "Resolution"]
+
+
+def get_configurations():
+    """
+    Returns all the analysis configurations, as tuples in the order of
+    configuration_names
+    """
+    return list(itertools.product(
+        ["additive", "radial"], [False, True], ["float64", "float32"], ["full", "downsampled"]
+    ))
+
+
+def load_subjective_scores(path):
+    """
+    Read the subjective scores file and calculate the mean score of every
+    image over all the ranking rounds (the Result_N columns).
+
+    :return:    A pandas Series of mean scores, indexed by the file name
+    """
+    csv_data = pandas.read_csv(path)
+    results = [column for column in csv_data.columns if column.startswith("Result")]
+    assert len(results) > 0, "No subjective ranking results in %s" % path
+    return csv_data[results].mean(axis=1).set_axis(csv_data["Filename"])
+
+
+def prepare_image(data, dtype, resolution, options):
+    """
+    Convert an image into the data type and resolution of a configuration.
+    """
+    data = data.astype(dtype)
+    if resolution == "downsampled":
+        scale = float(options.image_size) / min(data.shape)
+        if scale < 1:
+            size = tuple(max(1, int(round(side * scale))) for side in data.shape)
+            data = resize.resize(data, size, options.resize_method).astype(dtype)
+    return data
+
+
+def get_configuration_graph(configuration, options):
+    """
+    Returns the metrics.MetricGraph that calculates the quality parameters
+    in a configuration.
+    """
+    averaging, use_mask, dtype, resolution = configuration
+    run_options = copy.copy(options)
+    run_options.power_averaging = averaging
+    run_options.use_mask = use_mask
+    return metrics.MetricGraph(analysis.quality_parameters, run_options)
+
+
+def run_configuration(images, configuration, graph, options):
+    """
+    Analyze all the images in a single configuration, once.
+
+    :param images:          A list of 2D Numpy arrays
+    :param configuration:   A tuple of the configuration values
+    :param graph:           The graph of the configuration, see
+                            get_configuration_graph()
+    :param options:         Command line options
+    :return:                A (images x parameters) array and the average
+                            analysis time per image
+    """
+    averaging, use_mask, dtype, resolution = configuration
+    results = []
+    start = time.time()
+    for data in images:
+        data = prepare_image(data, dtype, resolution, options)
+        results.append(graph.evaluate(MyImage(data, [1, 1])))
+    elapsed = time.time() - start
+    return numpy.array(results, dtype=numpy.float64), elapsed / len(images)
+
+
+def time_configurations(images, configurations, options):
+    """
+    Analyze the images in all the configurations. Every configuration is
+    first run once without timing, so that the one-off costs (imports, FFT
+    planning, caches) are not charged to the first configurations. The
+    timed runs are then repeated --repeats times, every time in a different
+    random order, so that a drift in the machine speed does not always
+    penalize the same configurations. The shortest time is recorded.
+
+    :return:    A list of (images x parameters) arrays, and a list of the
+                average analysis times per image
+    """
+    graphs = [get_configuration_graph(configuration, options)
+              for configuration in configurations]
+    results = [run_configuration(images, configuration, graph, options)[0]
+               for configuration, graph in zip(configurations, graphs)]
+
+    times = [numpy.inf] * len(configurations)
+    order = list(range(len(configurations)))
+    random = numpy.random.RandomState(0)
+    for repeat in range(max(1, options.repeats)):
+        random.shuffle(order)
+        for i in order:
+            seconds = run_configuration(images, configurations[i], graphs[i], options)[1]
+            times[i] = min(times[i], seconds)
+    return results, times
+
+
+def calculate_correlations(results, scores):
+    """
+    Calculate the Spearman rank correlation of every quality parameter and
+    ranking variable with the subjective scores.
+
+    :param results: An (images x parameters) array of quality parameters
+    :param scores:  An array of subjective scores, one per image
+    :return:        A dictionary of correlation coefficients
+    """
+    csv_data = pandas.DataFrame(results, columns=analysis.quality_parameters)
+    analysis.calculate_normalized_parameters(csv_data)
+    csv_data["Average"] = csv_data[["InvSpectSTDNorm", "SpatEntNorm"]].mean(axis=1)
+
+    columns = analysis.quality_parameters + sorted(set(analysis.result_columns.values()))
+    return {column: stats.spearmanr(csv_data[column], scores)[0] for column in columns}
+
+
+def find_pareto_optimal(times, correlations):
+    """
+    Find the configurations that are not dominated by another configuration,
+    i.e. there is no configuration that is both faster and has a higher
+    rank correlation.
+
+    :return:    A boolean array
+    """
+    times = numpy.asarray(times)
+    correlations = numpy.nan_to_num(numpy.asarray(correlations), nan=-numpy.inf)
+    optimal = numpy.ones(times.size, dtype=bool)
+    for i in range(times.size):
+        dominated = (times <= times[i]) & (correlations >= correlations[i]) & \
+                    ((times < times[i]) | (correlations > correlations[i]))
+        optimal[i] = not dominated.any()
+    return optimal
+
+
+def main():
+    options = script_options.get_evaluation_script_options(sys.argv[1:])
+    kernels.set_backend(options.kernels)
+    path = options.working_directory
+    assert os.path.isdir(path)
+
+    scores = load_subjective_scores(os.path.join(path, options.scores))
+    file_names = list(scores.index)
+
+    # All the configurations are run with the same decoded images
+    images = []
+    for file_name in file_names:
+        image = MyImage.get_generic_image(os.path.join(path, file_name),
+                                          channel=options.rgb_channel,
+                                          decoder=options.decoder)
+        if image.is_rgb():
+            image = image.get_channel(options.rgb_channel)
+        images.append(image.get_array())
+
+    configurations = get_configurations()
+    all_results, times = time_configurations(images, configurations, options)
+    rows = []
+    for configuration, results, seconds in zip(configurations, all_results, times):
+        row = dict(zip(configuration_names, configuration))
+        row["Time"] = seconds
+        row.update(calculate_correlations(results, scores.values))
+        rows.append(row)
+        print("%-8s mask=%-5s %-7s %-11s %8.1f ms/image  rho=%.3f" % (
+            configuration + (1000 * seconds, row[analysis.result_columns[options.result]])))
+
+    csv_data = pandas.DataFrame(rows)
+    result = analysis.result_columns[options.result]
+    csv_data["Pareto"] = find_pareto_optimal(csv_data["Time"], csv_data[result])
+    csv_data.sort_values(by="Time", inplace=True)
+
+    # Create output directory
+    output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
+    output_dir = os.path.join(options.working_directory, output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    date_now = datetime.datetime.now().strftime("%H-%M-%S")
+    file_path = os.path.join(output_dir, date_now + '_PyIQ_evaluation.csv')
+    csv_data.to_csv(file_path, index=False)
+
+    print("\nPareto optimal configurations (%s), fastest first:" % result)
+    print(csv_data[csv_data["Pareto"]][configuration_names + ["Time", result]].to_string(index=False))
+    print("The results were saved to %s" % file_path)
+
+if __name__ == "__main__":
+    main()
@@ -22,9 +22,22 @@ the --mode parameter:
             printed on the terminal screen
 - directory:   All the images in a directory are analyzed and
             the results are saved in a file
+- heatmap:     The quality parameters are calculated in sliding
+            windows of a single file (--file), or of every image in
+            a directory, and saved as low resolution maps.
+- sweep:       The quality parameters of a single file, or of every
+            image in a directory, are calculated for a grid of
+            --power-threshold, --spatial-threshold and --invert-mask
+            settings (see the --sweep-* options), reusing the FFT and
+            the smoothed image. One row per image and setting is saved.
+- merge:       The output files of a sharded directory mode run
+            (see the --shard option) are combined into a single file,
+            as are the dataset summaries (--summary) of the shards.
 - analyze:     Variables are calculated from the analysis results.
 - plot:        The analysis results are ordered according to a
             selected image quality variable.
+With the --report option the plots are rendered into PNG files and an
+HTML page in a background process, which works without a display.
 License:
 The PyImageQuality software is licensed under BSD open-source license.
 
@@ -67,7 +80,9 @@ import datetime
 
 import csv
 import pandas
-from pyimq import filters, script_options, utils, myimage
+from pyimq import filters, script_options, utils, myimage, cascade, analysis, sharding, \
+    archives, discovery, metrics, report, thumbnails, heatmap, batch, faults, progress, summary, \
+    sweep, kernels
 
 
 def main():
@@ -75,12 +90,24 @@ def main():
     The Main program of the PyImageQualityRanking software.
     """
     options = script_options.get_quality_script_options(sys.argv[1:])
+    kernels.set_backend(options.kernels)
     path = options.working_directory
     file_path = None
     csv_data = None
 
     print("Mode option is %s" % options.mode)
 
+    # In the report mode all the plots are rendered into files in a
+    # background process, instead of showing them on screen.
+    if options.report:
+        report_dir = os.path.join(
+            options.working_directory,
+            datetime.datetime.now().strftime("%Y-%m-%d") + '_PyIQ_output',
+            datetime.datetime.now().strftime("%H-%M-%S") + '_PyIQ_report')
+        report.start(report_dir, thumbnail_size=options.thumbnail_size,
+                     cache_dir=thumbnails.get_cache_dir(options),
+                     cache_bytes=int(options.thumbnail_cache_size * 1024 * 1024))
+
     if "file" in options.mode:
         # In "file" mode a single file is analyzed and the various parameter
         # values are printed on screen. This functionality is provided mainly
@@ -88,11 +115,17 @@ def main():
         assert options.file is not None, "You have to specify a file with a " \
                                          "--file option"
         path = os.path.join(path, options.file)
-        assert os.path.isfile(path)
+        assert archives.exists(path), "Not a valid file %s" % path
         if options.imagej:
-            image = myimage.MyImage.get_image_from_imagej_tiff(path)
+            image = myimage.MyImage.get_image_from_imagej_tiff(path, rescale=options.rescale)
         else:
-            image = myimage.MyImage.get_generic_image(path)
+            image = myimage.MyImage.get_generic_image(
+                path,
+                channel=options.rgb_channel,
+                decoder=options.decoder,
+                draft=options.jpeg_draft,
+                rescale=options.rescale
+            )
         if image.is_rgb():
             image = image.get_channel(options.rgb_channel)
             print("The shape is %s" % str(image.images.shape))
@@ -127,66 +160,290 @@ def main():
             os.makedirs(output_dir)
         # Create output file
         date_now = datetime.datetime.now().strftime("%H-%M-%S")
-        file_name = date_now + '_PyIQ_out' + '.csv'
+        file_name = date_now + '_PyIQ_out' + sharding.get_shard_suffix(options.shard) + '.csv'
         file_path = os.path.join(output_dir, file_name)
         output_file = open(file_path, 'wt')
         output_writer = csv.writer(
             output_file, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
-        output_writer.writerow(
-            ("Filename", "tEntropy", "tBrenner", "fMoments", "fMean", "fSTD", "fEntropy",
-             "fTh", "fMaxPw", "Skew", "Kurtosis", "MeanBin"))
-
-        for image_name in os.listdir(path):
-            if options.file_filter is None or options.file_filter in image_name:
-                real_path = os.path.join(path, image_name)
-                # Only process images
-                if not os.path.isfile(real_path) or not real_path.endswith((".jpg", ".tif", ".tiff", ".png")):
-                    continue
-                # ImageJ files have particular TIFF tags that can be processed correctly
-                # with the options.imagej switch
-                if options.imagej:
-                    image = myimage.MyImage.get_image_from_imagej_tiff(real_path)
-                else:
-                    image = myimage.MyImage.get_generic_image(real_path)
-                # Only grayscale images are processed. If the input is an RGB image,
-                # a channel can be chosen for processing.
-                if image.is_rgb():
-                    image = image.get_channel(options.rgb_channel)
-                # Time series sometimes contain images of very different content: the start
-                # of the series may show nearly empty (black) images, whereas at the end
-                # of the series the whole field-of-view may be full of cells. Ranking such
-                # dataset in a single piece may be challenging. Therefore the beginning of
-                # the dataset can be separated from the end, by selecting a minimum value
-                # for average grayscale pixel value here.
-                if options.average_filter > 0 and image.average() < options.average_filter:
-                    continue
-
-                # Run spatial domain analysis
-                task = filters.LocalImageQuality(image, options)
-                task.set_smoothing_kernel_size(100)
-                entropy = task.calculate_image_quality()
-                # Run frequency domain analysis
-                task2 = filters.FrequencyQuality(image, options)
-                results = task2.analyze_power_spectrum()
-
-                task3 = filters.SpectralMoments(image, options)
-                moments = task3.calculate_spectral_moments()
-
-                task4 = filters.BrennerImageQuality(image, options)
-                brenner = task4.calculate_brenner_quality()
-
-                # Save results
-                results.insert(0, moments)
-                results.insert(0, brenner)
-                results.insert(0, entropy)
-                results.insert(0, os.path.join(path, image_name))
-                output_writer.writerow(results)
-
-                print("Done analyzing %s" % image_name)
+        # Several channels (or multi-channel TIFF planes) can be analyzed from a
+        # single decoded image. The results of every channel are then saved in
+        # separate columns, with a channel suffix. As the number of channels may
+        # not be known before the first image is opened, the header is written
+        # at the first image in that case.
+        channels = myimage.parse_channels(options.channels)
+        # Only the quality parameters selected with the --metrics option are
+        # calculated, and only the intermediate results that they need.
+        graph = metrics.MetricGraph(
+            metrics.parse_metrics(options.metrics, options.result), options)
+        columns = list(graph.metrics)
+        if options.cascade:
+            columns += ["cScore", "Stage"]
+        header = None
+        if channels != ["all"]:
+            header = ["Filename"]
+            for channel in channels:
+                header += [name + analysis.get_channel_suffix(channel) for name in columns]
+            output_writer.writerow(header)
+
+        # Find the images, possibly from a directory tree. With a persistent
+        # file index only new or modified images are analyzed.
+        index = None
+        if options.file_index is not None:
+            index = discovery.FileIndex(
+                os.path.join(options.working_directory, options.file_index), path)
+        image_paths = discovery.find_images(path, options, index)
+
+        # In a sharded run only a part of the files is analyzed by this process.
+        image_paths = sharding.select_shard(image_paths, path, options.shard)
+        if index is not None:
+            image_paths = [real_path for real_path in image_paths
+                           if not index.is_scored(real_path)]
+
+        # In cascade mode clearly good and clearly bad images are resolved with
+        # a cheap coarse measure. The thresholds can be calibrated from an evenly
+        # spaced sample of the dataset.
+        # Images that can not be loaded or scored are skipped and recorded in
+        # an errors file, unless the run is to be stopped at the first error.
+        errors = None
+        if not options.fail_fast:
+            errors = faults.ErrorLog(os.path.join(
+                output_dir, date_now + '_PyIQ_errors' + sharding.get_shard_suffix(options.shard) +
+                '.csv'))
+
+        if options.cascade:
+            screen = cascade.Cascade(options)
+            if options.cascade_calibrate > 0:
+                step = max(1, len(image_paths) // options.cascade_calibrate)
+                sample = image_paths[::step][:options.cascade_calibrate]
+                scores = []
+                for real_path, image in myimage.load_images(sample, options, errors, "calibrate"):
+                    if image.is_rgb():
+                        image = image.get_channel(options.rgb_channel)
+                    scores.append(screen.coarse_score(image))
+                screen.calibrate(scores)
+
+        # The images are scored either in this process, or in a pool of worker
+        # processes, that receive the decoded images through shared memory.
+        # The results are returned in the order of the images in both cases.
+        scorer = batch.get_scorer(graph, screen if options.cascade else None, options)
+
+        # Instead of a line per image, the progress and throughput is reported
+        # at an interval, and optionally written into telemetry files.
+        tracker = progress.Progress(len(image_paths), options.progress_interval,
+                                    options.telemetry, options.prometheus, errors, scorer)
+
+        # The dataset statistics of the numeric result columns can be
+        # accumulated as the results come in, see the summary module.
+        results_summary = None
+
+        def save_results(real_path, results, stages, error):
+            nonlocal results_summary
+            if error is not None:
+                errors.add(real_path, "score", options.retries + 1, error)
+                return
+            tracker.add_scored()
+            output_writer.writerow([real_path] + results)
+            if options.summary:
+                numeric = [name != "Stage" for name in columns] * (len(results) // len(columns))
+                if results_summary is None:
+                    results_summary = summary.Summary(
+                        [name for name, keep in zip(header[1:], numeric) if keep],
+                        options.summary_accuracy)
+                results_summary.add([value for value, keep in zip(results, numeric) if keep])
+            if index is not None:
+                index.mark_scored(real_path)
+            for stage in stages:
+                screen.record(stage)
+            if options.verbose:
+                print("Done analyzing %s" % os.path.basename(real_path))
+
+        # ImageJ files have particular TIFF tags that can be processed correctly
+        # with the options.imagej switch. Other images are decoded with the
+        # fastest available decoder, possibly in several threads. The serial
+        # scorer is done with an image before the next one is loaded, so the
+        # rescaling buffer can be reused.
+        reuse_buffer = isinstance(scorer, batch.SerialScorer)
+        for real_path, image in myimage.load_images(image_paths, options, errors,
+                                                    reuse_buffer=reuse_buffer):
+            image_name = os.path.basename(real_path)
+            tracker.add_decoded(image)
+            # Only grayscale images are processed. If the input is an RGB image,
+            # a channel can be chosen for processing.
+            if channels == [None]:
+                image_channels = [None]
+                score_channels = [options.rgb_channel]
+            else:
+                image_channels = myimage.get_image_channels(channels, image)
+                score_channels = image_channels
+            if header is None:
+                header = ["Filename"]
+                for channel in image_channels:
+                    header += [name + analysis.get_channel_suffix(channel) for name in columns]
+                output_writer.writerow(header)
+            if len(header) != 1 + len(image_channels) * len(columns):
+                message = "The number of channels in %s differs from the other images" % image_name
+                assert errors is not None, message
+                errors.add(real_path, "channels", 1, message)
+                continue
+            # The channels must be in the image; the channel of a grayscale
+            # image is only chosen by default (--rgb-channel)
+            missing = [channel for channel in image_channels
+                       if channel is not None and channel >= image.get_channel_count()]
+            if missing:
+                message = "%s has %i channel(s), channel %i was requested" % (
+                    image_name, image.get_channel_count(), missing[0])
+                assert errors is not None, message
+                errors.add(real_path, "channels", 1, message)
+                continue
+            # Time series sometimes contain images of very different content: the start
+            # of the series may show nearly empty (black) images, whereas at the end
+            # of the series the whole field-of-view may be full of cells. Ranking such
+            # dataset in a single piece may be challenging. Therefore the beginning of
+            # the dataset can be separated from the end, by selecting a minimum value
+            # for average grayscale pixel value here.
+            if options.average_filter > 0 and image.average() < options.average_filter:
+                if index is not None:
+                    index.mark_scored(real_path)
+                tracker.add_filtered()
+                continue
+
+            for finished in scorer.submit(real_path, image, score_channels):
+                save_results(*finished)
+
+        for finished in scorer.close():
+            save_results(*finished)
 
         output_file.close()
+        if index is not None:
+            index.close()
+        if errors is not None:
+            errors.close()
+            if errors.count > 0:
+                print("%i images were skipped, see %s" % (errors.count, errors.path))
+        tracker.finish()
+        if results_summary is not None:
+            summary_path = summary.save_summary(
+                results_summary, os.path.join(output_dir, date_now + '_PyIQ_summary' +
+                                              sharding.get_shard_suffix(options.shard)),
+                options.summary_quantiles)
+            print("The dataset summary was saved to %s" % summary_path)
+        if options.cascade:
+            print(screen.report())
         print("The results were saved to %s" % file_path)
 
+    if "heatmap" in options.mode:
+        # In heatmap mode the quality parameters are calculated in overlapping
+        # windows, which shows the variation of quality within an image. The
+        # maps are saved in .npz files (and optionally as PNG images).
+        if options.file is not None:
+            image_paths = [os.path.join(options.working_directory, options.file)]
+            assert archives.exists(image_paths[0]), "Not a valid file %s" % image_paths[0]
+        else:
+            assert os.path.isdir(path), path
+            image_paths = discovery.find_images(path, options)
+
+        output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
+        output_dir = os.path.join(options.working_directory, output_dir)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        date_now = datetime.datetime.now().strftime("%H-%M-%S")
+
+        quality_map = None
+        for real_path, image in myimage.load_images(image_paths, options, reuse_buffer=True):
+            if image.is_rgb():
+                image = image.get_channel(options.rgb_channel)
+            # The spectrum plan is reused, as long as the pixel size stays the same
+            if quality_map is None or quality_map.spacing != tuple(image.get_spacing()):
+                quality_map = heatmap.QualityMap(
+                    options, options.window_size, options.window_step,
+                    options.heatmap_metrics, image.get_spacing())
+            maps = quality_map.calculate(image)
+            # Archive members and frames are named after the file that contains them
+            container, member = archives.get_source_key(real_path)
+            name = os.path.splitext(os.path.basename(container))[0] + \
+                os.path.splitext(member.replace("/", "_"))[0]
+            saved = heatmap.save_heatmaps(
+                maps, os.path.join(output_dir, date_now + "_" + name + "_PyIQ_heatmap"),
+                data=image, image=options.heatmap_image,
+                centers=heatmap.get_window_centers(
+                    image.get_dimensions(), options.window_size, options.window_step))
+            print("The heatmaps of %s were saved to %s" % (os.path.basename(real_path), saved[0]))
+
+    if "sweep" in options.mode:
+        # In sweep mode the quality parameters are calculated for every
+        # combination of the swept threshold and mask settings. The
+        # intermediate results that the settings do not affect are shared.
+        if options.file is not None:
+            image_paths = [os.path.join(options.working_directory, options.file)]
+            assert archives.exists(image_paths[0]), "Not a valid file %s" % image_paths[0]
+        else:
+            assert os.path.isdir(path), path
+            image_paths = discovery.find_images(path, options)
+
+        settings = sweep.get_settings(options)
+        graph = metrics.MetricGraph(
+            metrics.parse_metrics(options.metrics, options.result), options)
+
+        output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
+        output_dir = os.path.join(options.working_directory, output_dir)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        date_now = datetime.datetime.now().strftime("%H-%M-%S")
+        file_path = os.path.join(output_dir, date_now + '_PyIQ_sweep.csv')
+        with open(file_path, 'wt') as output_file:
+            output_writer = csv.writer(
+                output_file, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+            output_writer.writerow(sweep.get_header(graph.metrics))
+            for real_path, image in myimage.load_images(image_paths, options,
+                                                        reuse_buffer=True):
+                if image.is_rgb():
+                    image = image.get_channel(options.rgb_channel)
+                results = graph.evaluate_sweep(image, settings)
+                output_writer.writerows(sweep.get_rows(real_path, settings, results))
+                if options.verbose:
+                    print("Done analyzing %s" % os.path.basename(real_path))
+        print("%i images were analyzed with %i settings, the results were saved to %s" % (
+            len(image_paths), len(settings), file_path))
+
+    if "merge" in options.mode:
+        # In merge mode the output files of a sharded directory mode run are
+        # combined into a single file. The shard files are searched with the
+        # glob pattern given with the --file option (relative to the working
+        # directory), or from all the output directories by default.
+        if options.file is not None:
+            pattern = os.path.join(options.working_directory, options.file)
+        else:
+            pattern = os.path.join(options.working_directory, "*_PyIQ_output",
+                                   "*_PyIQ_out_shard-*-of-*.csv")
+        shard_files = sharding.find_shard_files(pattern)
+        csv_data = sharding.merge_shard_files(shard_files)
+
+        # The dataset summaries (--summary) that were saved by the same runs
+        # as the selected shards are merged as well. Everything is read and
+        # checked before any output is written.
+        merged_summary = None
+        summary_files = sharding.find_summary_files(shard_files)
+        if summary_files:
+            merged_summary = summary.merge_summary_files(summary_files)
+
+        # Create output directory
+        output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
+        output_dir = os.path.join(options.working_directory, output_dir)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        date_now = datetime.datetime.now().strftime("%H-%M-%S")
+        file_name = date_now + '_PyIQ_merged_out' + '.csv'
+        file_path = os.path.join(output_dir, file_name)
+
+        csv_data.to_csv(file_path, index=False)
+        print("%i shard files were merged into %s" % (len(shard_files), file_path))
+
+        if merged_summary is not None:
+            summary_path = summary.save_summary(
+                merged_summary, os.path.join(output_dir, date_now + '_PyIQ_merged_summary'),
+                options.summary_quantiles)
+            print("The shard summaries were merged into %s" % summary_path)
+
     if "analyze" in options.mode:
     # In analyze mode the previously created quality ranking variables are
     # normalized to the highest value of every given variable. In addition
@@ -202,18 +459,8 @@ def main():
             assert path.endswith(".csv"), "Unknown suffix %s" % path.split(".")[-1]
 
         csv_data = pandas.read_csv(file_path)
-        csv_data["cv"] = csv_data.fSTD/csv_data.fMean
-        csv_data["SpatEntNorm"] = csv_data.tEntropy/csv_data.tEntropy.max()
-        csv_data["SpectMean"] = csv_data.fMean/csv_data.fMean.max()
-        csv_data["SpectSTDNorm"] = csv_data.fSTD/csv_data.fSTD.max()
-        csv_data["InvSpectSTDNorm"] = 1- csv_data.SpectSTDNorm
-        csv_data["SpectEntNorm"] = csv_data.fEntropy/csv_data.fEntropy.max()
-        csv_data["SkewNorm"] = 1 - abs(csv_data.Skew)/abs(csv_data.Skew).max()
-        csv_data["KurtosisNorm"] = abs(csv_data.Kurtosis)/abs(csv_data.Kurtosis).max()
-        csv_data["SpectHighPowerNorm"] = csv_data.fMaxPw/csv_data.fMaxPw.max()
-        csv_data["MeanBinNorm"] = csv_data.MeanBin/csv_data.MeanBin.max()
-        csv_data["BrennerNorm"] = csv_data.tBrenner/csv_data.tBrenner.max()
-        csv_data["SpectMomentsNorm"] = csv_data.fMoments/csv_data.fMoments.max()
+        for suffix in analysis.get_channel_suffixes(csv_data):
+            analysis.calculate_normalized_parameters(csv_data, suffix)
 
         # Create output directory
         output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
@@ -234,41 +481,34 @@ def main():
     # controlled by the options.npics parameter
         if csv_data is None:
             file_path = os.path.join(options.working_directory, options.file)
-            assert os.path.isfile(file_path), "Not a valid file %s" % path
-            assert path.endswith(".csv"), "Unknown suffix %s" % path.split(".")[-1]
+            assert os.path.isfile(file_path), "Not a valid file %s" % file_path
+            assert file_path.endswith(".csv"), "Unknown suffix %s" % file_path.split(".")[-1]
             csv_data = pandas.read_csv(file_path)
-        if options.result == "average":
-            csv_data["Average"] = csv_data[["InvSpectSTDNorm", "SpatEntNorm"]].mean(axis=1)
-            csv_data.sort_values(by="Average", ascending=False, inplace=True)
-        elif options.result == "fskew":
-            csv_data.sort_values(by="SkewNorm", ascending=False, inplace=True)
-        elif options.result == "fentropy":
-            csv_data.sort_values(by="SpectEntNorm", ascending=False, inplace=True)
-        elif options.result == "ientropy":
-            csv_data.sort_values(by="SpatEntNorm", ascending=False, inplace=True)
-        elif options.result == "icv":
-            csv_data.sort_values(by="SpatEntNorm", ascending=False, inplace=True)
-        elif options.result == "fstd":
-            csv_data.sort_values(by="SpectSTDNorm", ascending=False, inplace=True)
-        elif options.result == "fkurtosis":
-            csv_data.sort_values(by="KurtosisNorm", ascending=False, inplace=True)
-        elif options.result == "fpw":
-            csv_data.sort_values(by="SpectHighPowerNorm", ascending=False, inplace=True)
-        elif options.result == "fmean":
-            csv_data.sort_values(by="SpectHighPowerNorm", ascending=False, inplace=True)
-        elif options.result == "meanbin":
-            csv_data.sort_values(by="MeanBinNorm", ascending=False, inplace=True)
-        else:
-            print("Unknown results sorting method %s" % options.result)
-            sys.exit()
+        # With multi-channel results the ranking is based on the --rgb-channel,
+        # if it was analyzed, or otherwise on the first analyzed channel.
+        suffixes = analysis.get_channel_suffixes(csv_data)
+        suffix = analysis.get_channel_suffix(options.rgb_channel)
+        if suffix not in suffixes:
+            suffix = suffixes[0]
+        analysis.sort_by_result(csv_data, options.result, suffix)
 
         best_pics = csv_data["Filename"].head(options.npics).values
         worst_pics = csv_data["Filename"].tail(options.npics).values
-        utils.show_pics_from_disk(best_pics, title="BEST PICS")
-        utils.show_pics_from_disk(worst_pics, title="WORST PICS")
+        # The collages are made of cached thumbnails, unless the cache has
+        # been disabled
+        cache = None if options.report else thumbnails.get_cache(options)
+        utils.show_pics_from_disk(best_pics, title="BEST PICS", size=options.thumbnail_size,
+                                  cache=cache)
+        utils.show_pics_from_disk(worst_pics, title="WORST PICS", size=options.thumbnail_size,
+                                  cache=cache)
+        if cache is not None:
+            cache.close()
 
         csv_data.to_csv(file_path, index=False)
 
+    if options.report:
+        print("The report was saved to %s" % report.stop())
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
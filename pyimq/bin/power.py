@@ -7,24 +7,203 @@ Author: Sami Koho (sami.koho@gmail.com)
 Description:
 
 A utility script for extracting 1D power spectra of all images within
-a defined input directory. The spectra are saved in a single csv
-file, each column denoting a single image.
+a defined input directory. The spectra can be saved in a single csv
+file, each column denoting a single image, or in a binary (images x
+frequencies) matrix in Numpy .npy or HDF5 format. The binary matrix is
+preallocated and every spectrum is written into it as soon as it has
+been calculated, so that the memory usage does not depend on the
+number of images. The file names that correspond to the matrix rows
+are saved in a separate index file.
+
+The spectra can be calculated in several parallel processes with the
+--workers option.
+
+With --summary the running mean, variance and quantiles of every
+frequency over the whole dataset are saved as well (see the summary
+module). With --output-format none only the summary is saved, and the
+individual spectra are not stored at all; the workers then accumulate
+summaries of their own, which are merged at the end.
 """
 import sys
 import os
+import csv
 import datetime
-import pandas
+import multiprocessing
 import numpy
 
-from .. import script_options, myimage, filters
+from .. import script_options, myimage, filters, summary, kernels
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def calculate_spectrum(path, options):
+    """
+    Calculate the 1D (summed) power spectrum of an image, after cropping and
+    resizing it to options.image_size.
+
+    :param path:    Path to an image
+    :param options: Command line options
+    :return:        The power spectrum as a Numpy array
+    """
+    if options.imagej:
+        image = myimage.MyImage.get_image_from_imagej_tiff(path, rescale=options.rescale)
+    else:
+        image = myimage.MyImage.get_generic_image(
+            path,
+            channel=options.rgb_channel,
+            decoder=options.decoder,
+            draft=options.jpeg_draft,
+            rescale=options.rescale
+        )
+    return calculate_image_spectrum(image, options)
+
+
+def calculate_image_spectrum(image, options):
+    """
+    Calculate the 1D (summed) power spectrum of a MyImage object, after
+    cropping and resizing it to options.image_size.
+    """
+    # Only grayscale images are processed. If the input is an RGB image,
+    # a channel can be chosen for processing.
+    if image.is_rgb():
+        image = image.get_channel(options.rgb_channel)
+
+    image.crop_to_rectangle()
+    for dim in image.get_dimensions():
+        if dim != options.image_size:
+            image.resize((options.image_size, options.image_size), options.resize_method)
+            break
+
+    task = filters.FrequencyQuality(image, options)
+    task.calculate_power_spectrum()
+    task.calculate_summed_power()
+
+    return task.get_power_spectrum()[1]
+
+
+_worker_options = None
+
+
+def _initialize_worker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _calculate_indexed_spectrum(item):
+    index, path = item
+    return index, calculate_spectrum(path, _worker_options)
+
+
+def calculate_spectra(image_paths, options):
+    """
+    A generator that calculates the power spectra of a list of images,
+    possibly in several processes. The spectra are not necessarily
+    returned in the order of the paths.
+
+    :return:    A generator of (index, spectrum) tuples
+    """
+    if options.workers > 1:
+        pool = multiprocessing.Pool(
+            options.workers, initializer=_initialize_worker, initargs=(options,))
+        try:
+            for result in pool.imap_unordered(
+                    _calculate_indexed_spectrum, enumerate(image_paths), chunksize=4):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        images = myimage.load_images(image_paths, options)
+        for index, (path, image) in enumerate(images):
+            yield index, calculate_image_spectrum(image, options)
+
+
+def get_frequency_names(length):
+    """
+    The names of the frequency columns of a summary, same as in the csv file
+    """
+    return ["%g" % frequency for frequency in numpy.linspace(0, 1, num=length)]
+
+
+def create_summary(length, options):
+    return summary.Summary(get_frequency_names(length), options.summary_accuracy)
+
+
+def _summarize_chunk(paths):
+    length = _worker_options.image_size - _worker_options.image_size // 2
+    result = create_summary(length, _worker_options)
+    for path in paths:
+        result.add(calculate_spectrum(path, _worker_options))
+    result.flush()
+    return result
+
+
+def summarize_spectra(image_paths, length, options):
+    """
+    Calculate the summary of the power spectra of a list of images, without
+    storing the spectra. With several workers every worker summarizes a
+    chunk of the images at a time, and the summaries are merged.
+
+    :return:    A summary.Summary
+    """
+    result = create_summary(length, options)
+    if options.workers > 1:
+        size = max(1, len(image_paths) // (4 * options.workers))
+        chunks = [image_paths[i:i + size] for i in range(0, len(image_paths), size)]
+        pool = multiprocessing.Pool(
+            options.workers, initializer=_initialize_worker, initargs=(options,))
+        try:
+            for chunk_summary in pool.imap_unordered(_summarize_chunk, chunks):
+                result.merge(chunk_summary)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for path, image in myimage.load_images(image_paths, options):
+            result.add(calculate_image_spectrum(image, options))
+    return result
+
+
+def create_output_matrix(file_path, shape, output_format):
+    """
+    Create a preallocated output matrix on disk.
+
+    :return:    A tuple of the matrix and an object that needs to be closed
+                at the end, or None.
+    """
+    if output_format == "hdf5":
+        assert h5py is not None, "The HDF5 output format requires h5py"
+        output_file = h5py.File(file_path, "w")
+        matrix = output_file.create_dataset("power_spectra", shape=shape, dtype="f8")
+        return matrix, output_file
+    else:
+        matrix = numpy.lib.format.open_memmap(file_path, mode="w+", dtype="f8", shape=shape)
+        return matrix, None
+
+
+def write_csv(file_path, matrix, image_paths):
+    """
+    Write the spectra into a csv file, each column denoting a single
+    image. The file is written one frequency (row) at a time.
+    """
+    with open(file_path, "wt") as output_file:
+        output_writer = csv.writer(output_file, delimiter=",")
+        output_writer.writerow(["Power"] + [os.path.basename(path) for path in image_paths])
+        frequencies = numpy.linspace(0, 1, num=matrix.shape[1])
+        for i, frequency in enumerate(frequencies):
+            output_writer.writerow([frequency] + matrix[:, i].tolist())
+
 
 def main():
     options = script_options.get_power_script_options(sys.argv[1:])
+    kernels.set_backend(options.kernels)
     path = options.working_directory
 
     assert os.path.isdir(path)
 
-
     # Create output directory
     output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
     output_dir = os.path.join(options.working_directory, output_dir)
@@ -33,41 +212,58 @@ def main():
 
     # Create output file
     date_now = datetime.datetime.now().strftime("%H-%M-%S")
-    file_name = date_now + '_PyIQ_power_spectra' + '.csv'
-    file_path = os.path.join(output_dir, file_name)
-
-    csv_data = pandas.DataFrame()
-
+    base_name = os.path.join(output_dir, date_now + '_PyIQ_power_spectra')
     # Scan through images
-    for image_in in os.listdir(path):
-        if not image_in.endswith((".jpg", ".tif", ".tiff", ".png")):
-            continue
-        path_in = os.path.join(path, image_in)
+    image_paths = sorted(os.path.join(path, image_in) for image_in in os.listdir(path)
+                         if image_in.endswith((".jpg", ".tif", ".tiff", ".png")))
 
-        # Get image
-        image = myimage.MyImage.get_generic_image(path_in)
+    # The length of the summed power spectrum of a square image
+    length = options.image_size - options.image_size // 2
 
-        # Only grayscale images are processed. If the input is an RGB image,
-        # a channel can be chosen for processing.
-        if image.is_rgb():
-            image = image.get_channel(options.rgb_channel)
+    if options.output_format == "none":
+        assert options.summary, "Nothing would be saved, use --summary with --output-format none"
+        spectra_summary = summarize_spectra(image_paths, length, options)
+        summary_path = summary.save_summary(
+            spectra_summary, base_name + "_summary", options.summary_quantiles)
+        print("The power spectrum summary was saved to %s" % summary_path)
+        return
 
-        image.crop_to_rectangle()
-        for dim in image.get_dimensions():
-            if dim != options.image_size:
-                image.resize((options.image_size, options.image_size))
-                break
+    extensions = {"csv": ".npy", "npy": ".npy", "hdf5": ".h5"}
+    matrix_path = base_name + extensions[options.output_format]
+    if options.output_format == "csv":
+        matrix_path = base_name + "_temp.npy"
 
-        task = filters.FrequencyQuality(image, options)
-        task.calculate_power_spectrum()
-        task.calculate_summed_power()
+    matrix, output_file = create_output_matrix(
+        matrix_path, (len(image_paths), length), options.output_format)
 
-        power_spectrum = task.get_power_spectrum()
+    spectra_summary = create_summary(length, options) if options.summary else None
+    for index, spectrum in calculate_spectra(image_paths, options):
+        matrix[index] = spectrum
+        if spectra_summary is not None:
+            spectra_summary.add(spectrum)
 
-        csv_data[image_in] = power_spectrum[1]
+    if spectra_summary is not None:
+        summary_path = summary.save_summary(
+            spectra_summary, base_name + "_summary", options.summary_quantiles)
+        print("The power spectrum summary was saved to %s" % summary_path)
 
-    csv_data.insert(0, "Power", numpy.linspace(0, 1, num=len(csv_data)))
-    csv_data.to_csv(file_path, index=False)
+    if options.output_format == "csv":
+        write_csv(base_name + ".csv", matrix, image_paths)
+        del matrix
+        os.remove(matrix_path)
+        print("The power spectra were saved to %s" % (base_name + ".csv"))
+    else:
+        # Save the file names that correspond to the matrix rows
+        with open(base_name + "_index.csv", "wt") as index_file:
+            index_writer = csv.writer(index_file, delimiter=",")
+            index_writer.writerow(["Index", "Filename"])
+            for index, image_path in enumerate(image_paths):
+                index_writer.writerow([index, image_path])
+        if output_file is not None:
+            output_file.close()
+        else:
+            matrix.flush()
+        print("The power spectra were saved to %s" % matrix_path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
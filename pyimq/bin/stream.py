@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- python -*-
+"""
+File: stream.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+
+A utility script for calculating a quality time series for the frames
+of a video or a time-lapse series. The frames are read one at a time
+from a multi-frame image (e.g. a TIFF stack), or from a directory of
+frame images, and analyzed with the StreamScorer (see pyimq/stream.py).
+The quality parameters of every frame are saved in a csv file, along
+with the information on whether the frame was analyzed, or skipped
+with the --stream-step option, and the processing time of the frame.
+"""
+import sys
+import os
+import csv
+import datetime
+
+import numpy
+
+from .. import script_options, decoders, discovery, stream, analysis, kernels
+
+
+def iterate_frames(path, options):
+    """
+    Iterate over the grayscale frames of a multi-frame image, or of a
+    directory of frame images.
+    """
+    if os.path.isdir(path):
+        files = discovery.scan_directory(path)[0]
+        names = sorted(name for name, size, mtime in files
+                       if options.file_filter is None or options.file_filter in name)
+        paths = (os.path.join(path, name) for name in names)
+        frames = (data for name, data in decoders.imap(
+            paths, workers=options.decode_workers, channel=options.rgb_channel,
+            decoder=options.decoder))
+    else:
+        frames = decoders.iterate_frames(path, channel=options.rgb_channel)
+
+    for frame in frames:
+        if frame.ndim == 3:
+            frame = frame[:, :, options.rgb_channel]
+        yield frame
+
+
+def main():
+    options = script_options.get_stream_script_options(sys.argv[1:])
+    kernels.set_backend(options.kernels)
+    path = options.file
+    if not os.path.isabs(path):
+        path = os.path.join(options.working_directory, path)
+    assert os.path.exists(path), "%s does not exist" % path
+
+    # Create output directory
+    output_dir = datetime.datetime.now().strftime("%Y-%m-%d")+'_PyIQ_output'
+    output_dir = os.path.join(options.working_directory, output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    date_now = datetime.datetime.now().strftime("%H-%M-%S")
+    name = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+    file_path = os.path.join(output_dir, date_now + '_' + name + '_PyIQ_stream.csv')
+
+    scorer = stream.StreamScorer(options)
+    latencies = []
+    scored = 0
+    with open(file_path, "wt") as output_file:
+        output_writer = csv.writer(output_file, delimiter=",")
+        output_writer.writerow(["Frame", "Scored", "Latency"] + analysis.quality_parameters)
+        for result in scorer.run(iterate_frames(path, options)):
+            output_writer.writerow([result.index, int(result.scored), result.latency] +
+                                   list(result.values))
+            latencies.append(result.latency)
+            scored += result.scored
+
+    latencies = numpy.array(latencies)
+    print("Analyzed %i of %i frames. Latency per frame: mean %.1f ms, max %.1f ms" % (
+        scored, latencies.size, 1000 * latencies.mean(), 1000 * latencies.max()))
+    print("The results were saved to %s" % file_path)
+
+if __name__ == "__main__":
+    main()
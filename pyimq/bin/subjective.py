@@ -12,6 +12,8 @@ displayed at a time, after which it is ranked on 1-5 scale, 5 being the
 best and 1 the worst. The script can be run multiple times to collect
 several ranking results in a single csv file. At every run the data
 is shuffled in order to not repeat the same image sequence twice.
+The images are shown as downsampled previews (--preview-size), that
+are kept in a persistent thumbnail cache between the sessions.
 """
 
 import sys
@@ -19,6 +21,7 @@ import os
 import pandas
 import matplotlib.pyplot as plt
 import pyimq.script_options as script_options
+import pyimq.thumbnails as thumbnails
 
 
 def main():
@@ -62,18 +65,25 @@ def main():
     print("Images are graded on a scale 1-5, where 1 denotes a very bad image " \
           "and 5 an excellent image")
 
+    # The images are shown as (cached) previews, which makes them open
+    # quickly, even if they are large and on a network drive.
+    cache = thumbnails.get_cache(options)
+
     for image_name in csv_data["Filename"]:
         real_path = os.path.join(path, image_name)
-        image = plt.imread(real_path)
+        if cache is not None:
+            image = cache.load(real_path, options.preview_size)
+        else:
+            image = thumbnails.load_thumbnail(real_path, options.preview_size)
 
         plt.imshow(image, cmap=plt.cm.hot, vmax=image.max(), vmin=image.min())
 
         success = False
         while not success:
-            input = raw_input("Give grade: ")
+            grade = input("Give grade: ")
 
-            if input.isdigit():
-                result = int(input)
+            if grade.isdigit():
+                result = int(grade)
             else:
                 print("Please give a numeric grade 1-5.")
                 continue
@@ -84,6 +94,9 @@ def main():
             else:
                 print("Please give a numeric grade 1-5.")
 
+    if cache is not None:
+        cache.close()
+
     csv_data[result_name] = results
     csv_data.to_csv(file_path, index=False)
 
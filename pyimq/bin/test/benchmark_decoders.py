@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_decoders.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for measuring the image decoding throughput of the
+available decoders, for every supported file format. If a directory is
+given as the first argument, the images in it are used. Otherwise a
+small synthetic test set is created into a temporary directory.
+
+The results are printed as a table that shows images/s and MB/s of
+decoded pixel data, for full decoding, single-channel decoding,
+JPEG draft decoding and parallel decoding.
+"""
+import sys
+import os
+import time
+import shutil
+import tempfile
+
+import numpy
+from PIL import Image
+
+from pyimq import decoders
+
+
+def create_test_set(path, size=2048, count=8):
+    """
+    Create a synthetic test set of RGB JPEG/PNG/TIFF images and 16-bit
+    grayscale TIFF images.
+    """
+    random = numpy.random.RandomState(1)
+    for i in range(count):
+        rgb = random.randint(0, 255, (size, size, 3)).astype(numpy.uint8)
+        gray = random.randint(0, 65535, (size, size)).astype(numpy.uint16)
+        for extension in ("jpg", "png", "tif"):
+            Image.fromarray(rgb).save(os.path.join(path, "rgb_%i.%s" % (i, extension)))
+        Image.fromarray(gray).save(os.path.join(path, "gray16_%i.tif" % i))
+
+
+def measure(paths, repeats=2, workers=1, **kwargs):
+    """
+    Decode all the images and return the throughput as (images/s, MB/s)
+    """
+    nbytes = 0
+    start = time.time()
+    for i in range(repeats):
+        for path, data in decoders.imap(paths, workers=workers, **kwargs):
+            nbytes += data.nbytes
+    elapsed = time.time() - start
+    return repeats * len(paths) / elapsed, nbytes / elapsed / 1.0e6
+
+
+def main():
+    temporary = None
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+        assert os.path.isdir(path), path
+    else:
+        temporary = path = tempfile.mkdtemp()
+        create_test_set(path)
+
+    workers = os.cpu_count() or 1
+
+    files = {}
+    for image_name in sorted(os.listdir(path)):
+        extension = os.path.splitext(image_name)[1].lower()
+        if extension in (".jpg", ".tif", ".tiff", ".png"):
+            files.setdefault(extension, []).append(os.path.join(path, image_name))
+
+    print("%-6s %-10s %-16s %10s %10s" % ("Format", "Decoder", "Settings", "Images/s", "MB/s"))
+    for extension, paths in sorted(files.items()):
+        settings = [("full", {}), ("channel 1", {"channel": 1})]
+        if extension == ".jpg":
+            settings += [("draft %i" % i, {"draft": i}) for i in (2, 4, 8)]
+        for name in decoders.get_decoder_names(paths[0]):
+            for label, kwargs in settings:
+                speed = measure(paths, decoder=name, **kwargs)
+                print("%-6s %-10s %-16s %10.1f %10.1f" % ((extension, name, label) + speed))
+            speed = measure(paths, workers=workers, decoder=name)
+            label = "%i threads" % workers
+            print("%-6s %-10s %-16s %10.1f %10.1f" % ((extension, name, label) + speed))
+
+    if temporary is not None:
+        shutil.rmtree(temporary)
+
+if __name__ == "__main__":
+    main()
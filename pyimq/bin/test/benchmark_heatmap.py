@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_heatmap.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for measuring the speed of the quality heatmaps. The
+sliding windows of a synthetic test image (or of an image given as the
+first argument) are analyzed with the batched heatmap engine and, as
+a reference, with separate filter objects for every window, as in the
+directory mode. The script prints the number of windows analyzed per
+second for a few window sizes, and the largest relative difference
+between the two methods.
+"""
+import sys
+import time
+
+import numpy
+
+from pyimq import script_options, heatmap, metrics
+from pyimq.myimage import MyImage
+from pyimq.bin.test.benchmark_resize import create_test_image
+
+
+def analyze_windows(data, graph, size, step):
+    """
+    The reference: every window is analyzed separately
+    """
+    windows = heatmap.get_windows(data, size, step)
+    results = numpy.empty(windows.shape[:2] + (len(graph.metrics),))
+    for row in range(windows.shape[0]):
+        for column in range(windows.shape[1]):
+            image = MyImage(windows[row, column].copy(), [1.0, 1.0])
+            results[row, column] = graph.evaluate(image)
+    return results
+
+
+def main():
+    options = script_options.get_quality_script_options([])
+    if len(sys.argv) > 1:
+        data = MyImage.get_generic_image(sys.argv[1], channel=options.rgb_channel)
+        if data.is_rgb():
+            data = data.get_channel(options.rgb_channel)
+        data = data.get_array()
+    else:
+        data = create_test_image(2048)
+    parameters = ["tEntropy", "tBrenner", "fSTD", "fEntropy", "fTh"]
+    graph = metrics.MetricGraph(parameters, options)
+
+    print("Image %s, parameters %s" % (str(data.shape), " ".join(parameters)))
+    print("%-8s %8s %15s %15s %9s %14s" % ("Window", "Windows", "Batched (1/s)",
+                                          "Filters (1/s)", "Speedup", "Max. rel. diff"))
+    for size in (64, 128, 256):
+        step = size // 2
+        quality_map = heatmap.QualityMap(options, size, step, parameters)
+        start = time.time()
+        maps = quality_map.calculate(data)
+        batched = time.time() - start
+
+        start = time.time()
+        reference = analyze_windows(data, graph, size, step)
+        separate = time.time() - start
+
+        count = reference.shape[0] * reference.shape[1]
+        values = numpy.dstack([maps[name] for name in graph.metrics])
+        difference = numpy.max(numpy.abs(values - reference) / numpy.abs(reference))
+        print("%-8i %8i %15.0f %15.0f %9.1f %14.1e" % (
+            size, count, count / batched, count / separate, separate / batched, difference))
+
+
+if __name__ == "__main__":
+    main()
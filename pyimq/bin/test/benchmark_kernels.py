@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_kernels.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for checking and measuring the numeric kernels of the
+kernels module. Every kernel is run with all the available backends,
+and its results are compared to the reference implementation: the
+radial average to radial_profile.azimuthalAverage, the accumulation
+search to utils.analyze_accumulation, the histogram to
+scipy.ndimage.histogram and the Brenner measure to a direct Numpy
+calculation. The script prints the best time of a few runs for every
+backend, and the largest relative difference to the reference.
+"""
+import time
+
+import numpy
+from scipy import ndimage, fftpack
+
+from pyimq import kernels, spectra, utils
+from pyimq.external import radial_profile
+from pyimq.bin.test.benchmark_resize import create_test_image
+
+
+def measure(function, repeats=3):
+    """
+    Returns the result and the best time of a few runs. The first call is
+    not timed, as it includes the JIT compilation.
+    """
+    result = function()
+    best = float("inf")
+    for i in range(repeats):
+        start = time.time()
+        function()
+        best = min(best, time.time() - start)
+    return result, best
+
+
+def difference(result, reference):
+    result = numpy.asarray(result, dtype=numpy.float64)
+    reference = numpy.asarray(reference, dtype=numpy.float64)
+    scale = numpy.maximum(numpy.abs(reference), numpy.finfo(numpy.float64).tiny)
+    return float(numpy.max(numpy.abs(result - reference) / scale))
+
+
+def reference_brenner(data):
+    data = data.astype(numpy.int64 if data.dtype.kind in "ui" else numpy.float64)
+    return (data[:, :-2] - data[:, 2:]) ** 2
+
+
+def get_cases():
+    image = create_test_image(2048)
+    power = numpy.abs(fftpack.fftshift(fftpack.fft2(image[:512, :512]))) ** 2
+    labels, nbins, bin_centers, counts = spectra.get_radial_bins(power.shape, 2)
+    tail = power.sum(axis=0)[256:]
+    random = numpy.random.RandomState(0).rand(5000)
+    uint8 = (image / image.max() * 255).astype(numpy.uint8)
+    uint16 = (image / image.max() * 65535).astype(numpy.uint16)
+    float32 = image.astype(numpy.float32)
+    mask = ndimage.uniform_filter(float32, 32) > numpy.median(float32)
+
+    def histogram_reference(data, mask=None):
+        values = data if mask is None else data[mask]
+        return ndimage.histogram(values, values.min(), values.max(), 50)
+
+    return [
+        ("radial average", "512x512",
+         lambda: kernels.radial_average(power, labels, nbins, counts),
+         lambda: radial_profile.azimuthalAverage(power, binsize=2)),
+        ("accumulation", "256 values",
+         lambda: kernels.accumulation_index(tail, .2),
+         lambda: utils.analyze_accumulation(tail, .2)),
+        ("accumulation", "5000 values",
+         lambda: kernels.accumulation_index(random, .2),
+         lambda: utils.analyze_accumulation(random, .2)),
+        ("histogram", "uint8",
+         lambda: kernels.histogram(uint8), lambda: histogram_reference(uint8)),
+        ("histogram", "uint16",
+         lambda: kernels.histogram(uint16), lambda: histogram_reference(uint16)),
+        ("histogram", "float32",
+         lambda: kernels.histogram(float32), lambda: histogram_reference(float32)),
+        ("histogram", "float32 mask",
+         lambda: kernels.histogram(float32, mask=mask),
+         lambda: histogram_reference(float32, mask)),
+        ("brenner", "uint16",
+         lambda: kernels.brenner(uint16), lambda: reference_brenner(uint16).sum()),
+        ("brenner", "float32",
+         lambda: kernels.brenner(float32), lambda: reference_brenner(float32).sum()),
+    ]
+
+
+def main():
+    backends = ["numpy"] + (["numba"] if kernels.is_numba_available() else [])
+    print("Backends: %s" % ", ".join(backends))
+    print("%-15s %-13s %11s" % ("Kernel", "Data", "Reference") +
+          "".join(" %11s %10s" % (backend, "Max. diff") for backend in backends))
+    for name, data, kernel, reference in get_cases():
+        expected, reference_time = measure(reference, repeats=1)
+        line = "%-15s %-13s %9.2fms" % (name, data, 1000 * reference_time)
+        for backend in backends:
+            kernels.set_backend(backend)
+            result, best = measure(kernel)
+            line += " %9.2fms %10.1e" % (1000 * best, difference(result, expected))
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_moments.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for measuring the spectral moments calculation. The 1D
+power spectra of the sliding windows of a synthetic test image are
+calculated with a SpectrumPlan, and the spectral moments measure is then
+calculated (1) one spectrum at a time, as it was originally done in
+filters.SpectralMoments, and (2) for the whole stack at once with
+spectra.calculate_spectral_moments(). The script prints the times and
+the largest relative difference between the methods.
+"""
+import time
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pyimq import spectra
+from pyimq.bin.test.benchmark_resize import create_test_image
+
+
+def reference_moments(power):
+    percent = power / (power.sum() / 100)
+    bin_index = numpy.arange(1, power.shape[0] + 1)
+    return (percent * numpy.log10(bin_index)).sum()
+
+
+def main():
+    size = 64
+    image = create_test_image(2048)
+    windows = sliding_window_view(image, (size, size))[::16, ::16].reshape(-1, size, size)
+    plan = spectra.SpectrumPlan((size, size), "radial")
+    power = plan.calculate(numpy.ascontiguousarray(windows, dtype=numpy.float64))
+
+    start = time.time()
+    reference = numpy.array([reference_moments(spectrum) for spectrum in power])
+    separate = time.time() - start
+
+    start = time.time()
+    results = spectra.calculate_spectral_moments(power)
+    batch = time.time() - start
+
+    difference = numpy.max(numpy.abs(results - reference) / numpy.abs(reference))
+    print("%i spectra of %i bins" % power.shape)
+    print("One at a time: %.2f ms" % (1000 * separate))
+    print("Batch:         %.2f ms" % (1000 * batch))
+    print("Speedup:       %.1f" % (separate / batch))
+    print("Max. rel. difference: %.1e" % difference)
+
+
+if __name__ == "__main__":
+    main()
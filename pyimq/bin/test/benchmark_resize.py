@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_resize.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for comparing the image resizing methods, both in terms
+of speed and in terms of their effect on the power spectrum based
+quality parameters. A series of increasingly blurred versions of a
+synthetic test image (or of an image given as the first argument) is
+downscaled with every method. For every method the script prints the
+average resizing time, the largest relative deviation of each quality
+parameter from the cubic interpolation reference, and the Spearman rank
+correlation of the parameters with the blur level.
+"""
+import sys
+import time
+
+import numpy
+from scipy import ndimage, stats
+
+from pyimq import script_options, resize
+from pyimq.myimage import MyImage
+from pyimq.filters import FrequencyQuality
+
+parameter_names = ["fMean", "fSTD", "fEntropy", "fTh", "fMaxPw", "Skew", "Kurtosis", "MeanBin"]
+
+
+def create_test_image(size=2048):
+    random = numpy.random.RandomState(1)
+    image = ndimage.gaussian_filter(random.rand(size, size), 2)
+    image += ndimage.gaussian_filter(random.rand(size, size), 20) * 5
+    return image
+
+
+def main():
+    options = script_options.get_power_script_options([])
+    if len(sys.argv) > 1:
+        original = MyImage.get_generic_image(sys.argv[1], channel=options.rgb_channel)
+        original.crop_to_rectangle()
+        original = original.get_array().astype(numpy.float64)
+    else:
+        original = create_test_image()
+    size = (original.shape[0] // 4, original.shape[1] // 4)
+    sigmas = numpy.arange(0, 6)
+    series = [ndimage.gaussian_filter(original, sigma) for sigma in sigmas]
+
+    results = {}
+    timings = {}
+    for method in resize.resize_methods:
+        parameters = []
+        start = time.time()
+        resized = [resize.resize(image, size, method) for image in series]
+        timings[method] = (time.time() - start) / len(series)
+        for image in resized:
+            task = FrequencyQuality(MyImage(image, [1, 1]), options)
+            parameters.append(task.analyze_power_spectrum())
+        results[method] = numpy.array(parameters)
+
+    reference = results["cubic"]
+    print("Resizing %s -> %s" % (str(original.shape), str(size)))
+    print("%-10s %10s  %s" % ("Method", "Time (ms)", "Max. relative deviation from cubic"))
+    print("%-10s %10s  %s" % ("", "", " ".join("%9s" % name for name in parameter_names)))
+    for method in resize.resize_methods:
+        deviation = numpy.abs(results[method] - reference).max(axis=0) / \
+            numpy.abs(reference).max(axis=0)
+        print("%-10s %10.1f  %s" % (method, 1000 * timings[method],
+                                    " ".join("%9.3f" % value for value in deviation)))
+
+    print("\nSpearman correlation of the parameters with the blur level")
+    for method in resize.resize_methods:
+        correlations = [stats.spearmanr(sigmas, results[method][:, i])[0]
+                        for i in range(len(parameter_names))]
+        print("%-10s %10s  %s" % (method, "", " ".join("%9.2f" % value for value in correlations)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   benchmark_sweep.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small utility for measuring the speed of the parameter sweep mode. A
+synthetic test image (or an image given as the first argument) is
+analyzed for a grid of --power-threshold, --spatial-threshold and
+--invert-mask settings, with the shared intermediate results of the
+sweep and, as a reference, with a full analysis for every setting. The
+script prints the time of both methods, and the largest relative
+difference between their results.
+"""
+import sys
+import time
+
+import numpy
+
+from pyimq import script_options, metrics, sweep
+from pyimq.myimage import MyImage
+from pyimq.bin.test.benchmark_resize import create_test_image
+
+
+def main():
+    options = script_options.get_quality_script_options([
+        "--use-mask",
+        "--sweep-power-thresholds", "0.2", "0.3", "0.4", "0.5", "0.6",
+        "--sweep-spatial-thresholds", "60", "70", "80", "90",
+        "--sweep-invert-mask"])
+    if len(sys.argv) > 1:
+        data = MyImage.get_generic_image(sys.argv[1], channel=options.rgb_channel)
+        if data.is_rgb():
+            data = data.get_channel(options.rgb_channel)
+        data = data.get_array()
+    else:
+        data = create_test_image(1024)
+    settings = sweep.get_settings(options)
+    graph = metrics.MetricGraph(metrics.parse_metrics(["all"]), options)
+
+    start = time.time()
+    results = numpy.array(graph.evaluate_sweep(MyImage(data, [1.0, 1.0]), settings))
+    shared = time.time() - start
+
+    start = time.time()
+    reference = []
+    for setting in settings:
+        for name, value in setting.items():
+            setattr(options, name, value)
+        reference.append(graph.evaluate(MyImage(data, [1.0, 1.0])))
+    reference = numpy.array(reference)
+    separate = time.time() - start
+
+    difference = numpy.max(numpy.abs(results - reference) / numpy.abs(reference))
+    print("Image %s, %i settings" % (str(data.shape), len(settings)))
+    print("Sweep:      %.2f s" % shared)
+    print("Separate:   %.2f s" % separate)
+    print("Speedup:    %.1f" % (separate / shared))
+    print("Max. rel. difference: %.1e" % difference)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_cascade_ranking.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the ranking of cascade results. The images that are accepted
+by the coarse measure have no values for the full quality parameters,
+but they must still be ranked above the fully analyzed images, and the
+rejected images below them. Run with pytest, or as a script.
+"""
+import numpy
+import pandas
+
+from pyimq import analysis
+from pyimq.cascade import Cascade
+
+
+def create_results(suffix=""):
+    nan = numpy.nan
+    return pandas.DataFrame({
+        "Filename": ["full_good", "accepted", "rejected", "full_bad", "accepted_best"],
+        "tEntropy" + suffix: [6.0, nan, nan, 4.0, nan],
+        "fSTD" + suffix: [2.0, nan, nan, 3.0, nan],
+        "cScore" + suffix: [0.5, 0.8, 0.1, 0.4, 0.9],
+        "Stage" + suffix: [Cascade.FULL, Cascade.ACCEPT, Cascade.REJECT, Cascade.FULL,
+                           Cascade.ACCEPT]
+    })
+
+
+def rank(csv_data, result="average", suffix=""):
+    analysis.calculate_normalized_parameters(csv_data, suffix)
+    analysis.sort_by_result(csv_data, result, suffix)
+    return list(csv_data["Filename"])
+
+
+def test_accepted_images_rank_first():
+    assert rank(create_results()) == [
+        "accepted_best", "accepted", "full_good", "full_bad", "rejected"]
+
+
+def test_channel_suffix():
+    ranking = rank(create_results("_c1"), "fstd", "_c1")
+    assert ranking[:2] == ["accepted_best", "accepted"]
+    assert ranking[-1] == "rejected"
+
+
+def test_without_cascade():
+    csv_data = create_results().drop(columns=["cScore", "Stage"]).dropna()
+    assert rank(csv_data) == ["full_good", "full_bad"]
+
+
+def main():
+    test_accepted_images_rank_first()
+    test_channel_suffix()
+    test_without_cascade()
+    print("All the cascade ranking checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_channel_selection.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the --channels option of the directory mode. Channels that
+an image does not have must not be scored: a grayscale image is skipped
+and recorded in the errors file, when other channels than the first one
+are requested, and the run stops with --fail-fast. Run with pytest, or
+as a script.
+"""
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy
+import pandas
+from PIL import Image
+
+
+def run_main(directory, *arguments):
+    subprocess.check_call(
+        [sys.executable, "-m", "pyimq.bin.main", "--working-directory", directory,
+         "--mode", "directory"] + list(arguments),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def get_output(directory, pattern):
+    [path] = glob.glob(os.path.join(directory, "*_PyIQ_output", pattern))
+    return pandas.read_csv(path)
+
+
+def run_checks(directory):
+    random = numpy.random.RandomState(0)
+    for i in range(2):
+        data = (random.rand(64, 64) * 255).astype(numpy.uint8)
+        Image.fromarray(data).save(os.path.join(directory, "gray_%i.png" % i))
+    data = (random.rand(64, 64, 3) * 255).astype(numpy.uint8)
+    Image.fromarray(data).save(os.path.join(directory, "color.png"))
+
+    run_main(directory, "--channels", "0", "2")
+    results = get_output(directory, "*_PyIQ_out.csv")
+    assert [os.path.basename(path) for path in results["Filename"]] == ["color.png"]
+    assert "tBrenner_c2" in results.columns
+    errors = get_output(directory, "*_PyIQ_errors.csv")
+    assert sorted(os.path.basename(path) for path in errors["Filename"]) == \
+        ["gray_0.png", "gray_1.png"]
+    assert set(errors["Stage"]) == {"channels"}
+    shutil.rmtree(glob.glob(os.path.join(directory, "*_PyIQ_output"))[0])
+
+    # The first channel of a grayscale image exists
+    run_main(directory, "--channels", "0")
+    assert len(get_output(directory, "*_PyIQ_out.csv")) == 3
+    shutil.rmtree(glob.glob(os.path.join(directory, "*_PyIQ_output"))[0])
+
+    try:
+        run_main(directory, "--channels", "0", "2", "--fail-fast")
+    except subprocess.CalledProcessError:
+        pass
+    else:
+        raise AssertionError("A missing channel should stop a --fail-fast run")
+
+
+def test_missing_channels(tmp_path):
+    run_checks(str(tmp_path))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_checks(directory)
+    finally:
+        shutil.rmtree(directory)
+    print("All the channel selection checks passed")
+
+
+if __name__ == "__main__":
+    main()
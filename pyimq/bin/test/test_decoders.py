@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_decoders.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the page and channel selection of the image decoders. The
+first page of a multi-page grayscale TIFF is analyzed by default, also
+when --rgb-channel is set; the pages are only treated as channels with
+the --channels option. Every check is run with all the available
+decoders. A missing page is reported with a clear error. Run with
+pytest, or as a script.
+"""
+import os
+import shutil
+import tempfile
+
+import numpy
+from PIL import Image
+
+from pyimq import decoders, myimage, script_options
+
+
+def create_images(directory):
+    """
+    Save a three page grayscale TIFF and an RGB PNG image, whose pages and
+    channels have different constant values.
+    """
+    pages = [Image.fromarray(numpy.full((16, 20), 10 * (page + 1), dtype=numpy.uint8))
+             for page in range(3)]
+    stack = os.path.join(directory, "stack.tif")
+    pages[0].save(stack, save_all=True, append_images=pages[1:])
+    rgb = numpy.zeros((16, 20, 3), dtype=numpy.uint8)
+    rgb[:] = [1, 2, 3]
+    color = os.path.join(directory, "color.png")
+    Image.fromarray(rgb).save(color)
+    return stack, color
+
+
+def run_checks(directory):
+    stack, color = create_images(directory)
+    for name in decoders.get_decoder_names(stack):
+        # The first page, regardless of the channel
+        for channel in (None, 0, 1, 2):
+            data = decoders.decode(stack, channel=channel, decoder=name)
+            assert data.shape == (16, 20), name
+            assert (data == 10).all(), name
+        # The pages as channels
+        data = decoders.decode(stack, decoder=name, page_channels=True)
+        assert data.shape == (16, 20, 3), name
+        assert list(data[0, 0]) == [10, 20, 30], name
+        data = decoders.decode(stack, channel=1, decoder=name, page_channels=True)
+        assert (data == 20).all(), name
+        # A page past the end is reported with the file and the page count
+        try:
+            decoders.decode(stack, channel=3, decoder=name, page_channels=True)
+        except ValueError as error:
+            assert "stack.tif has 3 pages" in str(error), (name, error)
+        else:
+            raise AssertionError("Decoding a missing page should fail (%s)" % name)
+
+    for channel in (0, 1, 2):
+        assert (decoders.decode(color, channel=channel) == channel + 1).all()
+    assert decoders.decode(color).shape == (16, 20, 3)
+
+    # The batch mode loader, with the default --rgb-channel 1
+    options = script_options.get_quality_script_options([])
+    [(path, image)] = list(myimage.load_images([stack], options))
+    assert (image.get_array() == 10).all()
+    options = script_options.get_quality_script_options(["--channels", "all"])
+    [(path, image)] = list(myimage.load_images([stack], options))
+    assert image.get_channel_count() == 3
+
+
+def test_page_and_channel_selection(tmp_path):
+    run_checks(str(tmp_path))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_checks(directory)
+    finally:
+        shutil.rmtree(directory)
+    print("All the decoder checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_file_index.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the change detection of the persistent file index. After a
+run, only new images, and images that were modified (also in place,
+without changing the directory modification time) are scheduled for
+analysis. Run with pytest, or as a script.
+"""
+import os
+import shutil
+import tempfile
+
+from pyimq import discovery, script_options
+
+
+def write(path, content):
+    with open(path, "wb") as image_file:
+        image_file.write(content)
+
+
+def get_unscored(root, options):
+    index = discovery.FileIndex(os.path.join(root, "index.db"), root)
+    try:
+        images = discovery.find_images(root, options, index)
+        unscored = [path for path in images if not index.is_scored(path)]
+        for path in images:
+            index.mark_scored(path)
+        return sorted(os.path.basename(path) for path in unscored)
+    finally:
+        index.close()
+
+
+def run_checks(root):
+    options = script_options.get_quality_script_options(["--recursive"])
+    os.makedirs(os.path.join(root, "sub"))
+    for name in ("a.tif", "b.tif", os.path.join("sub", "c.tif")):
+        write(os.path.join(root, name), b"image")
+
+    assert get_unscored(root, options) == ["a.tif", "b.tif", "c.tif"]
+    assert get_unscored(root, options) == []
+
+    # A file that is rewritten in place keeps the directory modification
+    # time, which is restored here to be sure
+    directory_stat = os.stat(os.path.join(root, "sub"))
+    write(os.path.join(root, "sub", "c.tif"), b"modified image")
+    os.utime(os.path.join(root, "sub"),
+             ns=(directory_stat.st_atime_ns, directory_stat.st_mtime_ns))
+    assert get_unscored(root, options) == ["c.tif"]
+
+    # A touched file, with the same size
+    stat = os.stat(os.path.join(root, "a.tif"))
+    os.utime(os.path.join(root, "a.tif"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert get_unscored(root, options) == ["a.tif"]
+
+    # A new file
+    write(os.path.join(root, "d.tif"), b"image")
+    assert get_unscored(root, options) == ["d.tif"]
+    assert get_unscored(root, options) == []
+
+
+def test_change_detection(tmp_path):
+    run_checks(str(tmp_path))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_checks(directory)
+    finally:
+        shutil.rmtree(directory)
+    print("All the file index checks passed")
+
+
+if __name__ == "__main__":
+    main()
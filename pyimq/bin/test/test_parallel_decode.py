@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_parallel_decode.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for decoding images in worker processes (decoders.imap with
+processes). A worker that dies in the middle of an image, or that gets
+stuck in code that the time limit can not interrupt, must not stop the
+run: the image is returned with the error, and the rest of the images
+are decoded in a new pool. Run with pytest, or as a script.
+"""
+import os
+import signal
+import time
+
+import numpy
+
+from pyimq import decoders, faults
+
+
+def fake_decode(path):
+    """
+    A decoding target, that crashes on "crash" and hangs on "hang".
+    """
+    if path == "crash":
+        os.kill(os.getpid(), signal.SIGKILL)
+    if path == "hang":
+        # A signal handler would not be called, as in a long C function
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+        with faults.time_limit(0.5):
+            time.sleep(60)
+    return numpy.full((4, 4), len(path))
+
+
+def test_failed_workers():
+    paths = ["a", "crash", "bb", "ccc", "hang", "dddd", "eeeee", "crash", "ffffff"]
+    start = time.time()
+    results = list(decoders.imap(paths, workers=2, target=fake_decode, processes=True,
+                                 process_timeout=1))
+    assert time.time() - start < 30
+    assert [path for path, data in results] == paths
+    for path, data in results:
+        if path == "crash":
+            assert isinstance(data, RuntimeError)
+        elif path == "hang":
+            assert isinstance(data, faults.ImageTimeout)
+        else:
+            assert (data == len(path)).all()
+
+
+def main():
+    test_failed_workers()
+    print("All the parallel decoding checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_shard_merge.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for merging the results and the dataset summaries of a sharded
+directory mode run. A small synthetic dataset is analyzed in two shards
+with --summary, next to the stale output of an earlier run with three
+shards. The merge mode must only use the summaries of the selected
+shards, and must not write anything if a summary is missing. Run with
+pytest, or as a script.
+"""
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy
+import pandas
+from PIL import Image
+
+from pyimq import sharding, summary
+
+
+def run_main(directory, *arguments):
+    subprocess.check_call(
+        [sys.executable, "-m", "pyimq.bin.main", "--working-directory", directory] +
+        list(arguments), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def create_images(directory, count=12):
+    random = numpy.random.RandomState(0)
+    for i in range(count):
+        data = (random.rand(64, 64) * 255).astype(numpy.uint8)
+        Image.fromarray(data).save(os.path.join(directory, "image_%i.png" % i))
+
+
+def get_outputs(directory, pattern):
+    return glob.glob(os.path.join(directory, "*_PyIQ_output", pattern))
+
+
+def run_checks(directory):
+    create_images(directory)
+    for shard in ("0/3", "1/3", "2/3", "0/2", "1/2"):
+        run_main(directory, "--mode", "directory", "--summary", "--shard", shard)
+
+    shard_pattern = os.path.join("*_PyIQ_output", "*_PyIQ_out_shard-*-of-002.csv")
+    shard_files = sharding.find_shard_files(os.path.join(directory, shard_pattern))
+    summary_files = sharding.find_summary_files(shard_files)
+    # A shard without any images has no summary
+    expected = ["_PyIQ_summary_shard-%03i-of-002.npz" % i for i, path in enumerate(shard_files)
+                if sharding.has_results(path)]
+    assert [os.path.basename(path)[8:] for path in summary_files] == expected
+
+    run_main(directory, "--mode", "merge", "--file", shard_pattern)
+    [merged] = get_outputs(directory, "*_PyIQ_merged_out.csv")
+    [merged_summary] = get_outputs(directory, "*_PyIQ_merged_summary.npz")
+    assert len(pandas.read_csv(merged)) == 12
+    assert summary.Summary.load(merged_summary).get_count().tolist() == [12] * 11
+
+    # A missing summary stops the merge before anything is written
+    for path in get_outputs(directory, "*_PyIQ_merged_*"):
+        os.remove(path)
+    os.remove(summary_files[-1])
+    try:
+        run_main(directory, "--mode", "merge", "--file", shard_pattern)
+    except subprocess.CalledProcessError:
+        pass
+    else:
+        raise AssertionError("The merge should fail without all the shard summaries")
+    assert get_outputs(directory, "*_PyIQ_merged_*") == []
+
+
+def test_shard_and_summary_merge(tmp_path):
+    run_checks(str(tmp_path))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_checks(directory)
+    finally:
+        shutil.rmtree(directory)
+    print("All the shard merge checks passed")
+
+
+if __name__ == "__main__":
+    main()
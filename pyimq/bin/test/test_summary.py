@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_summary.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the streaming dataset summaries. The quantile estimates must
+be within the observed range of every column, also when the values are
+clustered inside a single sketch bucket, and empty columns must not get
+estimates. Run with pytest, or as a script.
+"""
+import numpy
+
+from pyimq import summary
+
+
+def test_quantiles_within_range():
+    values = 2.6238e11 + numpy.arange(50.0)
+    data = numpy.column_stack([values, -values, numpy.full(50, numpy.nan)])
+    results = summary.Summary(["Large", "Negative", "Empty"])
+    for row in data:
+        results.add(row)
+    table = results.to_frame()
+    quantiles = [name for name in table.columns if name.startswith("Q")]
+    for name in ("Large", "Negative"):
+        row = table.loc[name]
+        assert (row[quantiles] >= row["Min"]).all(), name
+        assert (row[quantiles] <= row["Max"]).all(), name
+        # The relative accuracy still holds
+        assert abs(row["Q50"] / numpy.median(data[:, 0 if name == "Large" else 1]) - 1) < 0.01
+    assert table.loc["Empty", quantiles].isna().all()
+
+
+def main():
+    test_quantiles_within_range()
+    print("All the summary checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- python -*-
+
+"""
+File:   test_thumbnail_key.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+Checks for the cache keys of the thumbnail cache. Uncompressed images of
+the same size often have identical headers and zero padded ends, so
+different files with the same beginning and end, and a file that is
+rewritten in place, must get different keys. Run with pytest, or as a
+script.
+"""
+import os
+import shutil
+import tempfile
+
+from pyimq import thumbnails
+
+
+def write_file(path, middle, mtime):
+    block = thumbnails.hash_block_size
+    with open(path, "wb") as output_file:
+        output_file.write(b"\0" * block + middle + b"\0" * block)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def run_checks(directory):
+    first = os.path.join(directory, "first.tif")
+    second = os.path.join(directory, "second.tif")
+    write_file(first, b"a" * 1000, 10 ** 18)
+    write_file(second, b"b" * 1000, 10 ** 18)
+    key = thumbnails.get_file_key(first)
+    assert key == thumbnails.get_file_key(first)
+    assert key != thumbnails.get_file_key(second)
+
+    # Rewritten in place, with the same size
+    write_file(first, b"c" * 1000, 10 ** 18 + 1)
+    assert key != thumbnails.get_file_key(first)
+
+
+def test_file_keys(tmp_path):
+    run_checks(str(tmp_path))
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_checks(directory)
+    finally:
+        shutil.rmtree(directory)
+    print("All the thumbnail key checks passed")
+
+
+if __name__ == "__main__":
+    main()
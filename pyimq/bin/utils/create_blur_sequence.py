@@ -9,7 +9,9 @@ dataset.
 
 import os
 import sys
-from scipy import ndimage, misc
+import numpy
+from scipy import ndimage
+from PIL import Image
 
 
 def main():
@@ -17,7 +19,7 @@ def main():
         print("Please specify a path to an image file")
         sys.exit(1)
 
-    original = misc.imread(sys.argv[1], mode='P')
+    original = numpy.array(Image.open(sys.argv[1]).convert("L"))
 
     path_parts = os.path.split(sys.argv[1])
     output_dir = os.path.join(path_parts[0], "Blurred")
@@ -34,7 +36,7 @@ def main():
         file_name = base_name + "_Gaussian_" + str(sigma) + "." + extension
         output_path = os.path.join(output_dir, file_name)
 
-        misc.imsave(output_path, blurred)
+        Image.fromarray(blurred).save(output_path)
 
 if __name__ == "__main__":
     main()
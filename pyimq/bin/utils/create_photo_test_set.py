@@ -9,9 +9,21 @@ dataset.
 
 import os
 import sys
-from scipy import ndimage, misc
+from scipy import ndimage
+from PIL import Image
 import numpy
 
+
+def save_image(path, data):
+    """
+    Save a grayscale image as 8-bit, with the intensities scaled to the
+    full range (like the removed scipy.misc.imsave did)
+    """
+    data_min, data_max = data.min(), data.max()
+    scale = 255.0 / (data_max - data_min) if data_max > data_min else 0.0
+    Image.fromarray(((data - data_min) * scale + 0.5).astype(numpy.uint8)).save(path)
+
+
 def main():
 
     # Check input parameters
@@ -31,24 +43,24 @@ def main():
         if not real_path.endswith((".jpg", ".tif", ".tiff", ".png")):
             continue
 
-        original = misc.imread(real_path, flatten=True)
+        original = numpy.array(Image.open(real_path).convert("F"))
         path_parts = os.path.split(real_path)
         extension = path_parts[1].split(".")[1]
         base_name = path_parts[1].split(".")[0]
 
         # Save original
         output_path = os.path.join(output_dir, image_name)
-        misc.imsave(output_path, original)
+        save_image(output_path, original)
 
         # Blur with Gaussian filter, Sigma=1
         file_name = base_name + "_gaussian_1." + extension
         output_path = os.path.join(output_dir, file_name)
-        misc.imsave(output_path, ndimage.gaussian_filter(original, 1))
+        save_image(output_path, ndimage.gaussian_filter(original, 1))
 
         # Blur with Gaussian filter, Sigma=2
         file_name = base_name + "_gaussian_2." + extension
         output_path = os.path.join(output_dir, file_name)
-        misc.imsave(output_path, ndimage.gaussian_filter(original, 2))
+        save_image(output_path, ndimage.gaussian_filter(original, 2))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- python -*-
+"""
+File: create_synthetic_dataset.py
+Author: Sami Koho (sami.koho@gmail.com)
+
+Description:
+
+A utility for generating synthetic microscopy datasets with a known
+focus ranking (see the synthetic module), for load testing and for
+checking the ranking accuracy of the quality parameters. Every field of
+view is saved at all the --blur-sigmas levels, and the ground truth
+table (synthetic_ground_truth.csv) is saved in the dataset directory.
+The images can be created in several parallel processes with the
+--workers option.
+
+The dataset can then be analyzed with the main program:
+
+    pyimq.main --mode directory --recursive --working-directory <dataset>
+
+and the ranking accuracy of the results checked with the --evaluate
+option, which prints the mean rank correlation of every quality
+parameter with the focus over all the fields.
+"""
+import sys
+import os
+import csv
+import time
+import multiprocessing
+
+import pandas
+
+from pyimq import script_options, synthetic
+
+ground_truth_name = "synthetic_ground_truth.csv"
+
+_worker_options = None
+
+
+def _initialize_worker(options):
+    global _worker_options
+    _worker_options = options
+
+
+def _create_field(item):
+    field, directory = item
+    return synthetic.create_field(field, directory, _worker_options)
+
+
+def create_fields(directory, options):
+    """
+    A generator that creates the fields of a dataset, possibly in several
+    processes. The fields are returned in order.
+
+    :return:    A generator of lists of ground truth rows
+    """
+    items = ((field, directory) for field in range(options.fields))
+    if options.workers > 1:
+        pool = multiprocessing.Pool(
+            options.workers, initializer=_initialize_worker, initargs=(options,))
+        try:
+            for rows in pool.imap(_create_field, items, chunksize=4):
+                yield rows
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for field, directory in items:
+            yield synthetic.create_field(field, directory, options)
+
+
+def evaluate(directory, options):
+    ground_truth = pandas.read_csv(os.path.join(directory, ground_truth_name))
+    results = pandas.read_csv(os.path.join(options.working_directory, options.evaluate))
+    correlations = synthetic.evaluate_ranking(ground_truth, results)
+    print("Rank correlation with the focus over %i fields:" % len(correlations))
+    for name, values in correlations.items():
+        print("%-12s mean %6.3f   min %6.3f" % (name, values.mean(), values.min()))
+
+
+def main():
+    options = script_options.get_synthetic_dataset_options(sys.argv[1:])
+    directory = os.path.join(options.working_directory, options.output_dir)
+
+    if options.evaluate is not None:
+        evaluate(directory, options)
+        return
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    total = options.fields * len(options.blur_sigmas)
+    start = time.time()
+    with open(os.path.join(directory, ground_truth_name), 'wt') as output_file:
+        output_writer = csv.writer(output_file, quoting=csv.QUOTE_NONNUMERIC, delimiter=",")
+        output_writer.writerow(synthetic.ground_truth_columns)
+        for field, rows in enumerate(create_fields(directory, options)):
+            output_writer.writerows(rows)
+            if (field + 1) % 100 == 0:
+                print("Created %i/%i images" % ((field + 1) * len(rows), total))
+
+    elapsed = time.time() - start
+    print("Created %i images in %.1f s (%.1f images/s)" % (total, elapsed, total / elapsed))
+    print("The ground truth was saved to %s" % os.path.join(directory, ground_truth_name))
+
+if __name__ == "__main__":
+    main()
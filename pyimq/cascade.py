@@ -0,0 +1,216 @@
+"""
+File:        cascade.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A coarse-to-fine early rejection cascade for out-of-focus screening.
+A cheap focus measure is first calculated from a decimated version of
+every image. Images that are clearly out-of-focus (or clearly in focus)
+are decided based on the coarse measure alone, whereas only the
+ambiguous ones are passed to the full (and much slower) image quality
+analysis with the FrequencyQuality and LocalImageQuality filters.
+
+The decision thresholds can be given on the command line, or they can
+be calibrated from a sample of the dataset, by selecting percentiles
+of the coarse measure distribution.
+"""
+
+import argparse
+import numpy
+from scipy import fftpack
+
+
+def get_options(parser):
+    """
+    Command-line options for the early rejection cascade
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Cascade", "Options for the coarse-to-fine early rejection cascade"
+    )
+    group.add_argument(
+        "--cascade",
+        help="Decide clearly good and clearly bad images with a cheap "
+             "coarse measure, and run the full analysis only on the rest",
+        action="store_true"
+    )
+    group.add_argument(
+        "--cascade-metric",
+        dest="cascade_metric",
+        choices=["brenner", "spectrum"],
+        default="brenner",
+        help="The coarse focus measure: Brenner gradient or the high frequency "
+             "power fraction of a low-resolution summed power spectrum"
+    )
+    group.add_argument(
+        "--cascade-decimate",
+        dest="cascade_decimate",
+        type=int,
+        default=4,
+        help="Decimation factor for the coarse measure"
+    )
+    group.add_argument(
+        "--cascade-reject",
+        dest="cascade_reject",
+        type=float,
+        default=None,
+        help="Images with a coarse measure below this value are rejected "
+             "without further analysis"
+    )
+    group.add_argument(
+        "--cascade-accept",
+        dest="cascade_accept",
+        type=float,
+        default=None,
+        help="Images with a coarse measure above this value are accepted "
+             "without further analysis"
+    )
+    group.add_argument(
+        "--cascade-calibrate",
+        dest="cascade_calibrate",
+        type=int,
+        default=0,
+        help="Calibrate the thresholds that were not given on the command "
+             "line from a sample of this many images"
+    )
+    group.add_argument(
+        "--cascade-percentiles",
+        dest="cascade_percentiles",
+        type=float,
+        nargs=2,
+        default=[20.0, 80.0],
+        help="The reject and accept percentiles used in calibration"
+    )
+    return parser
+
+
+def coarse_brenner(data, decimate=4):
+    """
+    The Brenner gradient, calculated at every decimate:th pixel. The value
+    is normalized by the number of pixels, so that it does not depend on
+    the image size.
+
+    :param data:        A 2D Numpy array
+    :param decimate:    Decimation factor
+    :return:            The mean squared difference of pixels two (decimated)
+                        steps apart
+    """
+    data = data[::decimate, ::decimate]
+    difference = data[:, :-2].astype(numpy.float64) - data[:, 2:]
+    return numpy.mean(difference ** 2)
+
+
+def coarse_spectrum(data, decimate=4, threshold=0.4):
+    """
+    The fraction of power at high frequencies, calculated from a summed 1D
+    power spectrum of a block-averaged image.
+
+    :param data:        A 2D Numpy array
+    :param decimate:    Block size for the averaging
+    :param threshold:   Relative frequency threshold for the spectrum tail
+    :return:            A number between 0 and 1
+    """
+    rows = data.shape[0] // decimate * decimate
+    columns = data.shape[1] // decimate * decimate
+    blocks = data[:rows, :columns].reshape(
+        rows // decimate, decimate, columns // decimate, decimate
+    ).mean(axis=(1, 3))
+    blocks -= blocks.mean()
+    power = numpy.abs(fftpack.fft2(blocks)) ** 2
+
+    spectrum = numpy.zeros(min(blocks.shape) // 2 + 1)
+    for axis in range(2):
+        summed = power.sum(axis=1 - axis)
+        half = summed.size // 2
+        folded = summed[:half + 1].copy()
+        folded[1:summed.size - half] += summed[::-1][:summed.size - half - 1]
+        spectrum += folded[:spectrum.size]
+
+    total = spectrum.sum()
+    if total == 0:
+        return 0.0
+    return spectrum[int(threshold * (spectrum.size - 1)):].sum() / total
+
+
+class Cascade(object):
+    """
+    Keeps track of the cascade decision thresholds and of the number of
+    images that were resolved at each stage.
+    """
+
+    REJECT = "coarse-reject"
+    ACCEPT = "coarse-accept"
+    FULL = "full"
+
+    def __init__(self, options):
+        self.options = options
+        self.reject = options.cascade_reject
+        self.accept = options.cascade_accept
+        self.counts = {Cascade.REJECT: 0, Cascade.ACCEPT: 0, Cascade.FULL: 0}
+
+    def coarse_score(self, image):
+        """
+        Calculate the coarse focus measure for a MyImage object
+        """
+        if self.options.cascade_metric == "spectrum":
+            return coarse_spectrum(image.get_array(),
+                                   self.options.cascade_decimate,
+                                   self.options.power_threshold)
+        else:
+            return coarse_brenner(image.get_array(), self.options.cascade_decimate)
+
+    def calibrate(self, scores):
+        """
+        Set the thresholds that were not defined on the command line,
+        based on the coarse measures of a sample of images.
+        """
+        assert len(scores) > 0, "Cannot calibrate the cascade without images"
+        low, high = numpy.percentile(scores, self.options.cascade_percentiles)
+        if self.reject is None:
+            self.reject = low
+        if self.accept is None:
+            self.accept = high
+        print("Cascade thresholds: reject < %e, accept > %e" % (self.reject, self.accept))
+
+    def classify(self, score):
+        """
+        Decide whether an image can be resolved based on the coarse measure,
+        without counting the decision.
+
+        :param score:   The coarse measure
+        :return:        One of Cascade.REJECT, Cascade.ACCEPT or Cascade.FULL
+        """
+        if self.reject is not None and score < self.reject:
+            return Cascade.REJECT
+        elif self.accept is not None and score > self.accept:
+            return Cascade.ACCEPT
+        return Cascade.FULL
+
+    def record(self, stage):
+        """
+        Count a decision, e.g. one that was made in a worker process.
+        """
+        self.counts[stage] += 1
+
+    def decide(self, score):
+        """
+        Decide whether an image can be resolved based on the coarse measure,
+        and count the decision.
+
+        :param score:   The coarse measure
+        :return:        One of Cascade.REJECT, Cascade.ACCEPT or Cascade.FULL
+        """
+        stage = self.classify(score)
+        self.record(stage)
+        return stage
+
+    def report(self):
+        """
+        Returns a summary of how many images were resolved at each stage.
+        """
+        total = sum(self.counts.values())
+        lines = ["Cascade summary for %i images:" % total]
+        for stage in (Cascade.REJECT, Cascade.ACCEPT, Cascade.FULL):
+            share = 100.0 * self.counts[stage] / total if total else 0.0
+            lines.append("  %-14s %8i (%.1f%%)" % (stage, self.counts[stage], share))
+        return "\n".join(lines)
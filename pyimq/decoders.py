@@ -0,0 +1,410 @@
+"""
+File:        decoders.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A small registry of image decoders for the PyImageQualityRanking
+software. Every decoder is a function that takes a path and returns
+a Numpy array. When several decoders are able to read a file, the
+one with the highest priority is used, which makes it possible to
+prefer fast optional backends (such as tifffile) when they are
+installed, while always falling back to PIL.
+
+Decoding of large datasets can additionally be run in a small thread
+pool with the imap() function. The image libraries release the GIL
+while decoding, so threads are enough to keep several files in flight.
+A time limit can not interrupt a decoder thread, so with time limits the
+images are decoded in worker processes instead. A worker process that
+dies (e.g. in a crash of a C decoder) or that does not return from a
+decoder within the time limit is replaced with a new one, and the image
+is returned with the error instead of an array.
+
+The paths can also be virtual paths to the members of zip and tar
+archives, and to the single frames of multi-frame images (see the
+archives module). The decoders then read the image from a memory
+buffer instead of a file.
+"""
+
+import os
+import collections
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from PIL import Image
+
+from pyimq import archives, faults
+
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+
+_registry = []
+
+
+def register_decoder(name, extensions=None, priority=0):
+    """
+    A decorator for adding a new decoder into the registry.
+
+    :param name:        Name of the decoder, used with the --decoder option
+    :param extensions:  A list of file extensions (e.g. [".tif"]) that the
+                        decoder can handle. None means that any file type
+                        is accepted.
+    :param priority:    Decoders with higher priority are preferred
+    """
+    def decorator(function):
+        _registry.append((priority, name, extensions, function))
+        _registry.sort(key=lambda item: -item[0])
+        return function
+    return decorator
+
+
+def get_decoder_names(path=None):
+    """
+    Returns the names of the registered decoders, in the order of
+    preference. If a path is given, only the decoders that are able to
+    read the file are listed.
+    """
+    extension = None if path is None else os.path.splitext(path)[1].lower()
+    return [name for priority, name, extensions, function in _registry
+            if extension is None or extensions is None or extension in extensions]
+
+
+def get_decoder(path, name="auto"):
+    """
+    Find a decoder for a file.
+
+    :param path:    Path to an image
+    :param name:    Name of a decoder, or "auto" to choose the fastest
+                    available one
+    :return:        A decoder function
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for priority, decoder_name, extensions, function in _registry:
+        if name != "auto" and name != decoder_name:
+            continue
+        if extensions is None or extension in extensions:
+            return function
+    raise ValueError("No decoder %s available for %s" % (name, path))
+
+
+def decode(path, channel=None, draft=1, decoder="auto", page_channels=False):
+    """
+    Decode an image into a Numpy array.
+
+    :param path:            Path to an image
+    :param channel:         If defined, only a single channel of a
+                            multi-channel image is returned. Depending on the
+                            decoder, the other channels may not be decoded
+                            at all.
+    :param draft:           A reduction factor (1, 2, 4 or 8) for JPEG images.
+                            With factors larger than 1 the JPEG image is
+                            decoded directly at a lower resolution, which is
+                            much faster. This is intended for quick preview
+                            scoring.
+    :param decoder:         Name of the decoder to use, "auto" by default.
+    :param page_channels:   If True, the pages of a multi-page grayscale image
+                            (such as an ImageJ hyperstack) are interpreted as
+                            channels (see the --channels option). Otherwise
+                            only the first page is decoded.
+    :return:                A Numpy array
+    """
+    container, frame = archives.split_frame(path)
+    if frame is not None:
+        return decode_frame(container, frame, channel=channel)
+    return get_decoder(path, decoder)(archives.open_source(path), channel=channel, draft=draft,
+                                      page_channels=page_channels)
+
+
+def decode_frame(path, index, channel=None):
+    """
+    Decode a single frame of a multi-frame image.
+
+    :param path:    Path to a multi-frame image
+    :param index:   Index of the frame
+    :param channel: The channel that is returned from multi-channel frames
+    :return:        A Numpy array
+    """
+    if tifffile is not None and os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        with tifffile.TiffFile(archives.open_source(path)) as tiff:
+            return _select_frame_channel(tiff.pages[index].asarray(), channel)
+
+    image = Image.open(archives.open_source(path))
+    image.seek(index)
+    return _select_pil_frame_channel(image, channel)
+
+
+def count_frames(path):
+    """
+    Returns the number of frames in a (multi-frame) image.
+    """
+    if tifffile is not None and os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        with tifffile.TiffFile(archives.open_source(path)) as tiff:
+            return len(tiff.pages)
+    with Image.open(archives.open_source(path)) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def _select_frame_channel(data, channel):
+    if channel is not None and data.ndim == 3:
+        return data[:, :, channel] if data.shape[-1] <= 4 else data[channel]
+    return data
+
+
+def _select_pil_frame_channel(image, channel):
+    # Palette frames (e.g. in GIF animations) are converted to RGB
+    frame = image.convert("RGB") if image.mode == "P" else image
+    if channel is not None and len(frame.getbands()) > 1:
+        return numpy.array(frame.getchannel(channel))
+    return numpy.array(frame)
+
+
+# A worker process that has not returned an image this long after the time
+# limit is considered stuck in a decoder, that the limit can not interrupt
+process_grace_time = 2.0
+
+_started = None
+
+
+def _initialize_process(started):
+    global _started
+    _started = started
+
+
+def _run_in_process(index, target, path, kwargs):
+    # The main process is told which worker runs which task, so that it
+    # can detect a worker that dies or gets stuck
+    _started.put((index, os.getpid()))
+    return target(path, **kwargs)
+
+
+class ProcessDecoderPool(object):
+    """
+    Decodes images in a pool of worker processes, in the submission order.
+    A worker that dies, or that exceeds the time limit, is not waited for:
+    the whole pool is replaced with a new one, and the images that were
+    still in progress are submitted again.
+    """
+
+    def __init__(self, workers, target, kwargs, timeout=0):
+        self.workers = workers
+        self.target = target
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.index = itertools.count()
+        self.pending = collections.deque()
+        self.start()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def start(self):
+        self.started = multiprocessing.SimpleQueue()
+        self.running = {}
+        self.pool = multiprocessing.Pool(self.workers, initializer=_initialize_process,
+                                         initargs=(self.started,))
+
+    def submit(self, path):
+        index = next(self.index)
+        result = self.pool.apply_async(_run_in_process, (index, self.target, path, self.kwargs))
+        self.pending.append((path, index, result))
+
+    def get_failure(self, index, result):
+        """
+        Wait for a result. Returns the error, if the worker process died or
+        exceeded the time limit, and None otherwise.
+        """
+        while not result.ready():
+            result.wait(0.1)
+            while not self.started.empty():
+                task, pid = self.started.get()
+                self.running[task] = pid, time.time()
+            if index not in self.running or result.ready():
+                continue
+            pid, started = self.running[index]
+            if pid not in [child.pid for child in multiprocessing.active_children()]:
+                # The result may still be on its way
+                result.wait(process_grace_time)
+                if result.ready():
+                    break
+                return RuntimeError("The decoder process died")
+            if 0 < self.timeout < time.time() - started - process_grace_time:
+                return faults.ImageTimeout("Timeout after %g s (the decoder did not return)"
+                                           % self.timeout)
+        self.running.pop(index, None)
+        return None
+
+    def get(self):
+        """
+        Returns the next (path, array) tuple, in the submission order.
+        """
+        path, index, result = self.pending.popleft()
+        failure = self.get_failure(index, result)
+        if failure is None:
+            return path, result.get()
+
+        self.pool.terminate()
+        self.start()
+        pending = self.pending
+        self.pending = collections.deque()
+        for item in pending:
+            if item[2].ready():
+                self.pending.append(item)
+            else:
+                self.submit(item[0])
+        return path, failure
+
+    def close(self):
+        # Workers that are stuck in a decoder are not waited for
+        self.pool.terminate()
+
+
+def imap(paths, workers=1, target=decode, processes=False, process_timeout=0, **kwargs):
+    """
+    Decode a sequence of images, possibly in parallel. The images are
+    returned in the same order as the paths. At most 2*workers images
+    are decoded ahead of the consumer.
+
+    :param paths:           An iterable of image paths
+    :param workers:         Number of decoder threads
+    :param target:          The decoding function, decode() by default
+    :param processes:       Decode in worker processes instead of threads (see
+                            ProcessDecoderPool). The decoded images are then
+                            copied to this process, but the decoding runs in
+                            the main thread of a worker, where it can be
+                            interrupted with a time limit (see
+                            faults.time_limit). The target must be picklable.
+                            An image whose worker dies, or does not return
+                            within process_timeout, is returned with the error
+                            (an exception) instead of an array.
+    :param process_timeout: The longest time (seconds) that the target may
+                            take in a worker process. 0 means no limit.
+    :param kwargs:          Keyword arguments for the decoding function
+    :return:                A generator of (path, array) tuples
+    """
+    if workers <= 1:
+        for path in paths:
+            yield path, target(path, **kwargs)
+        return
+
+    if processes:
+        pool = ProcessDecoderPool(workers, target, kwargs, process_timeout)
+        try:
+            for path in paths:
+                pool.submit(path)
+                if len(pool) >= 2 * workers:
+                    yield pool.get()
+            while len(pool) > 0:
+                yield pool.get()
+        finally:
+            pool.close()
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for path in paths:
+            pending.append((path, executor.submit(target, path, **kwargs)))
+            if len(pending) >= 2 * workers:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def iterate_frames(path, channel=None):
+    """
+    Iterate over the frames of a multi-frame image (such as a time-lapse
+    TIFF stack or an animated GIF) one at a time, without decoding the
+    whole stack into memory. The pages of a multi-page file are
+    interpreted as frames here, not as channels.
+
+    :param path:    Path to an image
+    :param channel: The channel that is returned from multi-channel frames.
+                    By default, all the channels are returned.
+    :return:        A generator of Numpy arrays
+    """
+    if tifffile is not None and os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+        with tifffile.TiffFile(archives.open_source(path)) as tiff:
+            for page in tiff.pages:
+                yield _select_frame_channel(page.asarray(), channel)
+        return
+
+    image = Image.open(archives.open_source(path))
+    for page in range(getattr(image, "n_frames", 1)):
+        image.seek(page)
+        yield _select_pil_frame_channel(image, channel)
+
+
+def _check_channel(path, channel, count, kind="channels"):
+    # An index past the last page or plane would otherwise fail with a bare
+    # IndexError, that does not tell which image and channel was the problem
+    if channel is not None and not 0 <= channel < count:
+        name = path if isinstance(path, str) else getattr(path, "name", "an archive member")
+        raise ValueError("Channel %i was requested, but %s has %i %s" %
+                         (channel, name, count, kind))
+
+
+@register_decoder("pil", priority=0)
+def decode_with_pil(path, channel=None, draft=1, page_channels=False):
+    """
+    The generic PIL based decoder. With page_channels multi-page single-band
+    images (such as ImageJ hyperstacks) are interpreted as multi-channel
+    images, the pages being the channels; otherwise the first page is
+    returned. The path can also be a file-like object.
+    """
+    image = Image.open(path)
+    if draft > 1 and image.format == "JPEG":
+        image.draft(image.mode, (image.size[0] // draft, image.size[1] // draft))
+
+    pages = getattr(image, "n_frames", 1)
+    bands = len(image.getbands())
+
+    if page_channels and pages > 1 and bands == 1:
+        if channel is not None:
+            _check_channel(path, channel, pages, "pages")
+            image.seek(channel)
+            return numpy.array(image)
+        frames = []
+        for page in range(pages):
+            image.seek(page)
+            frames.append(numpy.array(image))
+        return numpy.stack(frames, axis=-1)
+
+    if channel is not None and bands > 1:
+        image = image.getchannel(channel)
+    return numpy.array(image)
+
+
+if tifffile is not None:
+    @register_decoder("tifffile", extensions=(".tif", ".tiff"), priority=10)
+    def decode_with_tifffile(path, channel=None, draft=1, page_channels=False):
+        """
+        A decoder for TIFF files, based on the tifffile library. The library
+        is considerably faster than PIL with large 16-bit images. Channels
+        that are stored in separate pages (with page_channels) or in
+        separate planes are only decoded when needed. Without page_channels
+        only the first page of a multi-page grayscale file is decoded, as
+        with PIL.
+        """
+        with tifffile.TiffFile(path) as tiff:
+            pages = tiff.pages
+            if len(pages) > 1 and len(pages[0].shape) == 2:
+                if not page_channels:
+                    return pages[0].asarray()
+                if channel is not None:
+                    _check_channel(path, channel, len(pages), "pages")
+                    return pages[channel].asarray()
+            data = tiff.asarray()
+            interleaved = tiff.series[0].axes.endswith("S")
+
+        if data.ndim == 3:
+            _check_channel(path, channel, data.shape[-1] if interleaved else data.shape[0])
+            if interleaved:
+                return data if channel is None else numpy.ascontiguousarray(data[:, :, channel])
+            return numpy.moveaxis(data, 0, -1) if channel is None else data[channel]
+        return data
@@ -0,0 +1,343 @@
+"""
+File:        discovery.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Functions for finding the image files of a dataset. The images can be
+searched from a single directory, or recursively from a directory tree
+(such as the plate/well/field hierarchy of HCS exports). The files can
+be selected with include and exclude glob patterns, that are matched
+against the path relative to the working directory.
+
+Listing large directory trees on network storage can be slow. The
+optional FileIndex stores the directory modification times and the
+path, size, modification time and scored state of every image file in
+a SQLite database. On repeated runs the contents of the directories
+that have not changed are read from the index instead of listing them;
+only the sizes and modification times of the indexed files are checked,
+to find the files that were rewritten in place. Only the new or
+modified images are scheduled for analysis.
+
+Please note that SQLite file locking is not reliable on all network
+file systems: when running sharded analyses on several nodes, every
+shard should use its own index file.
+
+With the --archives option the images inside zip and tar archives are
+analyzed as well, without extracting them, and with the --frames option
+every frame of a multi-frame TIFF file is analyzed as a separate image.
+The members and frames are listed with virtual paths (see the archives
+module), that are filtered with the same patterns as regular files. The
+file index tracks only the regular files, so the contents of archives
+are always analyzed.
+"""
+
+import os
+import fnmatch
+import sqlite3
+import argparse
+
+from pyimq import archives, decoders
+
+
+image_extensions = (".jpg", ".tif", ".tiff", ".png")
+
+
+def get_options(parser):
+    """
+    Command-line options for dataset discovery
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "File discovery", "Options for finding the image files in batch mode"
+    )
+    group.add_argument(
+        "--recursive",
+        help="Search images also from the subdirectories of the working "
+             "directory",
+        action="store_true"
+    )
+    group.add_argument(
+        "--include",
+        help="Only analyze files whose path (relative to the working directory) "
+             "matches a glob pattern. Can be given several times.",
+        action="append",
+        default=None
+    )
+    group.add_argument(
+        "--exclude",
+        help="Skip files whose path (relative to the working directory) "
+             "matches a glob pattern. Can be given several times.",
+        action="append",
+        default=None
+    )
+    group.add_argument(
+        "--file-index",
+        dest="file_index",
+        help="Path to a persistent file index (SQLite database). With an index "
+             "only new or modified images are analyzed on repeated runs.",
+        default=None
+    )
+    group.add_argument(
+        "--rescan",
+        help="List all the directories again, even if their modification time "
+             "has not changed since the last run",
+        action="store_true"
+    )
+    group.add_argument(
+        "--archives",
+        help="Analyze also the images inside zip and tar archives, without "
+             "extracting them",
+        action="store_true"
+    )
+    group.add_argument(
+        "--frames",
+        help="Analyze every frame of a multi-frame TIFF file as a separate "
+             "image",
+        action="store_true"
+    )
+    return parser
+
+
+def to_relative(path, root):
+    """
+    Returns a path relative to root, with forward slashes.
+    """
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def is_selected(relative_path, options):
+    """
+    Check whether a file is selected by the --file-filter, --include and
+    --exclude options.
+
+    :param relative_path:   Path relative to the working directory
+    :param options:         Command line options
+    """
+    name = relative_path.rsplit("/", 1)[-1]
+    if options.file_filter is not None and options.file_filter not in name:
+        return False
+    if options.include and not any(fnmatch.fnmatch(relative_path, pattern)
+                                   for pattern in options.include):
+        return False
+    if options.exclude and any(fnmatch.fnmatch(relative_path, pattern)
+                               for pattern in options.exclude):
+        return False
+    return True
+
+
+def scan_directory(path):
+    """
+    List the image files (and the archives) and the subdirectories of a
+    directory.
+
+    :param path:        A directory
+    :return:            A tuple of a list of (name, size, mtime) tuples
+                        and a list of subdirectory names
+    """
+    files = []
+    subdirectories = []
+    for entry in os.scandir(path):
+        if entry.is_dir():
+            # The output directories never contain images
+            if not entry.name.endswith("_PyIQ_output"):
+                subdirectories.append(entry.name)
+        elif entry.is_file() and (entry.name.lower().endswith(image_extensions) or
+                                  archives.is_archive(entry.name)):
+            stat = entry.stat()
+            files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return files, subdirectories
+
+
+def find_images(root, options, index=None):
+    """
+    Find the image files in a directory (tree).
+
+    :param root:    The working directory
+    :param options: Command line options
+    :param index:   A FileIndex object, or None
+    :return:        A sorted list of image paths
+    """
+    images = []
+    directories = [root]
+    while directories:
+        directory = directories.pop()
+        relative_directory = to_relative(directory, root)
+        mtime = os.stat(directory).st_mtime_ns
+
+        if index is not None and not options.rescan and \
+                index.is_unchanged(relative_directory, mtime):
+            files, subdirectories = index.get_directory(relative_directory)
+            # Files that are rewritten in place do not change the directory
+            # modification time, so the indexed files are checked one by one
+            files = index.update_files(relative_directory, directory, files)
+        else:
+            files, subdirectories = scan_directory(directory)
+            if index is not None:
+                index.update_directory(relative_directory, mtime, files, subdirectories)
+
+        for name, size, file_mtime in files:
+            path = os.path.join(directory, name)
+            if archives.is_archive(name):
+                # The members of an archive are selected separately
+                if options.archives:
+                    images.append(path)
+            elif is_selected(to_relative(path, root), options):
+                images.append(path)
+        if options.recursive:
+            directories.extend(os.path.join(directory, name) for name in subdirectories)
+
+    if index is not None:
+        index.commit()
+    images = sorted(images)
+    if options.archives or options.frames:
+        images = expand_containers(images, root, options)
+    return images
+
+
+def expand_containers(paths, root, options):
+    """
+    Replace the archives in a list of images with the virtual paths of their
+    image members, and with the --frames option the multi-frame images with
+    the virtual paths of their frames. The members are kept in the archive
+    order, which is the fastest order to read them.
+
+    :param paths:   A list of image and archive paths
+    :param root:    The working directory
+    :param options: Command line options
+    :return:        A list of image paths
+    """
+    images = []
+    for path in paths:
+        if not archives.is_archive(path):
+            images.append(path)
+            continue
+        for member in archives.list_members(path):
+            member_path = path + "/" + member
+            if member.lower().endswith(image_extensions) and \
+                    is_selected(to_relative(member_path, root), options):
+                images.append(member_path)
+    if not options.frames:
+        return images
+
+    frames = []
+    for path in images:
+        count = decoders.count_frames(path) if path.lower().endswith(archives.frame_extensions) else 1
+        if count > 1:
+            frames.extend(archives.get_frame_path(path, index) for index in range(count))
+        else:
+            frames.append(path)
+    return frames
+
+
+class FileIndex(object):
+    """
+    A persistent index of the image files in a dataset. The paths are
+    stored relative to the working directory, so that the index remains
+    valid if the dataset is mounted at a different location.
+    """
+
+    def __init__(self, path, root):
+        self.root = root
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS directories (
+                path TEXT PRIMARY KEY, mtime INTEGER, subdirectories TEXT);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, directory TEXT, name TEXT,
+                size INTEGER, mtime INTEGER, scored INTEGER DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+            """
+        )
+
+    def is_unchanged(self, directory, mtime):
+        """
+        Check whether a directory has been modified since it was indexed.
+        """
+        row = self.connection.execute(
+            "SELECT mtime FROM directories WHERE path = ?", (directory,)).fetchone()
+        return row is not None and row[0] == mtime
+
+    def get_directory(self, directory):
+        """
+        Returns the indexed contents of a directory, in the same format as
+        the scan_directory() function.
+        """
+        files = self.connection.execute(
+            "SELECT name, size, mtime FROM files WHERE directory = ?", (directory,)).fetchall()
+        row = self.connection.execute(
+            "SELECT subdirectories FROM directories WHERE path = ?", (directory,)).fetchone()
+        subdirectories = [name for name in row[0].split("/") if name]
+        return files, subdirectories
+
+    def update_directory(self, directory, mtime, files, subdirectories):
+        """
+        Update the index entries of a directory. The scored state of a file
+        is kept only if its size and modification time have not changed.
+        """
+        old = dict((row[0], row[1:]) for row in self.connection.execute(
+            "SELECT name, size, mtime, scored FROM files WHERE directory = ?", (directory,)))
+        rows = []
+        for name, size, file_mtime in files:
+            scored = 0
+            if name in old and old[name][:2] == (size, file_mtime):
+                scored = old[name][2]
+            rows.append((self.get_key(directory, name), directory, name, size, file_mtime, scored))
+
+        self.connection.execute("DELETE FROM files WHERE directory = ?", (directory,))
+        self.connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?)",
+            (directory, mtime, "/".join(subdirectories)))
+
+    def update_files(self, directory, path, files):
+        """
+        Compare the indexed files of an unchanged directory with the files on
+        disk. The entries of modified files are updated, and their scored
+        state is cleared. Checking the files is much faster than listing the
+        directory.
+
+        :param directory:   The directory, relative to the working directory
+        :param path:        The directory path
+        :param files:       The indexed files, see get_directory()
+        :return:            The files, with the current sizes and
+                            modification times
+        """
+        current = []
+        for name, size, file_mtime in files:
+            try:
+                stat = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, file_mtime):
+                self.connection.execute(
+                    "UPDATE files SET size = ?, mtime = ?, scored = 0 WHERE path = ?",
+                    (stat.st_size, stat.st_mtime_ns, self.get_key(directory, name)))
+            current.append((name, stat.st_size, stat.st_mtime_ns))
+        return current
+
+    @staticmethod
+    def get_key(directory, name):
+        return name if directory == "." else directory + "/" + name
+
+    def is_scored(self, path):
+        """
+        Check whether an image has been analyzed already.
+        """
+        row = self.connection.execute(
+            "SELECT scored FROM files WHERE path = ?", (to_relative(path, self.root),)).fetchone()
+        return row is not None and row[0] == 1
+
+    def mark_scored(self, path):
+        """
+        Mark an image as analyzed.
+        """
+        self.connection.execute(
+            "UPDATE files SET scored = 1 WHERE path = ?", (to_relative(path, self.root),))
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -0,0 +1,225 @@
+"""
+File:        entropy.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A histogram and Shannon entropy engine for the PyImageQuality software.
+The histograms are identical to the ones calculated with
+scipy.ndimage.histogram(data, data.min(), data.max(), bins), that was
+used earlier, but the fastest exact strategy is chosen according to
+the data type:
+
+-   Integer images (e.g. uint8 and uint16) are counted with
+    numpy.bincount on the raw pixel values, after which the integer
+    counts are re-binned into the final histogram bins.
+-   Other data types are binned with numpy.histogram, chunk by chunk.
+-   Stacks of small images (or 1D spectra) are binned all at once, by
+    calculating the bin indexes of all the values in a single pass.
+
+A mask can be given to restrict the calculation to a part of an image.
+The masked pixels are processed in chunks, so that the selected pixel
+values are never copied into a single large array. The batch functions
+calculate histograms/entropies for a stack of images at once.
+"""
+
+import numpy
+
+
+# Integer images with a larger value range are binned as floats
+max_integer_span = 1 << 22
+
+# Approximate number of pixels processed at a time
+chunk_size = 1 << 20
+
+# Images smaller than this are binned all at once in batch mode
+small_image_size = 1 << 14
+
+
+def get_min_max(data, mask=None, axis=None):
+    """
+    Returns the minimum and maximum values of the data, or of the masked
+    part of the data. If nothing is selected by the mask, an empty (0, 0)
+    range is returned.
+    """
+    if mask is None:
+        return data.min(axis=axis), data.max(axis=axis)
+    if numpy.issubdtype(data.dtype, numpy.integer):
+        info = numpy.iinfo(data.dtype)
+    else:
+        info = numpy.finfo(data.dtype)
+    minimum = numpy.min(data, axis=axis, where=mask, initial=info.max)
+    maximum = numpy.max(data, axis=axis, where=mask, initial=info.min)
+    empty = ~mask.any(axis=axis)
+    return numpy.where(empty, 0, minimum)[()], numpy.where(empty, 0, maximum)[()]
+
+
+def iterate_chunks(data, mask=None):
+    """
+    Iterate over the (masked) pixel values of an image in chunks of
+    approximately chunk_size pixels.
+    """
+    if data.ndim < 2:
+        yield data if mask is None else data[mask]
+        return
+    row_size = data[0].size
+    step = max(1, chunk_size // max(row_size, 1))
+    for start in range(0, data.shape[0], step):
+        block = data[start:start + step]
+        if mask is None:
+            yield block.ravel()
+        else:
+            yield block[mask[start:start + step]]
+
+
+def get_bin_indexes(values, edges):
+    """
+    Find the histogram bin of every value, with numpy.histogram semantics:
+    every bin is half-open, except the last one. All the values are
+    assumed to be within the edges.
+
+    :param values:  A 2D (images x values) array
+    :param edges:   A 2D (images x (bins + 1)) array of bin edges
+    :return:        An array of bin indexes, with the shape of the values
+    """
+    bins = edges.shape[1] - 1
+    first = edges[:, :1].astype(numpy.float64)
+    span = edges[:, -1:].astype(numpy.float64) - first
+    norm = numpy.divide(bins, span, out=numpy.zeros_like(span), where=span > 0)
+
+    indexes = ((values - first) * norm).astype(numpy.intp)
+    numpy.clip(indexes, 0, bins - 1, out=indexes)
+    # The division above may be off by one at the bin edges; the exact
+    # position is fixed by comparing to the edges, like numpy does.
+    indexes -= values < numpy.take_along_axis(edges, indexes, axis=1)
+    indexes += (values >= numpy.take_along_axis(edges, indexes + 1, axis=1)) & \
+        (indexes != bins - 1)
+    # All the values are in the last bin, if the minimum equals the maximum
+    indexes[numpy.broadcast_to(span == 0, indexes.shape)] = bins - 1
+    return indexes
+
+
+def integer_histogram(data, minimum, maximum, bins, mask=None):
+    """
+    Histogram of an integer image, based on counting the raw pixel values.
+    """
+    span = int(maximum) - int(minimum) + 1
+    counts = numpy.zeros(span, dtype=numpy.int64)
+    for values in iterate_chunks(data, mask):
+        if values.size > 0:
+            counts += numpy.bincount(values.astype(numpy.intp) - int(minimum), minlength=span)
+    return rebin_integer_counts(counts, minimum, maximum, bins)
+
+
+def rebin_integer_counts(counts, minimum, maximum, bins):
+    """
+    Re-bin the counts of every integer value between the minimum and the
+    maximum into the final histogram bins.
+    """
+    edges = numpy.linspace(minimum, maximum, bins + 1)
+    levels = numpy.arange(int(minimum), int(maximum) + 1)
+    indexes = numpy.searchsorted(edges, levels, side="right") - 1
+    numpy.clip(indexes, 0, bins - 1, out=indexes)
+    return numpy.bincount(indexes, weights=counts, minlength=bins).astype(numpy.int64)
+
+
+def uniform_histogram(data, minimum, maximum, bins, mask=None):
+    """
+    Histogram of an image of any data type, by direct binning.
+    """
+    edges = numpy.linspace(minimum, maximum, bins + 1)
+    histogram = numpy.zeros(bins, dtype=numpy.int64)
+    for values in iterate_chunks(data, mask):
+        histogram += numpy.histogram(values, edges)[0]
+    return histogram
+
+
+def calculate_histogram(data, bins=50, mask=None):
+    """
+    Calculate a histogram with equal width bins between the minimum and the
+    maximum value of the data.
+
+    :param data:    A Numpy array
+    :param bins:    Number of bins
+    :param mask:    An optional boolean array of the same shape as the data.
+                    Only the pixels where the mask is True are counted.
+    :return:        The histogram counts
+    """
+    if mask is not None:
+        mask = numpy.asarray(mask, dtype=bool)
+        if not mask.any():
+            return numpy.zeros(bins, dtype=numpy.int64)
+    minimum, maximum = get_min_max(data, mask)
+    if numpy.issubdtype(data.dtype, numpy.integer) and \
+            int(maximum) - int(minimum) < max_integer_span:
+        return integer_histogram(data, minimum, maximum, bins, mask)
+    return uniform_histogram(data, minimum, maximum, bins, mask)
+
+
+def histogram_entropy(histogram, axis=-1):
+    """
+    Calculate the Shannon entropy from histogram counts. Empty bins are
+    excluded.
+    """
+    histogram = numpy.asarray(histogram, dtype=numpy.float64)
+    total = histogram.sum(axis=axis, keepdims=True)
+    probabilities = numpy.divide(histogram, total, out=numpy.zeros_like(histogram),
+                                 where=total > 0)
+    logarithms = numpy.log2(probabilities, out=numpy.zeros_like(probabilities),
+                            where=probabilities > 0)
+    return -numpy.sum(probabilities * logarithms, axis=axis)
+
+
+def calculate_entropy(data, bins=50, mask=None):
+    """
+    Calculate the Shannon entropy of the data (or of a masked part of the
+    data), based on a histogram with equal width bins.
+    """
+    return histogram_entropy(calculate_histogram(data, bins, mask))
+
+
+def calculate_histogram_batch(stack, bins=50, masks=None):
+    """
+    Calculate the histograms of a stack of images at once. Every image is
+    binned between its own minimum and maximum values.
+
+    :param stack:   A Numpy array, the first dimension being the image index
+    :param bins:    Number of bins
+    :param masks:   An optional boolean array of the same shape as the stack
+    :return:        An (images x bins) array of histogram counts
+    """
+    count = stack.shape[0]
+    values = stack.reshape(count, -1)
+    # Large images are faster to process one at a time
+    if values.shape[1] >= small_image_size:
+        if masks is None:
+            return numpy.array([calculate_histogram(image, bins) for image in stack],
+                               dtype=numpy.int64).reshape(count, bins)
+        return numpy.array([calculate_histogram(image, bins, mask)
+                            for image, mask in zip(stack, masks)],
+                           dtype=numpy.int64).reshape(count, bins)
+
+    if masks is not None:
+        masks = numpy.asarray(masks, dtype=bool).reshape(count, -1)
+    minima, maxima = get_min_max(values, masks, axis=1)
+
+    histograms = numpy.zeros((count, bins), dtype=numpy.int64)
+    step = max(1, chunk_size // max(values.shape[1], 1))
+    for start in range(0, count, step):
+        stop = min(start + step, count)
+        edges = numpy.linspace(minima[start:stop], maxima[start:stop], bins + 1, axis=1)
+        indexes = get_bin_indexes(values[start:stop], edges)
+        indexes += bins * numpy.arange(stop - start)[:, numpy.newaxis]
+        if masks is not None:
+            indexes = indexes[masks[start:stop]]
+        histograms[start:stop] = numpy.bincount(
+            indexes.ravel(), minlength=(stop - start) * bins).reshape(stop - start, bins)
+    return histograms
+
+
+def calculate_entropy_batch(stack, bins=50, masks=None):
+    """
+    Calculate the Shannon entropies of a stack of images at once.
+
+    :return:    An array of entropy values, one per image
+    """
+    return histogram_entropy(calculate_histogram_batch(stack, bins, masks))
@@ -76,11 +76,11 @@ def azimuthalAverage(
     nbins_true = int(sampling_freq/binsize)
     bin_centers = bin_centers[0:nbins_true]
     if stddev:
-        radial_prof = np.array([image.flat[mask*(whichbin==b)].std() for b in xrange(1,nbins+1)])
+        radial_prof = np.array([image.flat[mask*(whichbin==b)].std() for b in range(1,nbins+1)])
     elif sum_bin:
-        radial_prof = np.array([((image*weights).flat[mask*(whichbin == b)].sum()) for b in xrange(1, nbins_true+1)])
+        radial_prof = np.array([((image*weights).flat[mask*(whichbin == b)].sum()) for b in range(1, nbins_true+1)])
     else:
-        radial_prof = np.array([((image*weights).flat[mask*(whichbin == b)].sum()) / (weights.flat[mask*(whichbin==b)].sum()) for b in xrange(1, nbins_true+1)])
+        radial_prof = np.array([((image*weights).flat[mask*(whichbin == b)].sum()) / (weights.flat[mask*(whichbin==b)].sum()) for b in range(1, nbins_true+1)])
 
     # if normalize:
         # radial_prof /= radial_prof.sum()
@@ -205,9 +205,9 @@ def radialAverage(image, center=None, stddev=False, returnAz=False, return_naz=F
     # recall that bins are from 1 to nbins (which is expressed in array terms by arange(nbins)+1 or xrange(1,nbins+1) )
     # azimuthal_prof.shape = bin_centers.shape
     if stddev:
-        azimuthal_prof = np.array([image.flat[mask*(whichbin==b)].std() for b in xrange(1,nbins+1)])
+        azimuthal_prof = np.array([image.flat[mask*(whichbin==b)].std() for b in range(1,nbins+1)])
     else:
-        azimuthal_prof = np.array([((image*weights).flat[mask*(whichbin==b)].sum()) / (weights.flat[mask*(whichbin==b)].sum()) for b in xrange(1,nbins+1)])
+        azimuthal_prof = np.array([((image*weights).flat[mask*(whichbin==b)].sum()) / (weights.flat[mask*(whichbin==b)].sum()) for b in range(1,nbins+1)])
 
     #import pdb; pdb.set_trace()
 
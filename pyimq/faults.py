@@ -0,0 +1,153 @@
+"""
+File:        faults.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Per-image fault isolation for the batch runs of the PyImageQuality
+software. A single truncated or otherwise broken file should not abort
+a run over thousands of images, and a pathological image should not
+make it hang. Every image is therefore decoded and scored in isolation:
+
+-   An image that can not be decoded or scored is retried a given number
+    of times, and then skipped.
+-   The decoding and the scoring of an image can be limited in time. In
+    the main process the limit is implemented with SIGALRM (on Unix),
+    which interrupts Python code, but not a single long running C
+    function. The limit does not work in threads, so parallel decoding
+    is then done in worker processes (see decoders.imap). Decoder worker
+    processes that die, or that do not return within the limit, are
+    replaced with new ones. Scoring worker
+    processes that exceed the limit are killed and restarted, see the
+    batch module.
+-   The skipped images are recorded, with the reason, in an errors file
+    next to the results file. The images are not marked as scored in the
+    file index, so they are retried in the next run.
+"""
+
+import argparse
+import contextlib
+import csv
+import os
+import signal
+import threading
+
+
+class ImageTimeout(Exception):
+    """
+    Raised when the processing of an image takes longer than the time limit
+    """
+    pass
+
+
+def get_options(parser):
+    """
+    Command-line options for the fault isolation
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Fault isolation", "Options for handling broken images in batch runs"
+    )
+    group.add_argument(
+        "--image-timeout",
+        dest="image_timeout",
+        type=float,
+        default=0,
+        help="Time limit for decoding and for scoring a single image (seconds). "
+             "0 means no limit. With --decode-workers the images are then "
+             "decoded in worker processes instead of threads, as the limit can "
+             "not interrupt a thread. In the main process the limit can not "
+             "interrupt a decoder that does not return to Python, and it only "
+             "works on Unix."
+    )
+    group.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="Number of times decoding or scoring an image is retried after "
+             "a failure, before the image is skipped"
+    )
+    group.add_argument(
+        "--fail-fast",
+        dest="fail_fast",
+        action="store_true",
+        help="Stop the run at the first broken image, instead of skipping it"
+    )
+    return parser
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    """
+    A context manager that raises ImageTimeout, if the block takes longer
+    than the given time. The limit only works in the main thread on Unix;
+    elsewhere, or with seconds <= 0, the block is not limited.
+    """
+    if seconds <= 0 or not hasattr(signal, "SIGALRM") or \
+            threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def handler(signum, frame):
+        raise ImageTimeout("Timeout after %g s" % seconds)
+
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def describe(error):
+    """
+    Returns a single line description of an exception, or of the last line
+    of a formatted traceback.
+    """
+    if isinstance(error, BaseException):
+        message = str(error).strip().splitlines()
+        return "%s: %s" % (type(error).__name__, message[-1] if message else "")
+    lines = [line for line in str(error).strip().splitlines() if line.strip()]
+    return lines[-1].strip() if lines else "Unknown error"
+
+
+class ErrorLog(object):
+    """
+    Records the skipped images into a CSV file. The file is only created
+    when the first error occurs.
+    """
+
+    header = ["Filename", "Stage", "Attempts", "Error"]
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.errors_file = None
+        self.writer = None
+
+    def add(self, filename, stage, attempts, error):
+        """
+        Record a skipped image.
+
+        :param filename:    Path to the image
+        :param stage:       Where the error happened, e.g. "decode" or "score"
+        :param attempts:    How many times the image was tried
+        :param error:       An exception or an error message
+        """
+        if self.writer is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.errors_file = open(self.path, "wt")
+            self.writer = csv.writer(self.errors_file, quoting=csv.QUOTE_NONNUMERIC,
+                                     delimiter=",")
+            self.writer.writerow(ErrorLog.header)
+        self.writer.writerow([filename, stage, attempts, describe(error)])
+        self.errors_file.flush()
+        self.count += 1
+        print("Skipped %s (%s): %s" % (os.path.basename(str(filename)), stage, describe(error)))
+
+    def close(self):
+        if self.errors_file is not None:
+            self.errors_file.close()
+            self.errors_file = None
@@ -14,7 +14,9 @@ image quality parameters in the PyImageQuality software.
     are based on the analysis of the tail of the 1D power spect-
     rum.
 -   Brenner and Spectral domain autofocus metrics were impelemnted
-    as well, based on the two classes above.
+    as well, based on the two classes above. The BrennerImageQuality
+    class also provides the gradient based variants of the gradient
+    module.
 """
 
 import numpy
@@ -24,7 +26,11 @@ from math import floor
 import argparse
 
 import pyimq.utils as utils
-import pyimq.external.radial_profile as radprof
+import pyimq.gradient as gradient
+import pyimq.entropy as entropy
+import pyimq.kernels as kernels
+import pyimq.report as report
+import pyimq.spectra as spectra
 
 from pyimq.myimage import MyImage as Image
 
@@ -71,6 +77,14 @@ def get_common_options(parser):
         type=int,
         default=80
     )
+    group.add_argument(
+        "--kernels",
+        choices=kernels.backends,
+        default=None,
+        help="The backend of the numeric kernels. By default the "
+             "PYIMQ_KERNELS environment variable, or auto, which uses "
+             "Numba if it is installed."
+    )
     group.add_argument(
         "--show-plots",
         dest="show_plots",
@@ -79,6 +93,69 @@ def get_common_options(parser):
     return parser
 
 
+def calculate_tail_statistics(simple_power, threshold):
+    """
+    Calculate the statistical quality parameters from the tail of a 1D
+    power spectrum.
+
+    :param simple_power:    A [frequencies, power] list
+    :param threshold:       The tail starts at this fraction of the highest
+                            frequency
+    :return:                A list of the quality parameters: mean, std,
+                            entropy, threshold (nm), power at high
+                            frequencies, skewness, kurtosis, mean bin
+    """
+    f_k, power = simple_power
+    tail = f_k > threshold * f_k.max()
+    hf_sum = power[tail]
+
+    # Calculate parameters
+    f_th = f_k[tail][-kernels.accumulation_index(hf_sum, .2)]
+    mean = numpy.mean(hf_sum)
+    std = numpy.std(hf_sum)
+    entropy = utils.calculate_entropy(hf_sum)
+    nm_th = 1.0e9 / f_th
+    pw_at_high_f = numpy.mean(power[f_k > .9 * f_k.max()])
+    skew = stats.skew(numpy.log(hf_sum))
+    kurtosis = stats.kurtosis(hf_sum)
+    mean_bin = numpy.mean(hf_sum[0:5])
+
+    return [mean, std, entropy, nm_th, pw_at_high_f, skew, kurtosis, mean_bin]
+
+
+def calculate_tail_statistics_batch(f_k, power, threshold):
+    """
+    Calculate the statistical quality parameters of a stack of 1D power
+    spectra at once, see calculate_tail_statistics().
+
+    :param f_k:         The frequencies, common to all the spectra
+    :param power:       An (images x frequencies) Numpy array
+    :param threshold:   The tail starts at this fraction of the highest
+                        frequency
+    :return:            An (images x 8) Numpy array of the quality parameters
+    """
+    tail = f_k > threshold * f_k.max()
+    hf_sum = power[:, tail]
+
+    # The accumulation analysis of utils.analyze_accumulation(), with
+    # a cumulative sum from the end of every spectrum
+    accumulated = numpy.cumsum(hf_sum[:, ::-1], axis=1)
+    final = .2 * hf_sum.sum(axis=1)
+    index = numpy.argmax(accumulated >= final[:, numpy.newaxis], axis=1) + 1
+    f_th = f_k[tail][-index]
+
+    results = numpy.empty((power.shape[0], 8))
+    results[:, 0] = numpy.mean(hf_sum, axis=1)
+    results[:, 1] = numpy.std(hf_sum, axis=1)
+    results[:, 2] = entropy.calculate_entropy_batch(hf_sum)
+    results[:, 3] = 1.0e9 / f_th
+    results[:, 4] = numpy.mean(power[:, f_k > .9 * f_k.max()], axis=1)
+    results[:, 5] = stats.skew(numpy.log(hf_sum), axis=1)
+    results[:, 6] = stats.kurtosis(hf_sum, axis=1)
+    results[:, 7] = numpy.mean(hf_sum[:, 0:5], axis=1)
+    return results
+
+
 class Filter(object):
     """
     A base class for a filter utilizing Image class object
@@ -152,21 +229,12 @@ class LocalImageQuality(Filter):
         if return_result:
             return Image(self.data_temp, self.spacing)
 
-    def calculate_entropy(self):
+    def calculate_entropy(self, mask=None):
         """
-        Returns the Shannon entropy value of an image.
+        Returns the Shannon entropy value of an image. If a mask is given,
+        only the pixels at the mask positions are included.
         """
-        # Calculate histogram
-        histogram = ndimage.histogram(
-            self.data_temp,
-            self.data_temp.min(),
-            self.data_temp.max(), 50
-        )
-        # Exclude zeros
-        histogram = histogram[numpy.nonzero(histogram)]
-        # Normalize histogram bins to sum to one
-        histogram = histogram.astype(float) / histogram.sum()
-        return -numpy.sum(histogram * numpy.log2(histogram))
+        return utils.calculate_entropy(self.data_temp, mask=mask)
 
     def find_sampling_positions(self):
         """
@@ -174,9 +242,9 @@ class LocalImageQuality(Filter):
         that have pixel values higher than 80% of the maximum value.
         """
         peaks = numpy.percentile(self.data_temp, self.options.spatial_threshold)
-        mask = numpy.where(self.data_temp >= peaks, 1, 0)
+        mask = self.data_temp >= peaks
         if self.options.invert_mask:
-            return numpy.invert(mask.astype(bool))
+            return numpy.invert(mask)
         else:
             return mask
 
@@ -197,9 +265,10 @@ class LocalImageQuality(Filter):
                 self.run_mean_smoothing()
 
             positions = self.find_sampling_positions()
-            self.data_temp = self.data[:][numpy.nonzero(positions)]
+            self.data_temp = self.data[:]
             if show:
                 Image(self.data[:] * positions, self.spacing).show()
+            return self.calculate_entropy(mask=positions)
         else:
             self.data_temp = self.data[:]
 
@@ -247,11 +316,9 @@ class FrequencyQuality(Filter):
         Convert a 2D centered power spectrum into 1D by averaging spectral
         power at different radiuses from the zero frequency center
         """
-        bin_centers, average = radprof.azimuthalAverage(
-            self.power,
-            binsize=bin_size,
-            returnradii=True,
-        )
+        labels, nbins, bin_centers, counts = spectra.get_radial_bins(
+            self.power.shape, bin_size)
+        average = kernels.radial_average(self.power, labels, nbins, counts)
         dx = self.data.get_spacing()[0]
 
         size = int(float(self.power.shape[0]) / 2)
@@ -259,7 +326,11 @@ class FrequencyQuality(Filter):
 
         self.simple_power = [f_k, average]
 
-        if self.options.show_plots:
+        if self.options.show_plots and report.is_active():
+            report.show_plot(self.simple_power[0], self.simple_power[1],
+                             title="Radial average", xlabel="Frequency",
+                             ylabel="Average power", log=True)
+        elif self.options.show_plots:
             plt.plot(numpy.log10(self.simple_power[0]))
             plt.ylabel("Average power")
             plt.xlabel("Frequency")
@@ -284,7 +355,11 @@ class FrequencyQuality(Filter):
 
         self.simple_power = [f_k, sum]
 
-        if self.options.show_plots:
+        if self.options.show_plots and report.is_active():
+            report.show_plot(self.simple_power[0], self.simple_power[1],
+                             title="Summed power", xlabel="Frequency",
+                             ylabel="Total power", log=True)
+        elif self.options.show_plots:
             plt.plot(self.simple_power[0], self.simple_power[1], linewidth=2, color="red")
             plt.ylabel("Total power")
             plt.yscale('log')
@@ -306,27 +381,15 @@ class FrequencyQuality(Filter):
         else:
             raise NotImplementedError
 
-        # Extract the power spectrum tail
-        hf_sum = self.simple_power[1][self.simple_power[0] > self.options.power_threshold * self.simple_power[0].max()]
-
-        # Calculate parameters
-        f_th = self.simple_power[0][self.simple_power[0] > self.options.power_threshold * self.simple_power[0].max()][
-            -utils.analyze_accumulation(hf_sum, .2)]
-        mean = numpy.mean(hf_sum)
-        std = numpy.std(hf_sum)
-        entropy = utils.calculate_entropy(hf_sum)
-        nm_th = 1.0e9 / f_th
-        pw_at_high_f = numpy.mean(self.simple_power[1][self.simple_power[0] > .9 * self.simple_power[0].max()])
-        skew = stats.skew(numpy.log(hf_sum))
-        kurtosis = stats.kurtosis(hf_sum)
-        mean_bin = numpy.mean(hf_sum[0:5])
-
-        return [mean, std, entropy, nm_th, pw_at_high_f, skew, kurtosis, mean_bin]
+        return calculate_tail_statistics(self.simple_power, self.options.power_threshold)
 
     def show_all(self):
         """
         A small utility to show a plot of the 2D and 1D power spectra
         """
+        if report.is_active():
+            report.show_spectrum(self.power, self.simple_power)
+            return
         fig, subplots = plt.subplots(1, 2)
         if self.power is not None:
             subplots[0].imshow(numpy.log10(self.power))
@@ -354,9 +417,6 @@ class SpectralMoments(FrequencyQuality):
     http://doi.org/10.1002/cyto.990120302
     """
 
-    def calculate_percent_spectrum(self):
-        self.simple_power[1] /= (self.simple_power[1].sum() / 100)
-
     def calculate_spectral_moments(self):
         """
         Run the image quality analysis on the power spectrum
@@ -372,11 +432,7 @@ class SpectralMoments(FrequencyQuality):
         else:
             raise NotImplementedError
 
-        self.calculate_percent_spectrum()
-
-        bin_index = numpy.arange(1, self.simple_power[1].shape[0] + 1)
-
-        return (self.simple_power[1] * numpy.log10(bin_index)).sum()
+        return spectra.calculate_spectral_moments(self.simple_power[1])
 
 
 class BrennerImageQuality(Filter):
@@ -394,11 +450,27 @@ class BrennerImageQuality(Filter):
         self.data.crop_to_rectangle()
 
     def calculate_brenner_quality(self):
-        data = self.data.get_array()
-        rows = data.shape[0]
-        columns = data.shape[1] - 2
-        temp = numpy.zeros((rows, columns))
+        """
+        Calculate the Brenner measure in blocks, without temporary
+        full-size arrays. The differences of integer images are
+        accumulated in a wider type, so they do not overflow.
+        """
+        return kernels.brenner(self.data.get_array())
 
-        temp[:] = ((data[:, 0:-2] - data[:, 2:]) ** 2)
+    def calculate_brenner_2d_quality(self):
+        """
+        The Brenner measure in both horizontal and vertical directions
+        """
+        return kernels.brenner(self.data.get_array(), direction="both")
 
-        return temp.sum()
+    def calculate_tenengrad_quality(self):
+        """
+        The Tenengrad measure: the sum of the squared Sobel gradient magnitude
+        """
+        return gradient.tenengrad(self.data.get_array())
+
+    def calculate_laplacian_quality(self):
+        """
+        The variance of the Laplacian of the image
+        """
+        return gradient.laplacian_variance(self.data.get_array())
@@ -0,0 +1,212 @@
+"""
+File:        gradient.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Chunked gradient based focus measures for the PyImageQuality software:
+the Brenner measure (horizontal, or horizontal + vertical), Tenengrad
+(sum of the squared Sobel gradient magnitude) and the variance of the
+Laplacian. The image is processed in blocks of rows, so that the
+temporary arrays never exceed a fixed size, even with 100-megapixel
+images. The pixel differences are calculated from the native data type
+directly into a reused work buffer, that has a wider accumulator type:
+
+-   8- and 16-bit integer images are accumulated in int64, which can
+    not overflow within a block. The block sums are added together as
+    Python integers, so the total is exact.
+-   Other images are accumulated in float64.
+
+All the measures are calculated over the pixels at which the whole
+difference kernel fits inside the image.
+"""
+
+import numpy
+
+
+# Approximate number of pixels processed at a time
+chunk_size = 1 << 20
+
+
+def get_accumulator_dtype(dtype):
+    """
+    Returns the data type that differences of pixels of a given type are
+    accumulated in.
+    """
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == "b" or (dtype.kind in "ui" and dtype.itemsize <= 2):
+        return numpy.dtype(numpy.int64)
+    return numpy.dtype(numpy.float64)
+
+
+def iterate_blocks(data, overlap):
+    """
+    Iterate over overlapping blocks of rows of an image. Every block has
+    overlap extra rows at the end, so that a kernel of overlap + 1 rows
+    can be evaluated at all the rows of the block without gaps.
+
+    :param data:    A 2D Numpy array
+    :param overlap: Number of extra rows
+    :return:        A generator of blocks (views to the data)
+    """
+    rows = data.shape[0] - overlap
+    step = max(1, chunk_size // max(data.shape[1], 1))
+    for start in range(0, rows, step):
+        yield data[start:min(start + step, rows) + overlap]
+
+
+class _Buffers(object):
+    """
+    A set of reused work buffers, sized for the largest block.
+    """
+
+    def __init__(self, data, overlap, count):
+        rows = min(data.shape[0], max(1, chunk_size // max(data.shape[1], 1)) + overlap)
+        dtype = get_accumulator_dtype(data.dtype)
+        self.buffers = [numpy.empty((rows, data.shape[1]), dtype=dtype) for i in range(count)]
+
+    def get(self, index, shape):
+        return self.buffers[index][:shape[0], :shape[1]]
+
+
+def _total(value):
+    """
+    Convert a block sum into a Python number, for exact integer totals.
+    """
+    return int(value) if isinstance(value, numpy.integer) else float(value)
+
+
+def _sum_of_squares(buffer):
+    if buffer.dtype.kind == "f":
+        flat = buffer.reshape(-1)
+        return float(numpy.dot(flat, flat))
+    numpy.multiply(buffer, buffer, out=buffer)
+    return _total(buffer.sum())
+
+
+def brenner(data, direction="horizontal"):
+    """
+    The Brenner measure: the sum of squared differences of pixels that are
+    two pixels apart.
+
+    :param data:        A 2D Numpy array
+    :param direction:   "horizontal", "vertical" or "both"
+    :return:            The measure (a Python int with 8- and 16-bit
+                        integer images, a float otherwise)
+    """
+    assert direction in ("horizontal", "vertical", "both")
+    total = 0
+    if direction in ("horizontal", "both") and data.shape[1] > 2:
+        buffers = _Buffers(data, 0, 1)
+        for block in iterate_blocks(data, 0):
+            difference = buffers.get(0, (block.shape[0], block.shape[1] - 2))
+            numpy.subtract(block[:, :-2], block[:, 2:], out=difference,
+                           dtype=difference.dtype, casting="unsafe")
+            total += _sum_of_squares(difference)
+    if direction in ("vertical", "both") and data.shape[0] > 2:
+        buffers = _Buffers(data, 2, 1)
+        for block in iterate_blocks(data, 2):
+            difference = buffers.get(0, (block.shape[0] - 2, block.shape[1]))
+            numpy.subtract(block[:-2], block[2:], out=difference,
+                           dtype=difference.dtype, casting="unsafe")
+            total += _sum_of_squares(difference)
+    return total
+
+
+def sobel(block, buffers):
+    """
+    Calculate the horizontal and vertical Sobel gradients of the inner
+    pixels of a block into the work buffers 0 and 1.
+    """
+    shape = (block.shape[0] - 2, block.shape[1] - 2)
+    gx, gy, temp = (buffers.get(i, shape) for i in range(3))
+    kwargs = dict(dtype=gx.dtype, casting="unsafe")
+
+    # Horizontal gradient: [1, 2, 1]^T * [-1, 0, 1]
+    numpy.subtract(block[1:-1, 2:], block[1:-1, :-2], out=gx, **kwargs)
+    numpy.add(gx, gx, out=gx)
+    numpy.subtract(block[:-2, 2:], block[:-2, :-2], out=temp, **kwargs)
+    numpy.add(gx, temp, out=gx)
+    numpy.subtract(block[2:, 2:], block[2:, :-2], out=temp, **kwargs)
+    numpy.add(gx, temp, out=gx)
+
+    # Vertical gradient: [-1, 0, 1]^T * [1, 2, 1]
+    numpy.subtract(block[2:, 1:-1], block[:-2, 1:-1], out=gy, **kwargs)
+    numpy.add(gy, gy, out=gy)
+    numpy.subtract(block[2:, :-2], block[:-2, :-2], out=temp, **kwargs)
+    numpy.add(gy, temp, out=gy)
+    numpy.subtract(block[2:, 2:], block[:-2, 2:], out=temp, **kwargs)
+    numpy.add(gy, temp, out=gy)
+    return gx, gy
+
+
+def tenengrad(data):
+    """
+    The Tenengrad measure: the sum of the squared Sobel gradient magnitude.
+
+    :param data:    A 2D Numpy array
+    :return:        The measure (a Python int with 8- and 16-bit integer
+                    images, a float otherwise)
+    """
+    if min(data.shape) < 3:
+        return 0
+    buffers = _Buffers(data, 2, 3)
+    total = 0
+    for block in iterate_blocks(data, 2):
+        gx, gy = sobel(block, buffers)
+        total += _sum_of_squares(gx) + _sum_of_squares(gy)
+    return total
+
+
+def laplacian(block, buffers):
+    """
+    Calculate the (4-neighbour) Laplacian of the inner pixels of a block
+    into the work buffer 0.
+    """
+    shape = (block.shape[0] - 2, block.shape[1] - 2)
+    result, temp = buffers.get(0, shape), buffers.get(1, shape)
+    kwargs = dict(dtype=result.dtype, casting="unsafe")
+
+    numpy.add(block[:-2, 1:-1], block[2:, 1:-1], out=result, **kwargs)
+    numpy.add(block[1:-1, :-2], block[1:-1, 2:], out=temp, **kwargs)
+    numpy.add(result, temp, out=result)
+    numpy.multiply(block[1:-1, 1:-1], 4, out=temp, **kwargs)
+    numpy.subtract(result, temp, out=result)
+    return result
+
+
+def laplacian_variance(data):
+    """
+    The variance of the Laplacian. With integer images the sums are exact;
+    with other images the block means and variances are combined with the
+    parallel variance algorithm, which avoids cancellation.
+
+    :param data:    A 2D Numpy array
+    :return:        The variance (a float)
+    """
+    if min(data.shape) < 3:
+        return 0.0
+    buffers = _Buffers(data, 2, 2)
+    count = 0
+    if get_accumulator_dtype(data.dtype).kind == "i":
+        total = 0
+        squares = 0
+        for block in iterate_blocks(data, 2):
+            values = laplacian(block, buffers)
+            count += values.size
+            total += _total(values.sum())
+            squares += _sum_of_squares(values)
+        return float(count * squares - total * total) / (count * count)
+
+    mean = 0.0
+    m2 = 0.0
+    for block in iterate_blocks(data, 2):
+        values = laplacian(block, buffers)
+        block_mean = float(values.mean())
+        values -= block_mean
+        block_m2 = _sum_of_squares(values)
+        delta = block_mean - mean
+        new_count = count + values.size
+        mean += delta * values.size / new_count
+        m2 += block_m2 + delta * delta * count * values.size / new_count
+        count = new_count
+    return m2 / count
@@ -0,0 +1,242 @@
+"""
+File:        heatmap.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Quality heatmaps for the PyImageQuality software. Instead of a single
+value per image, the quality parameters are calculated in overlapping
+square windows, which shows e.g. the out-of-focus parts of a large
+tile scan. The result is a low resolution map of every selected
+parameter, one value per window.
+
+The windows are not analyzed with separate filter objects. Instead the
+sliding windows are taken as views to the image, and the windows of
+several window rows are stacked and analyzed at once: the 1D power
+spectra with a single batched FFT (spectra.SpectrumPlan), the tail
+statistics with filters.calculate_tail_statistics_batch() and the
+entropies with entropy.calculate_entropy_batch(). The values are the
+same as when every window is analyzed separately in the directory mode,
+except that the smoothing mask (--use-mask) is not used in the windows.
+"""
+
+import argparse
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+from pyimq import analysis, entropy, filters, gradient, spectra, thumbnails
+
+
+# Approximate number of pixels in the windows that are analyzed at once
+chunk_size = 1 << 22
+
+# The node and the index of the node result, that every quality parameter
+# is read from, see metrics._outputs
+_outputs = {
+    "tEntropy": ("entropy", None),
+    "tBrenner": ("brenner", None),
+    "fMoments": ("moments", None),
+    "fMean": ("tail", 0),
+    "fSTD": ("tail", 1),
+    "fEntropy": ("tail", 2),
+    "fTh": ("tail", 3),
+    "fMaxPw": ("tail", 4),
+    "Skew": ("tail", 5),
+    "Kurtosis": ("tail", 6),
+    "MeanBin": ("tail", 7)
+}
+
+
+def get_options(parser):
+    """
+    Command-line options for the quality heatmaps
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Heatmap", "Options for the heatmap mode"
+    )
+    group.add_argument(
+        "--window-size",
+        dest="window_size",
+        type=int,
+        default=128,
+        help="The size of the square analysis windows (pixels)"
+    )
+    group.add_argument(
+        "--window-step",
+        dest="window_step",
+        type=int,
+        default=64,
+        help="The distance between adjacent windows (pixels)"
+    )
+    group.add_argument(
+        "--heatmap-metrics",
+        dest="heatmap_metrics",
+        nargs="+",
+        choices=analysis.quality_parameters,
+        default=["fSTD"],
+        help="The quality parameters that are mapped"
+    )
+    group.add_argument(
+        "--heatmap-image",
+        dest="heatmap_image",
+        action="store_true",
+        help="Save the heatmaps also as PNG images, on top of the image"
+    )
+    return parser
+
+
+def get_windows(data, size, step):
+    """
+    Returns the sliding windows of an image.
+
+    :param data:    A 2D Numpy array
+    :param size:    The window size
+    :param step:    The distance between adjacent windows
+    :return:        A (rows x columns x size x size) view to the data
+    """
+    assert min(data.shape) >= size, "The image is smaller than the window"
+    return sliding_window_view(data, (size, size))[::step, ::step]
+
+
+def get_window_centers(shape, size, step):
+    """
+    Returns the pixel coordinates of the window centers, along the rows
+    and the columns of the map.
+    """
+    return tuple(numpy.arange(0, length - size + 1, step) + size / 2.0 for length in shape)
+
+
+class QualityMap(object):
+    """
+    Calculates quality heatmaps with a fixed window size. The spectrum
+    plan is reused for all the images.
+    """
+
+    def __init__(self, options, size=128, step=64, metrics=("fSTD",), spacing=(1.0, 1.0),
+                 workers=1):
+        assert all(name in _outputs for name in metrics), "Unknown metric in %s" % metrics
+        self.options = options
+        self.size = size
+        self.step = step
+        self.metrics = [name for name in analysis.quality_parameters if name in metrics]
+        self.nodes = set(_outputs[name][0] for name in self.metrics)
+        self.spacing = tuple(spacing)
+        self.workers = workers
+        self.spectrum = None
+        if self.nodes & {"moments", "tail"}:
+            self.spectrum = spectra.SpectrumPlan(
+                (size, size), options.power_averaging, options.normalize_power,
+                spacing, workers)
+
+    def calculate_windows(self, windows):
+        """
+        Calculate the quality parameters of a stack of windows.
+
+        :param windows: An (n x size x size) Numpy array
+        :return:        An (n x metrics) Numpy array
+        """
+        values = {}
+        if "entropy" in self.nodes:
+            values["entropy"] = entropy.calculate_entropy_batch(windows)
+        if "brenner" in self.nodes:
+            difference = numpy.subtract(
+                windows[..., :-2], windows[..., 2:],
+                dtype=gradient.get_accumulator_dtype(windows.dtype), casting="unsafe")
+            values["brenner"] = numpy.einsum("nij,nij->n", difference, difference)
+        if self.spectrum is not None:
+            power = self.spectrum.calculate(windows.astype(numpy.float64))
+            if "moments" in self.nodes:
+                values["moments"] = spectra.calculate_spectral_moments(power)
+            if "tail" in self.nodes:
+                values["tail"] = filters.calculate_tail_statistics_batch(
+                    self.spectrum.f_k, power, self.options.power_threshold)
+
+        results = numpy.empty((windows.shape[0], len(self.metrics)))
+        for column, metric in enumerate(self.metrics):
+            name, index = _outputs[metric]
+            results[:, column] = values[name] if index is None else values[name][:, index]
+        return results
+
+    def calculate(self, data):
+        """
+        Calculate the quality heatmaps of an image.
+
+        :param data:    A 2D Numpy array (or a grayscale MyImage)
+        :return:        A dictionary of (rows x columns) maps, one for every
+                        selected quality parameter
+        """
+        data = numpy.asarray(data[:])
+        windows = get_windows(data, self.size, self.step)
+        rows, columns = windows.shape[:2]
+        results = numpy.empty((rows, columns, len(self.metrics)))
+
+        # A few rows of windows are analyzed at a time, which limits the
+        # size of the (copied) window stacks
+        step = max(1, chunk_size // (columns * self.size * self.size))
+        for start in range(0, rows, step):
+            stop = min(start + step, rows)
+            stack = numpy.ascontiguousarray(windows[start:stop]).reshape(
+                -1, self.size, self.size)
+            results[start:stop] = self.calculate_windows(stack).reshape(
+                stop - start, columns, len(self.metrics))
+
+        return dict((metric, results[:, :, column]) for column, metric in enumerate(self.metrics))
+
+
+def render_heatmap(quality_map, data=None, size=thumbnails.thumbnail_size * 2, alpha=0.5):
+    """
+    Render a heatmap as an RGB image, optionally on top of a grayscale
+    thumbnail of the image.
+
+    :param quality_map: A 2D Numpy array
+    :param data:        The image, or None
+    :param size:        Maximum length of the longer side of the output
+    :param alpha:       Opacity of the heatmap on top of the image
+    :return:            An RGB PIL Image
+    """
+    from matplotlib import cm
+
+    finite = numpy.isfinite(quality_map)
+    low, high = (numpy.min(quality_map[finite]), numpy.max(quality_map[finite])) \
+        if finite.any() else (0.0, 1.0)
+    if high <= low:
+        high = low + 1
+    scaled = numpy.clip((quality_map - low) / (high - low), 0, 1)
+    colors = numpy.uint8(255 * cm.viridis(numpy.where(finite, scaled, 0))[:, :, :3])
+    heatmap = Image.fromarray(colors)
+
+    if data is None:
+        factor = max(1, size // max(quality_map.shape))
+        return heatmap.resize((quality_map.shape[1] * factor, quality_map.shape[0] * factor),
+                              Image.NEAREST)
+
+    preview = Image.fromarray(thumbnails.make_thumbnail(numpy.asarray(data[:]), size))
+    heatmap = heatmap.resize(preview.size, Image.BILINEAR)
+    return Image.blend(preview.convert("RGB"), heatmap, alpha)
+
+
+def save_heatmaps(quality_maps, path, data=None, centers=None, image=False):
+    """
+    Save the heatmaps of an image into a .npz file, and optionally as PNG
+    images.
+
+    :param quality_maps:    A dictionary of maps, see QualityMap.calculate()
+    :param path:            The output path, without a suffix
+    :param data:            The image, for the PNG images
+    :param centers:         The window centers, see get_window_centers()
+    :param image:           Save the PNG images
+    :return:                A list of the saved files
+    """
+    arrays = dict(quality_maps)
+    if centers is not None:
+        arrays["row_centers"], arrays["column_centers"] = centers
+    numpy.savez(path + ".npz", **arrays)
+    saved = [path + ".npz"]
+    if image:
+        for metric, quality_map in quality_maps.items():
+            file_name = "%s_%s.png" % (path, metric)
+            render_heatmap(quality_map, data).save(file_name)
+            saved.append(file_name)
+    return saved
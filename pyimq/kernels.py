@@ -0,0 +1,303 @@
+"""
+File:        kernels.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Numeric kernels of the PyImageQuality software, with an optional JIT
+compiled backend. The kernels are simple loops, that are either slow in
+pure Python or create several full-size temporary arrays with Numpy:
+
+-   radial_average: the radial average of a 2D power spectrum (the
+    reference is radial_profile.azimuthalAverage, that loops over the
+    bins in Python)
+-   accumulation_index: the accumulation search of the power spectrum
+    tail (the reference is utils.analyze_accumulation, a Python loop)
+-   histogram: the entropy histogram (the reference is the entropy
+    module, which is the Numpy backend as well)
+-   brenner: the Brenner measure (the reference is the gradient module,
+    which is the Numpy backend as well)
+
+The "numpy" backend is always available. The "numba" backend requires
+Numba (pip install pyimq[jit]), and compiles the loops into single pass
+machine code without temporary arrays. By default ("auto") Numba is used,
+if it is installed. The backend can be selected with the --kernels option
+or with the PYIMQ_KERNELS environment variable, which is also inherited
+by worker processes.
+
+The compiled backend adds the values in a different order than Numpy, so
+the floating point results may differ in the last digits; integer
+results are identical.
+"""
+
+import importlib.util
+import os
+
+import numpy
+
+from pyimq import entropy, gradient
+
+backends = ["auto", "numpy", "numba"]
+
+_backend = None
+_jit = None
+
+
+def is_numba_available():
+    return importlib.util.find_spec("numba") is not None
+
+
+def set_backend(name=None):
+    """
+    Select the kernel backend: "auto", "numpy" or "numba". With None the
+    PYIMQ_KERNELS environment variable is used, or "auto" if it is not set.
+    """
+    global _backend
+    if name is None:
+        name = os.environ.get("PYIMQ_KERNELS", "auto")
+    if name not in backends:
+        raise ValueError("Unknown kernel backend %s, choose from %s" % (name, backends))
+    if name == "auto":
+        name = "numba" if is_numba_available() else "numpy"
+    if name == "numba" and not is_numba_available():
+        raise ValueError("The numba kernel backend requires Numba (pip install pyimq[jit])")
+    _backend = name
+    os.environ["PYIMQ_KERNELS"] = name
+
+
+def get_backend():
+    """
+    Returns the name of the selected backend, "numpy" or "numba"
+    """
+    if _backend is None:
+        set_backend()
+    return _backend
+
+
+def _radial_sums(values, labels, nbins):
+    sums = numpy.zeros(nbins)
+    for i in range(values.size):
+        label = labels[i]
+        if 1 <= label <= nbins:
+            sums[label - 1] += values[i]
+    return sums
+
+
+def _accumulation_index(x, final):
+    total = 0.0
+    for index in range(1, x.size + 1):
+        total += x[x.size - index]
+        if total >= final:
+            return index
+    return x.size
+
+
+def _min_max(data, mask, masked):
+    minimum = numpy.inf
+    maximum = -numpy.inf
+    for row in range(data.shape[0]):
+        for column in range(data.shape[1]):
+            if masked and not mask[row, column]:
+                continue
+            value = numpy.float64(data[row, column])
+            if value < minimum:
+                minimum = value
+            if value > maximum:
+                maximum = value
+    return minimum, maximum
+
+
+def _integer_counts(data, mask, masked, minimum, span):
+    counts = numpy.zeros(span, dtype=numpy.int64)
+    for row in range(data.shape[0]):
+        for column in range(data.shape[1]):
+            if masked and not mask[row, column]:
+                continue
+            counts[numpy.int64(data[row, column]) - minimum] += 1
+    return counts
+
+
+def _histogram(data, mask, masked, edges):
+    # The bin search of numpy.histogram: every bin is half-open, except the
+    # last one. The estimate of the division is fixed by comparing to the
+    # edges.
+    bins = edges.size - 1
+    counts = numpy.zeros(bins, dtype=numpy.int64)
+    first = edges[0]
+    span = edges[bins] - first
+    norm = bins / span if span > 0 else 0.0
+    for row in range(data.shape[0]):
+        for column in range(data.shape[1]):
+            if masked and not mask[row, column]:
+                continue
+            value = numpy.float64(data[row, column])
+            if span <= 0:
+                counts[bins - 1] += 1
+                continue
+            index = int((value - first) * norm)
+            if index > bins - 1:
+                index = bins - 1
+            elif index < 0:
+                index = 0
+            if value < edges[index]:
+                index -= 1
+            elif index != bins - 1 and value >= edges[index + 1]:
+                index += 1
+            counts[index] += 1
+    return counts
+
+
+def _brenner_integer(data, horizontal, vertical):
+    total = 0
+    rows, columns = data.shape
+    if horizontal:
+        for row in range(rows):
+            for column in range(columns - 2):
+                difference = numpy.int64(data[row, column]) - \
+                    numpy.int64(data[row, column + 2])
+                total += difference * difference
+    if vertical:
+        for row in range(rows - 2):
+            for column in range(columns):
+                difference = numpy.int64(data[row, column]) - \
+                    numpy.int64(data[row + 2, column])
+                total += difference * difference
+    return total
+
+
+def _brenner_float(data, horizontal, vertical):
+    # The rows are summed separately, which keeps the rounding errors small
+    total = 0.0
+    rows, columns = data.shape
+    if horizontal:
+        for row in range(rows):
+            row_total = 0.0
+            for column in range(columns - 2):
+                difference = numpy.float64(data[row, column]) - \
+                    numpy.float64(data[row, column + 2])
+                row_total += difference * difference
+            total += row_total
+    if vertical:
+        for row in range(rows - 2):
+            row_total = 0.0
+            for column in range(columns):
+                difference = numpy.float64(data[row, column]) - \
+                    numpy.float64(data[row + 2, column])
+                row_total += difference * difference
+            total += row_total
+    return total
+
+
+def _get_jit():
+    """
+    Compile the loops with Numba. The compilation happens at the first
+    call of every kernel; the results are cached on disk.
+    """
+    global _jit
+    if _jit is None:
+        import numba
+        jit = numba.njit(cache=True, nogil=True)
+        _jit = {
+            "radial_sums": jit(_radial_sums),
+            "accumulation_index": jit(_accumulation_index),
+            "min_max": jit(_min_max),
+            "integer_counts": jit(_integer_counts),
+            "histogram": jit(_histogram),
+            "brenner_integer": jit(_brenner_integer),
+            "brenner_float": jit(_brenner_float)
+        }
+    return _jit
+
+
+def radial_average(power, labels, nbins, counts):
+    """
+    The radial average of a 2D power spectrum.
+
+    :param power:   A 2D power spectrum
+    :param labels:  The radial bin of every pixel, starting from 1, see
+                    spectra.get_radial_bins()
+    :param nbins:   The number of bins
+    :param counts:  The number of pixels in every bin
+    :return:        The average power in every bin
+    """
+    values = numpy.ravel(power)
+    labels = numpy.ravel(labels)
+    if get_backend() == "numba":
+        sums = _get_jit()["radial_sums"](values, labels, nbins)
+    else:
+        sums = numpy.bincount(labels, weights=values, minlength=nbins + 1)[1:nbins + 1]
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        return sums / counts
+
+
+def accumulation_index(x, fraction):
+    """
+    Analyze the accumulation by starting from the end of the data: returns
+    the number of values from the end, whose sum reaches the given fraction
+    of the total.
+    """
+    assert 0.0 < fraction <= 1.0
+    x = numpy.ascontiguousarray(x, dtype=numpy.float64)
+    final = fraction * x.sum()
+    if get_backend() == "numba":
+        return int(_get_jit()["accumulation_index"](x, final))
+    reached = numpy.cumsum(x[::-1]) >= final
+    return int(numpy.argmax(reached)) + 1 if reached.any() else x.size
+
+
+def _as_2d(data):
+    data = numpy.asarray(data)
+    if data.ndim == 2:
+        return data
+    if data.ndim < 2:
+        return data.reshape(1, -1)
+    return data.reshape(data.shape[0], -1)
+
+
+def histogram(data, bins=50, mask=None):
+    """
+    A histogram with equal width bins between the minimum and the maximum
+    value of the data, see entropy.calculate_histogram()
+    """
+    if get_backend() != "numba" or numpy.asarray(data).dtype.kind not in "uif":
+        return entropy.calculate_histogram(data, bins, mask)
+    jit = _get_jit()
+    data = _as_2d(data)
+    masked = mask is not None
+    if masked:
+        mask = _as_2d(numpy.asarray(mask, dtype=bool))
+        if not mask.any():
+            return numpy.zeros(bins, dtype=numpy.int64)
+    else:
+        mask = numpy.ones((1, 1), dtype=bool)
+    minimum, maximum = jit["min_max"](data, mask, masked)
+    # The minimum and maximum are values of the data, so they are exact in
+    # the data type. The edges are calculated from them as in the entropy
+    # module, which for float32 data gives float32 edges.
+    minimum, maximum = data.dtype.type(minimum), data.dtype.type(maximum)
+    if data.dtype.kind in "ui" and int(maximum) - int(minimum) < entropy.max_integer_span:
+        counts = jit["integer_counts"](data, mask, masked, int(minimum),
+                                       int(maximum) - int(minimum) + 1)
+        return entropy.rebin_integer_counts(counts, minimum, maximum, bins)
+    edges = numpy.linspace(minimum, maximum, bins + 1)
+    return jit["histogram"](data, mask, masked, edges)
+
+
+def calculate_entropy(data, bins=50, mask=None):
+    """
+    The Shannon entropy of the data (or of a masked part of the data)
+    """
+    return entropy.histogram_entropy(histogram(data, bins, mask))
+
+
+def brenner(data, direction="horizontal"):
+    """
+    The Brenner measure, see gradient.brenner()
+    """
+    assert direction in ("horizontal", "vertical", "both")
+    if get_backend() != "numba" or data.ndim != 2 or data.dtype.kind not in "uif":
+        return gradient.brenner(data, direction)
+    horizontal = direction in ("horizontal", "both")
+    vertical = direction in ("vertical", "both")
+    if gradient.get_accumulator_dtype(data.dtype).kind == "i":
+        return int(_get_jit()["brenner_integer"](data, horizontal, vertical))
+    return float(_get_jit()["brenner_float"](data, horizontal, vertical))
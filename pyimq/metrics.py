@@ -0,0 +1,316 @@
+"""
+File:        metrics.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A metric graph for the PyImageQuality software. The quality parameters
+(see analysis.quality_parameters) depend on a few shared intermediate
+results: the smoothing mask of the entropy calculation, the 2D power
+spectrum (FFT), the 1D power spectrum and the statistics of the power
+spectrum tail. Every intermediate result is a node in the graph, that
+declares the nodes it requires. When a set of quality parameters is
+selected, only the nodes that are needed for them are calculated, each
+of them only once per image. For example the Brenner measure alone
+does not require the FFT at all.
+
+The nodes are calculated in the order of registration, which is the
+same order in which the filters were originally run in the directory
+mode (some of the filters crop the image in place).
+
+Every node also declares the command line options that only affect its
+own (cheap) final step, such as the tail threshold of the power spectrum.
+In a parameter sweep (see the sweep module) only the nodes that depend
+on the swept options are calculated again for every setting; the rest,
+e.g. the FFT and the smoothed image of the mask, are calculated once.
+"""
+
+import argparse
+import collections
+import copy
+
+from pyimq import filters, analysis, spectra
+
+
+Node = collections.namedtuple("Node", ["name", "requires", "function", "options"])
+
+_nodes = collections.OrderedDict()
+
+all_parameters = analysis.quality_parameters + analysis.gradient_parameters
+
+# The node and the index of the node result, that every quality parameter
+# is read from. An index of None means that the node result is the value.
+_outputs = {
+    "tEntropy": ("entropy", None),
+    "tBrenner": ("brenner", None),
+    "fMoments": ("moments", None),
+    "fMean": ("tail", 0),
+    "fSTD": ("tail", 1),
+    "fEntropy": ("tail", 2),
+    "fTh": ("tail", 3),
+    "fMaxPw": ("tail", 4),
+    "Skew": ("tail", 5),
+    "Kurtosis": ("tail", 6),
+    "MeanBin": ("tail", 7),
+    "tBrenner2D": ("brenner2d", None),
+    "tTenengrad": ("tenengrad", None),
+    "tLaplacian": ("laplacian", None)
+}
+
+
+def get_options(parser):
+    """
+    Command-line options for selecting the quality parameters
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Metrics", "Options for selecting the calculated quality parameters"
+    )
+    group.add_argument(
+        "--metrics",
+        nargs="+",
+        choices=["all", "auto"] + all_parameters,
+        default=["all"],
+        help="The quality parameters that are calculated in the directory "
+             "mode. all stands for the standard parameters and auto for "
+             "the parameters that the --result ranking variable requires. "
+             "The gradient measures are only calculated when selected."
+    )
+    return parser
+
+
+def register_node(name, requires=(), options=()):
+    """
+    A decorator for adding a node into the metric graph. The node function
+    is called as function(image, options, values), where values is a
+    dictionary of the results of the required nodes. options is a list of
+    the names of the command line options, that the node result depends on
+    (in addition to those of the required nodes) and that can be swept.
+    """
+    def decorator(function):
+        _nodes[name] = Node(name, tuple(requires), function, tuple(options))
+        return function
+    return decorator
+
+
+def parse_metrics(metrics, result="average"):
+    """
+    Parse the --metrics option value.
+
+    :param metrics: A list of quality parameter names, or ["all"]/["auto"]
+    :param result:  The --result ranking variable, used with "auto"
+    :return:        A list of quality parameter names, in the order of
+                    all_parameters
+    """
+    if metrics is None:
+        return list(analysis.quality_parameters)
+    selected = set(metrics)
+    if "all" in selected:
+        selected.remove("all")
+        selected.update(analysis.quality_parameters)
+    if "auto" in selected:
+        selected.remove("auto")
+        selected.update(analysis.result_parameters[result])
+    return [name for name in all_parameters if name in selected]
+
+
+def resolve_nodes(metrics):
+    """
+    Find the nodes that are needed for calculating a set of quality
+    parameters.
+
+    :return:    A list of node names, in the order of calculation
+    """
+    needed = set()
+    pending = [_outputs[name][0] for name in metrics]
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(_nodes[name].requires)
+    return [name for name in _nodes if name in needed]
+
+
+class MetricGraph(object):
+    """
+    Calculates a selected set of quality parameters for grayscale images.
+    """
+
+    def __init__(self, metrics, options):
+        assert all(name in _outputs for name in metrics), "Unknown metric in %s" % metrics
+        self.metrics = [name for name in all_parameters if name in metrics]
+        self.options = options
+        self.nodes = resolve_nodes(self.metrics)
+
+    def evaluate(self, image):
+        """
+        Calculate the quality parameters of an image.
+
+        :param image:   A grayscale MyImage object
+        :return:        A list of the quality parameter values, in the
+                        order of self.metrics
+        """
+        values = {}
+        for name in self.nodes:
+            values[name] = _nodes[name].function(image, self.options, values)
+
+        return self.get_results(values)
+
+    def get_results(self, values):
+        results = []
+        for metric in self.metrics:
+            name, index = _outputs[metric]
+            results.append(values[name] if index is None else values[name][index])
+        return results
+
+    def get_dependent_nodes(self, names):
+        """
+        Returns the nodes whose results depend on the given options, directly
+        or through the nodes they require.
+
+        :return:    A dictionary of the node names, and the names of the given
+                    options that each of them depends on
+        """
+        dependent = {}
+        for name in self.nodes:
+            node = _nodes[name]
+            depends = set(node.options) & set(names)
+            for required in node.requires:
+                depends.update(dependent.get(required, ()))
+            if depends:
+                dependent[name] = sorted(depends)
+        return dependent
+
+    def evaluate_sweep(self, image, settings):
+        """
+        Calculate the quality parameters of an image with several settings
+        of the command line options. The nodes that do not depend on the
+        swept options are calculated only once.
+
+        :param image:       A grayscale MyImage object
+        :param settings:    A list of dictionaries of option values, e.g.
+                            [{"power_threshold": 0.3}, {"power_threshold": 0.4}]
+        :return:            A list of results (see evaluate()) for every setting
+        """
+        names = set(name for setting in settings for name in setting)
+        dependent = self.get_dependent_nodes(names)
+        setting_options = []
+        for setting in settings:
+            options = copy.copy(self.options)
+            for name, value in setting.items():
+                setattr(options, name, value)
+            setting_options.append(options)
+
+        shared = {}
+        values = [collections.ChainMap({}, shared) for setting in settings]
+        # The nodes are calculated in the same order as in evaluate(), as
+        # some of them modify the image. A dependent node is calculated once
+        # for every distinct combination of the options it depends on.
+        for name in self.nodes:
+            function = _nodes[name].function
+            if name in dependent:
+                calculated = {}
+                for options, setting_values in zip(setting_options, values):
+                    key = tuple(getattr(options, option) for option in dependent[name])
+                    if key not in calculated:
+                        calculated[key] = function(image, options, setting_values)
+                    setting_values[name] = calculated[key]
+            else:
+                shared[name] = function(image, self.options, shared)
+        return [self.get_results(setting_values) for setting_values in values]
+
+
+@register_node("smoothed")
+def calculate_smoothed_image(image, options, values):
+    """
+    The mean smoothed image, that the mask of the entropy calculation is
+    based on, or None if the mask is not used.
+    """
+    if not options.use_mask:
+        return None
+    task = filters.LocalImageQuality(image, options)
+    task.set_smoothing_kernel_size(100)
+    task.run_mean_smoothing()
+    return task.data_temp
+
+
+@register_node("mask", requires=["smoothed"], options=["spatial_threshold", "invert_mask"])
+def calculate_mask(image, options, values):
+    """
+    The smoothed image based sampling positions of the entropy calculation,
+    or None if the mask is not used.
+    """
+    if values["smoothed"] is None:
+        return None
+    task = filters.LocalImageQuality(image, options)
+    task.data_temp = values["smoothed"]
+    return task.find_sampling_positions()
+
+
+@register_node("entropy", requires=["mask"])
+def calculate_entropy(image, options, values):
+    task = filters.LocalImageQuality(image, options)
+    task.data_temp = image[:]
+    return task.calculate_entropy(mask=values["mask"])
+
+
+@register_node("fft")
+def calculate_power_spectrum(image, options, values):
+    """
+    The 2D power spectrum. The FrequencyQuality filter is returned, as it
+    holds the spectrum.
+    """
+    task = filters.FrequencyQuality(image, options)
+    task.calculate_power_spectrum()
+    return task
+
+
+@register_node("spectrum", requires=["fft"])
+def calculate_simple_power(image, options, values):
+    """
+    The 1D power spectrum, as a [frequencies, power] list
+    """
+    task = values["fft"]
+    if options.power_averaging == "radial":
+        task.calculate_radial_average()
+    elif options.power_averaging == "additive":
+        task.calculate_summed_power()
+    else:
+        raise NotImplementedError
+    return task.get_power_spectrum()
+
+
+@register_node("moments", requires=["spectrum"])
+def calculate_spectral_moments(image, options, values):
+    """
+    The spectral moments measure, see filters.SpectralMoments
+    """
+    return spectra.calculate_spectral_moments(values["spectrum"][1])
+
+
+@register_node("tail", requires=["spectrum"], options=["power_threshold"])
+def calculate_tail_statistics(image, options, values):
+    return filters.calculate_tail_statistics(values["spectrum"], options.power_threshold)
+
+
+@register_node("brenner")
+def calculate_brenner(image, options, values):
+    task = filters.BrennerImageQuality(image, options)
+    return task.calculate_brenner_quality()
+
+
+@register_node("brenner2d")
+def calculate_brenner_2d(image, options, values):
+    task = filters.BrennerImageQuality(image, options)
+    return task.calculate_brenner_2d_quality()
+
+
+@register_node("tenengrad")
+def calculate_tenengrad(image, options, values):
+    task = filters.BrennerImageQuality(image, options)
+    return task.calculate_tenengrad_quality()
+
+
+@register_node("laplacian")
+def calculate_laplacian(image, options, values):
+    task = filters.BrennerImageQuality(image, options)
+    return task.calculate_laplacian_quality()
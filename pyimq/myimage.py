@@ -18,6 +18,8 @@ from PIL.TiffImagePlugin import X_RESOLUTION, Y_RESOLUTION
 from matplotlib import pyplot as plt
 from math import log10, ceil, floor
 
+from pyimq import archives, decoders, resize, normalize, report, faults
+
 
 def get_options(parser):
     """
@@ -41,6 +43,50 @@ def get_options(parser):
         type=int,
         choices=[0, 1, 2],
         default=1
+    )
+    group.add_argument(
+        "--decoder",
+        help="Select the image decoder. By default the fastest available "
+             "decoder is used for every file type.",
+        choices=["auto"] + decoders.get_decoder_names(),
+        default="auto"
+    )
+    group.add_argument(
+        "--jpeg-draft",
+        help="Decode JPEG images at a reduced size (1/2, 1/4 or 1/8), which "
+             "is considerably faster. Intended for quick preview scoring.",
+        dest="jpeg_draft",
+        type=int,
+        choices=[1, 2, 4, 8],
+        default=1
+    )
+    group.add_argument(
+        "--decode-workers",
+        help="Number of threads used for decoding images in batch mode (or "
+             "processes, with --image-timeout)",
+        dest="decode_workers",
+        type=int,
+        default=1
+    )
+    group.add_argument(
+        "--rescale",
+        help="Rescale the image intensities to a range MIN MAX (float32) "
+             "when the images are loaded",
+        nargs=2,
+        type=float,
+        metavar=("MIN", "MAX"),
+        default=None
+    )
+    group.add_argument(
+        "--channels",
+        help="Analyze several channels of a multi-channel image (RGB or "
+             "multi-page TIFF) in a single pass. Give a list of channel "
+             "indexes, or \"all\". Overrides --rgb-channel in batch mode. "
+             "The pages of a multi-page grayscale TIFF are only treated as "
+             "channels with this option; otherwise the first page is analyzed. "
+             "Images that do not have all the channels are skipped.",
+        nargs="+",
+        default=None
     )
      # File filtering for batch mode processing
     parser.add_argument(
@@ -60,54 +106,185 @@ def get_options(parser):
     return parser
 
 
+def parse_channels(channels):
+    """
+    Parse the --channels option value.
+
+    :param channels:    A list of strings, or None
+    :return:            A list of channel indexes, ["all"] or [None] if the
+                        option was not set.
+    """
+    if channels is None:
+        return [None]
+    if "all" in channels:
+        return ["all"]
+    return [int(channel) for channel in channels]
+
+
+def get_image_channels(channels, image):
+    """
+    Returns the channel indexes that are to be analyzed from an image.
+
+    :param channels:    The result of parse_channels()
+    :param image:       A MyImage object
+    """
+    if channels == ["all"]:
+        return list(range(image.get_channel_count()))
+    return channels
+
+
+def load_images(paths, options, errors=None, stage="decode", reuse_buffer=False):
+    """
+    A generator for loading a series of images in batch mode, according
+    to the image I/O command line options. If options.decode_workers is
+    larger than one, several images are decoded in parallel.
+    :param paths:           A list of image paths
+    :param options:         Command line options
+    :param errors:          An optional faults.ErrorLog. If given, images that
+                            can not be loaded (after options.retries retries)
+                            are recorded in it and skipped, instead of raising
+                            an error.
+    :param stage:           The stage name of the errors
+    :param reuse_buffer:    With --rescale, write the rescaled images of the
+                            same shape into a single buffer (see
+                            normalize.Normalizer). An image is then only valid
+                            until the next one is loaded, so this can only be
+                            used if the images are not kept.
+    :return:                A generator of (path, MyImage) tuples
+    """
+    if options.imagej:
+        for path in paths:
+            image = try_load(MyImage.get_image_from_imagej_tiff, path, options, errors,
+                             stage, rescale=options.rescale)
+            if image is not None:
+                yield path, image
+        return
+
+    kwargs = dict(
+        channel=None if options.channels else options.rgb_channel,
+        draft=options.jpeg_draft,
+        decoder=options.decoder,
+        page_channels=bool(options.channels)
+    )
+    if errors is None:
+        images = decoders.imap(paths, workers=options.decode_workers, **kwargs)
+    else:
+        # The time limit only works in the main thread, so with a limit the
+        # images are decoded in worker processes instead of threads
+        images = decoders.imap(paths, workers=options.decode_workers, target=try_decode,
+                               processes=options.image_timeout > 0,
+                               process_timeout=options.image_timeout * (options.retries + 1),
+                               retries=options.retries, timeout=options.image_timeout,
+                               **kwargs)
+    rescale = None
+    if options.rescale is not None:
+        rescale = normalize.Normalizer(*options.rescale) if reuse_buffer else \
+            lambda data: normalize.rescale_to_min_max(data, *options.rescale)
+    for path, data in images:
+        if isinstance(data, Exception):
+            errors.add(path, stage, options.retries + 1, data)
+            continue
+        if rescale is not None:
+            data = rescale(data)
+        yield path, MyImage(images=data, spacing=[1, 1], copy=False)
+
+
+def try_decode(path, retries=0, timeout=0, **kwargs):
+    """
+    Decode an image, with retries. Instead of raising an error, the last
+    error is returned, if the image could not be decoded.
+    """
+    for attempt in range(retries + 1):
+        try:
+            with faults.time_limit(timeout):
+                return decoders.decode(path, **kwargs)
+        except Exception as error:
+            failure = error
+    return failure
+
+
+def try_load(function, path, options, errors=None, stage="decode", **kwargs):
+    """
+    Load an image with a loader function, with retries. If errors is given,
+    a failed image is recorded in it and None is returned.
+    """
+    if errors is None:
+        return function(path, **kwargs)
+    for attempt in range(options.retries + 1):
+        try:
+            with faults.time_limit(options.image_timeout):
+                return function(path, **kwargs)
+        except Exception as error:
+            failure = error
+    errors.add(path, stage, options.retries + 1, failure)
+    return None
+
+
 class MyImage(object):
     """
     A very simple class to contain image data
     """
 
     @classmethod
-    def get_image_from_imagej_tiff(cls, path):
+    def get_image_from_imagej_tiff(cls, path, rescale=None):
         """
         A class method for opening a ImageJ tiff file. Using this method
         will enable the use of correct pixel size during analysis.
-        :param path: Path to an image
-        :return:     An object of the MyImage class
+        :param path:    Path to an image
+        :param rescale: An optional (min, max) tuple. If given, the image
+                        intensities are rescaled to the range (float32).
+        :return:        An object of the MyImage class
         """
-        assert os.path.isfile(path)
+        assert archives.exists(path)
         assert path.endswith(('.tif', '.tiff'))
 
-        image = Image.open(path)
+        image = Image.open(archives.open_source(path))
 
-        xresolution = image.tag.tags[X_RESOLUTION][0][0]
-        yresolution = image.tag.tags[Y_RESOLUTION][0][0]
+        xresolution = float(image.tag_v2[X_RESOLUTION])
+        yresolution = float(image.tag_v2[Y_RESOLUTION])
 
-        #data = utils.rescale_to_min_max(numpy.array(image), 0, 255)
+        data = numpy.array(image)
+        if rescale is not None:
+            data = normalize.rescale_to_min_max(data, *rescale)
 
         if data.shape[0] == 1:
             data = data[0]
 
-        return cls(images=data, spacing=[1.0/xresolution, 1.0/yresolution])
+        return cls(images=data, spacing=[1.0/xresolution, 1.0/yresolution], copy=False)
 
     @classmethod
-    def get_generic_image(cls, path):
+    def get_generic_image(cls, path, channel=None, decoder="auto", draft=1, rescale=None):
         """
         A class method for opening all kinds of images. No attempt is made
         to read any tags, as most image formats do not have them. The idea
         was to keep this very simple and straightforward.
-        :param path: Path to an image
-        :return:     An object of the MyImage class
+        :param path:    Path to an image
+        :param channel: Decode only a single channel of a multi-channel image
+        :param decoder: Name of the decoder, see the decoders module
+        :param draft:   JPEG draft mode reduction factor
+        :param rescale: An optional (min, max) tuple. If given, the image
+                        intensities are rescaled to the range (float32).
+        :return:        An object of the MyImage class
         """
-        assert os.path.isfile(path)
+        assert archives.exists(path)
 
-        image = numpy.array(Image.open(path))
-        #image = utils.rescale_to_min_max(image, 0, 255)
+        image = decoders.decode(path, channel=channel, draft=draft, decoder=decoder)
+        if rescale is not None:
+            image = normalize.rescale_to_min_max(image, *rescale)
 
-        return cls(images=image, spacing=[1, 1])
+        return cls(images=image, spacing=[1, 1], copy=False)
 
 
-    def __init__(self, images=None, spacing=None):
-
-        self.images = numpy.array(images)
+    def __init__(self, images=None, spacing=None, copy=True):
+        """
+        :param images:  The image data
+        :param spacing: The pixel size
+        :param copy:    If False, a Numpy array is used as it is, instead of
+                        copying it. The image is then a view to the original
+                        data (e.g. to a shared memory buffer), which must not
+                        be released or modified while the image is in use.
+        """
+        self.images = numpy.array(images) if copy else numpy.asarray(images)
         self.spacing = list(spacing)
 
         power = log10(spacing[0])
@@ -153,6 +330,9 @@ class MyImage(object):
         """
         Show a plot of the image
         """
+        if report.is_active():
+            report.show_image(self.images)
+            return
         plt.imshow(self.images, cmap=plt.cm.binary)
         plt.show()
 
@@ -163,6 +343,12 @@ class MyImage(object):
         """
         return MyImage(self.images[:, :, channel], self.spacing)
 
+    def get_channel_count(self):
+        """
+        Returns the number of channels in the image.
+        """
+        return self.images.shape[2] if self.is_rgb() else 1
+
     def get_array(self):
         return self.images
 
@@ -206,18 +392,23 @@ class MyImage(object):
             diff = 0.5*(dims[1]-dims[0])
             self.images = self.images[:, int(floor(diff)): -int(ceil(diff))]
 
-    def resize(self, size):
+    def resize(self, size, method="cubic"):
         """
-        Resize the image, using cubic interpolation.
+        Resize the image, using cubic interpolation by default. Faster
+        methods are available in the resize module.
 
-        :param size: A tuple of new image dimensions.
+        :param size:    A tuple of new image dimensions.
+        :param method:  One of resize.resize_methods
 
         """
         assert isinstance(size, tuple)
         zoom = [float(a)/b for a, b in zip(size, self.images.shape)]
         print("The zoom is %s" % zoom)
 
-        self.images = itp.zoom(self.images, tuple(zoom), order=3)
+        if method == "cubic":
+            self.images = itp.zoom(self.images, tuple(zoom), order=3)
+        else:
+            self.images = resize.resize(self.images, size, method)
 
 
 
@@ -0,0 +1,102 @@
+"""
+File:        normalize.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Vectorized intensity normalization functions for the PyImageQuality
+software. The minimum and maximum values of all the channels of an
+RGB image are calculated with a single reduction, and the result can
+be written into a preallocated (e.g. float32) output buffer, so that
+the input data is never modified. The Normalizer class keeps such a
+buffer for reuse in batch pipelines.
+"""
+
+import numpy
+
+
+def get_channel_min_max(data):
+    """
+    Calculate the minimum and maximum values of every channel of an image.
+
+    :param data:    A 2D (grayscale) or 3D (channels last) Numpy array
+    :return:        Two arrays, with one value per channel (0-dimensional
+                    arrays for grayscale images)
+    """
+    axes = (0, 1) if data.ndim == 3 else None
+    return numpy.min(data, axis=axes), numpy.max(data, axis=axes)
+
+
+def get_rescale_factors(minima, maxima, data_min, data_max, per_channel=False):
+    """
+    Calculate the multiplication factors for rescale_to_min_max(). A channel
+    is scaled to data_max if its largest absolute value is positive (or
+    data_min is zero), and to data_min otherwise.
+
+    :param minima:      Channel minimum values
+    :param maxima:      Channel maximum values
+    :param data_min:    Minimum pixel value of the result
+    :param data_max:    Maximum pixel value of the result
+    :param per_channel: If True, every channel is scaled to its own extreme
+                        value. By default all the channels are scaled with
+                        the extreme values of the whole image, which keeps
+                        the color balance of RGB images.
+    :return:            An array of factors, one per channel
+    """
+    if per_channel:
+        scale_min, scale_max = minima, maxima
+    else:
+        scale_min, scale_max = minima.min(), maxima.max()
+    scale_min = numpy.where(scale_min == 0, 1, scale_min).astype(numpy.float64)
+    scale_max = numpy.where(scale_max == 0, 1, scale_max).astype(numpy.float64)
+
+    use_max = (numpy.abs(maxima) > numpy.abs(minima)) | (data_min == 0)
+    return numpy.where(use_max, data_max / scale_max, data_min / scale_min)
+
+
+def rescale_to_min_max(data, data_min, data_max, out=None, dtype=numpy.float32,
+                       per_channel=False):
+    """
+    Rescale image intensities to a range defined by the data_min and data_max
+    input parameters. The input array is not modified, unless it is given as
+    the out parameter as well.
+
+    :param data:        Input image (Numpy array)
+    :param data_min:    Minimum pixel value
+    :param data_max:    Maximum pixel value
+    :param out:         A floating point output array with the same shape as
+                        the data. If None, a new array is created.
+    :param dtype:       Data type of the new output array
+    :param per_channel: See get_rescale_factors()
+    :return:            The rescaled array
+    """
+    if out is None:
+        out = numpy.empty(data.shape, dtype=dtype)
+    assert out.shape == data.shape, "The output array has a wrong shape"
+    assert out.dtype.kind == "f", "The output array must be a floating point array"
+
+    minima, maxima = get_channel_min_max(data)
+    factors = get_rescale_factors(minima, maxima, data_min, data_max, per_channel)
+    numpy.multiply(data, factors, out=out, casting="same_kind")
+    return out
+
+
+class Normalizer(object):
+    """
+    A reusable intensity normalization stage for batch pipelines. The
+    output buffer is reused for consecutive images of the same shape, so
+    please make sure to copy the result if it needs to be kept after the
+    next image has been normalized.
+    """
+
+    def __init__(self, data_min, data_max, dtype=numpy.float32, per_channel=False):
+        self.data_min = data_min
+        self.data_max = data_max
+        self.dtype = dtype
+        self.per_channel = per_channel
+        self.buffer = None
+
+    def __call__(self, data):
+        if self.buffer is None or self.buffer.shape != data.shape:
+            self.buffer = numpy.empty(data.shape, dtype=self.dtype)
+        return rescale_to_min_max(data, self.data_min, self.data_max,
+                                  out=self.buffer, per_channel=self.per_channel)
@@ -0,0 +1,194 @@
+"""
+File:        progress.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Progress and throughput telemetry for the batch runs of the
+PyImageQuality software. Instead of a line per image, a progress line is
+printed at a fixed interval, with the number of scored and skipped
+images, the throughput in images/s and in decoded MB/s, the estimated
+time to completion and the utilisation of the scoring workers (the
+fraction of the time that the workers spent scoring images).
+
+The same numbers can be written into a JSON-lines file (one record per
+update), and into a text file in the Prometheus exposition format, that
+e.g. the node exporter textfile collector can pick up. The Prometheus
+file is replaced atomically at every update.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import time
+
+
+def get_options(parser):
+    """
+    Command-line options for the progress telemetry
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Progress", "Options for the progress and throughput reporting of batch runs"
+    )
+    group.add_argument(
+        "--progress-interval",
+        dest="progress_interval",
+        type=float,
+        default=10,
+        help="Interval of the progress updates (seconds)"
+    )
+    group.add_argument(
+        "--telemetry",
+        default=None,
+        help="Append the progress updates into a JSON-lines file"
+    )
+    group.add_argument(
+        "--prometheus",
+        default=None,
+        help="Write the progress into a Prometheus text format file"
+    )
+    group.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print a line for every analyzed image"
+    )
+    return parser
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "-"
+    return str(datetime.timedelta(seconds=int(round(seconds))))
+
+
+class Progress(object):
+    """
+    Keeps track of the progress of a batch run.
+    """
+
+    def __init__(self, total, interval=10, telemetry=None, prometheus=None,
+                 errors=None, scorer=None):
+        """
+        :param total:       The number of images in the run
+        :param interval:    The interval of the updates (seconds)
+        :param telemetry:   Path to a JSON-lines file, or None
+        :param prometheus:  Path to a Prometheus text file, or None
+        :param errors:      A faults.ErrorLog, for counting the skipped images
+        :param scorer:      A batch scorer, for the worker utilisation
+        """
+        self.total = total
+        self.interval = interval
+        self.telemetry = telemetry
+        self.prometheus = prometheus
+        self.errors = errors
+        self.scorer = scorer
+        self.started = time.time()
+        self.updated = self.started
+        self.scored = 0
+        self.filtered = 0
+        self.decoded_bytes = 0
+
+    def add_decoded(self, image):
+        """
+        Count a decoded image (a MyImage)
+        """
+        self.decoded_bytes += image.get_array().nbytes
+
+    def add_scored(self):
+        self.scored += 1
+        self.check()
+
+    def add_filtered(self):
+        """
+        Count an image that was left out of the analysis (--average-filter)
+        """
+        self.filtered += 1
+        self.check()
+
+    def check(self):
+        if time.time() - self.updated >= self.interval:
+            self.update()
+
+    def get_status(self):
+        """
+        Returns a dictionary of the current progress values.
+        """
+        now = time.time()
+        elapsed = max(now - self.started, 1e-9)
+        skipped = self.errors.count if self.errors is not None else 0
+        done = self.scored + self.filtered + skipped
+        rate = done / elapsed
+        remaining = max(self.total - done, 0)
+        utilisation = None
+        if self.scorer is not None:
+            utilisation = self.scorer.busy_time / (elapsed * self.scorer.worker_count)
+        return {
+            "time": now,
+            "elapsed": elapsed,
+            "total": self.total,
+            "scored": self.scored,
+            "skipped": skipped,
+            "filtered": self.filtered,
+            "images_per_second": rate,
+            "megabytes_per_second": self.decoded_bytes / elapsed / 1e6,
+            "decoded_bytes": self.decoded_bytes,
+            "eta": remaining / rate if rate > 0 else None,
+            "utilisation": utilisation
+        }
+
+    def update(self):
+        """
+        Print the progress, and write it into the telemetry files.
+        """
+        self.updated = time.time()
+        status = self.get_status()
+        done = status["scored"] + status["filtered"] + status["skipped"]
+        line = "Progress: %i/%i images (%.1f%%), %i skipped, %.2f images/s, %.1f MB/s, ETA %s" % (
+            done, self.total, 100.0 * done / self.total if self.total else 100.0,
+            status["skipped"], status["images_per_second"], status["megabytes_per_second"],
+            format_duration(status["eta"]))
+        if status["utilisation"] is not None:
+            line += ", utilisation %.0f%%" % (100 * status["utilisation"])
+        print(line)
+
+        if self.telemetry is not None:
+            with open(self.telemetry, "at") as telemetry_file:
+                telemetry_file.write(json.dumps(status) + "\n")
+        if self.prometheus is not None:
+            self.write_prometheus(status)
+
+    def write_prometheus(self, status):
+        metrics = [
+            ("pyimq_images_expected", "gauge", "Number of images in the run", status["total"]),
+            ("pyimq_images_scored_total", "counter", "Number of scored images", status["scored"]),
+            ("pyimq_images_skipped_total", "counter", "Number of skipped images", status["skipped"]),
+            ("pyimq_images_filtered_total", "counter", "Number of images left out by the average filter",
+             status["filtered"]),
+            ("pyimq_decoded_bytes_total", "counter", "Number of decoded bytes", status["decoded_bytes"]),
+            ("pyimq_elapsed_seconds", "gauge", "Duration of the run", status["elapsed"]),
+            ("pyimq_images_per_second", "gauge", "Image throughput",
+             status["images_per_second"]),
+            ("pyimq_decoded_megabytes_per_second", "gauge", "Decoding throughput",
+             status["megabytes_per_second"]),
+            ("pyimq_eta_seconds", "gauge", "Estimated time to completion",
+             status["eta"] if status["eta"] is not None else float("nan")),
+            ("pyimq_worker_utilisation", "gauge", "Fraction of time the workers were busy",
+             status["utilisation"] if status["utilisation"] is not None else float("nan"))
+        ]
+        temporary = self.prometheus + ".tmp"
+        with open(temporary, "wt") as prometheus_file:
+            for name, kind, description, value in metrics:
+                prometheus_file.write("# HELP %s %s\n# TYPE %s %s\n%s %s\n" % (
+                    name, description, name, kind, name, repr(float(value))))
+        os.replace(temporary, self.prometheus)
+
+    def finish(self):
+        """
+        Write the final update, and print a summary.
+        """
+        self.update()
+        status = self.get_status()
+        print("Analyzed %i images in %.1f s (%.2f images/s, %.1f MB/s)" % (
+            status["scored"], status["elapsed"],
+            status["images_per_second"], status["megabytes_per_second"]))
@@ -0,0 +1,241 @@
+"""
+File:        report.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A headless report mode for the PyImageQuality software. Normally the
+plots (--show-plots, the best/worst image collages of the plot mode
+etc.) are shown on screen with the blocking plt.show(). In the report
+mode the plots are instead sent to a separate worker process, that
+renders them into PNG files with the non-interactive Agg backend, and
+writes an HTML page that shows all of them. The scoring process only
+puts small jobs into a queue: large images are replaced by thumbnails
+before sending, and the collage images are read (as thumbnails) by the
+worker itself. Reporting thus never stalls the analysis, and it works
+on cluster nodes without a display.
+
+The report is started with start() and finished with stop(). While
+the report is active, the plotting functions of the other modules
+call the functions below instead of plt.show().
+"""
+
+import argparse
+import os
+import re
+import multiprocessing
+from html import escape
+
+import numpy
+
+from pyimq import thumbnails
+
+
+_worker = None
+
+
+def get_options(parser):
+    """
+    Command-line options for the headless report mode
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Report", "Options for rendering the plots into files"
+    )
+    group.add_argument(
+        "--report",
+        help="Render the plots into PNG files and an HTML page in a "
+             "background process, instead of showing them on screen",
+        action="store_true"
+    )
+    return parser
+
+
+def is_active():
+    return _worker is not None
+
+
+def start(output_dir, thumbnail_size=thumbnails.thumbnail_size, title="PyIQ report",
+          cache_dir=None, cache_bytes=256 * 1024 * 1024):
+    """
+    Start the report worker process.
+
+    :param output_dir:      The directory, where the PNG files and the
+                            index.html file are written
+    :param thumbnail_size:  The size of the image thumbnails
+    :param title:           Title of the HTML page
+    :param cache_dir:       A thumbnail cache directory, or None
+    :param cache_bytes:     Maximum size of the thumbnail cache
+    """
+    global _worker
+    assert _worker is None, "The report has already been started"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=run_worker,
+        args=(queue, output_dir, thumbnail_size, title, cache_dir, cache_bytes))
+    process.daemon = True
+    process.start()
+    _worker = (queue, process, output_dir, thumbnail_size)
+
+
+def stop():
+    """
+    Wait until all the plots have been rendered, and stop the worker.
+
+    :return:    Path to the HTML page, or None if the report was not active
+    """
+    global _worker
+    if _worker is None:
+        return None
+    queue, process, output_dir, thumbnail_size = _worker
+    queue.put(None)
+    process.join()
+    _worker = None
+    return os.path.join(output_dir, "index.html")
+
+
+def submit(kind, title, *args):
+    assert _worker is not None, "The report has not been started"
+    _worker[0].put((kind, title, args))
+
+
+def show_collage(filenames, title="Image collage"):
+    """
+    Add a collage of images, that are read from disk, into the report.
+    """
+    submit("collage", title, [str(name) for name in filenames])
+
+
+def show_image(data, title="Image"):
+    """
+    Add an image into the report. Only a thumbnail is sent to the worker.
+    """
+    submit("image", title, thumbnails.make_thumbnail(numpy.asarray(data), _worker[3]))
+
+
+def show_plot(x, y, title="Plot", xlabel="", ylabel="", log=False):
+    """
+    Add a line plot into the report.
+    """
+    submit("plot", title, numpy.asarray(x), numpy.asarray(y), xlabel, ylabel, log)
+
+
+def show_spectrum(power, simple_power=None, title="Power spectrum"):
+    """
+    Add a 2D power spectrum, and optionally a 1D power spectrum, into the
+    report.
+    """
+    preview = None
+    if power is not None:
+        preview = thumbnails.make_thumbnail(numpy.log10(power), _worker[3])
+    submit("spectrum", title, preview, simple_power)
+
+
+def get_file_name(index, title):
+    return "%03i_%s.png" % (index, re.sub(r"[^A-Za-z0-9]+", "_", title).strip("_").lower())
+
+
+def render_collage(figure, images, names, title):
+    """
+    Draw a collage of images on a figure, in a square grid.
+    """
+    columns = max(1, int(numpy.ceil(numpy.sqrt(len(images)))))
+    rows = max(1, int(numpy.ceil(float(len(images)) / columns)))
+    for index, (image, name) in enumerate(zip(images, names)):
+        axes = figure.add_subplot(rows, columns, index + 1)
+        axes.imshow(image, cmap="hot")
+        axes.set_title(name, fontsize=8)
+        axes.axis("off")
+    figure.suptitle(title, size=16)
+
+
+def render_job(figure, kind, title, args, thumbnail_size, cache=None):
+    """
+    Draw a report job on a figure.
+    """
+    if kind == "collage":
+        images = []
+        names = []
+        for path in args[0]:
+            if cache is not None:
+                images.append(cache.load(path, thumbnail_size))
+            else:
+                images.append(thumbnails.load_thumbnail(path, thumbnail_size))
+            names.append(os.path.basename(path))
+        render_collage(figure, images, names, title)
+    elif kind == "image":
+        axes = figure.add_subplot(1, 1, 1)
+        axes.imshow(args[0], cmap="binary")
+        axes.axis("off")
+        axes.set_title(title)
+    elif kind == "plot":
+        x, y, xlabel, ylabel, log = args
+        axes = figure.add_subplot(1, 1, 1)
+        axes.plot(x, y, linewidth=2, color="red")
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        if log:
+            axes.set_yscale("log")
+        axes.set_title(title)
+    elif kind == "spectrum":
+        preview, simple_power = args
+        axes = figure.add_subplot(1, 2, 1)
+        if preview is not None:
+            axes.imshow(preview)
+        axes.axis("off")
+        axes = figure.add_subplot(1, 2, 2)
+        if simple_power is not None:
+            axes.plot(simple_power[0], simple_power[1], linewidth=1)
+            axes.set_yscale("log")
+        figure.suptitle(title)
+    else:
+        raise NotImplementedError("Unknown report job %s" % kind)
+
+
+def write_html(path, title, entries):
+    """
+    Write an HTML page that shows the rendered plots.
+    """
+    title = escape(title)
+    with open(path, "wt") as html_file:
+        html_file.write("<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+                        "<title>%s</title></head><body>\n<h1>%s</h1>\n" % (title, title))
+        for entry_title, file_name in entries:
+            html_file.write("<h2>%s</h2>\n<img src=\"%s\" alt=\"%s\">\n" % (
+                escape(entry_title), file_name, escape(entry_title)))
+        html_file.write("</body></html>\n")
+
+
+def run_worker(queue, output_dir, thumbnail_size, title, cache_dir=None, cache_bytes=0):
+    """
+    The report worker process. Renders the jobs from the queue, until None
+    is received.
+    """
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+    from matplotlib import pyplot as plt
+
+    cache = None
+    if cache_dir is not None:
+        cache = thumbnails.ThumbnailCache(cache_dir, cache_bytes)
+
+    entries = []
+    while True:
+        job = queue.get()
+        if job is None:
+            break
+        kind, job_title, args = job
+        file_name = get_file_name(len(entries), job_title)
+        figure = plt.figure(figsize=(10, 10) if kind == "collage" else (10, 5))
+        try:
+            render_job(figure, kind, job_title, args, thumbnail_size, cache)
+            figure.savefig(os.path.join(output_dir, file_name), dpi=100)
+            entries.append((job_title, file_name))
+        except Exception as error:
+            print("Could not render %s: %s" % (job_title, error))
+        finally:
+            plt.close(figure)
+    if cache is not None:
+        cache.close()
+    write_html(os.path.join(output_dir, "index.html"), title, entries)
@@ -0,0 +1,144 @@
+"""
+File:        resize.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Image resizing methods for the PyImageQuality software. Cubic spline
+interpolation (scipy.ndimage.zoom) is accurate, but slow and it does
+not low-pass filter the image when downscaling, which causes aliasing
+at high frequencies -- exactly where the power spectrum based quality
+parameters are calculated. The faster alternatives here are:
+
+-   bin:        Integer block-mean binning. Only exact integer
+                reduction factors are supported.
+-   antialias:  Separable resampling with a triangle filter, that is
+                stretched by the reduction factor, so that every output
+                pixel is a weighted average of the input pixels under it.
+                The resampling is done with two matrix products.
+-   fourier:    Cropping of the centered Fourier transform. The power
+                spectrum of the result is exactly the low-frequency part
+                of the original power spectrum.
+-   auto:       bin for exact integer factors, antialias otherwise.
+"""
+
+import numpy
+from scipy import ndimage, fftpack
+
+
+resize_methods = ["cubic", "bin", "antialias", "fourier", "auto"]
+
+
+def get_integer_factors(shape, size):
+    """
+    Returns the integer reduction factors for resizing an image of a given
+    shape into size, or None if the factors are not exact integers.
+    """
+    factors = []
+    for old, new in zip(shape, size):
+        if new > old or old % new != 0:
+            return None
+        factors.append(old // new)
+    return factors
+
+
+def block_mean(data, factors):
+    """
+    Downscale an image by averaging blocks of pixels.
+
+    :param data:    A 2D Numpy array
+    :param factors: Integer reduction factors for both dimensions. If the
+                    image dimensions are not divisible by the factors, the
+                    remaining pixels at the end are discarded.
+    :return:        The downscaled image (float64)
+    """
+    rows = data.shape[0] // factors[0]
+    columns = data.shape[1] // factors[1]
+    blocks = data[:rows * factors[0], :columns * factors[1]].reshape(
+        rows, factors[0], columns, factors[1])
+    return blocks.mean(axis=(1, 3))
+
+
+def get_resampling_matrix(old, new):
+    """
+    Create a (new x old) matrix for resampling a signal of length old into
+    length new with a triangle filter. When downscaling, the filter support
+    is stretched by the reduction factor, which makes the filter act as an
+    anti-aliasing low-pass filter.
+    """
+    scale = float(old) / new
+    support = max(scale, 1.0)
+    centers = (numpy.arange(new) + 0.5) * scale - 0.5
+    positions = numpy.arange(old)
+    weights = 1.0 - numpy.abs(positions[numpy.newaxis, :] - centers[:, numpy.newaxis]) / support
+    numpy.clip(weights, 0, None, out=weights)
+    weights /= weights.sum(axis=1)[:, numpy.newaxis]
+    return weights
+
+
+def antialias(data, size):
+    """
+    Resize an image with separable anti-aliased resampling.
+
+    :param data:    A 2D Numpy array
+    :param size:    A tuple of new image dimensions
+    :return:        The resized image (float64)
+    """
+    rows = get_resampling_matrix(data.shape[0], size[0])
+    columns = get_resampling_matrix(data.shape[1], size[1])
+    return rows.dot(data).dot(columns.T)
+
+
+def fourier_crop(data, size):
+    """
+    Resize an image by cropping (or zero padding) its centered Fourier
+    transform. The result is scaled so that the mean intensity is kept.
+
+    :param data:    A 2D Numpy array
+    :param size:    A tuple of new image dimensions
+    :return:        The resized image (float64)
+    """
+    spectrum = fftpack.fftshift(fftpack.fft2(data))
+    result = numpy.zeros(size, dtype=spectrum.dtype)
+
+    slices_in = []
+    slices_out = []
+    for old, new in zip(data.shape, size):
+        length = min(old, new)
+        start_in = old // 2 - length // 2
+        start_out = new // 2 - length // 2
+        slices_in.append(slice(start_in, start_in + length))
+        slices_out.append(slice(start_out, start_out + length))
+    result[tuple(slices_out)] = spectrum[tuple(slices_in)]
+
+    scale = float(size[0] * size[1]) / (data.shape[0] * data.shape[1])
+    return numpy.real(fftpack.ifft2(fftpack.ifftshift(result))) * scale
+
+
+def resize(data, size, method="cubic"):
+    """
+    Resize an image.
+
+    :param data:    A 2D Numpy array
+    :param size:    A tuple of new image dimensions
+    :param method:  One of the resize_methods
+    :return:        The resized image
+    """
+    assert method in resize_methods, "Unknown resize method %s" % method
+    size = tuple(size)
+
+    if method in ("bin", "auto"):
+        factors = get_integer_factors(data.shape, size)
+        if factors is not None:
+            return block_mean(data, factors)
+        if method == "bin":
+            raise ValueError("Binning requires integer reduction factors, "
+                             "%s -> %s" % (data.shape, size))
+        method = "antialias"
+
+    if method == "antialias":
+        return antialias(data, size)
+    elif method == "fourier":
+        return fourier_crop(data, size)
+    else:
+        zoom = [float(a)/b for a, b in zip(size, data.shape)]
+        return ndimage.zoom(data, tuple(zoom), order=3)
@@ -11,7 +11,9 @@ filters.py file
 
 import argparse
 
-from pyimq import filters, myimage
+from pyimq import filters, myimage, cascade, sharding, discovery, resize, stream, \
+    analysis, metrics, report, thumbnails, heatmap, batch, faults, progress, summary, sweep, \
+    synthetic
 
 
 def get_quality_script_options(arguments):
@@ -33,7 +35,7 @@ def get_quality_script_options(arguments):
     )
     parser.add_argument(
         "--mode",
-        choices=["file", "directory", "analyze", "plot"],
+        choices=["file", "directory", "heatmap", "sweep", "merge", "analyze", "plot"],
         action="append",
         help="The argument containing the functionality of the main program"
              "You can concatenate actions by defining multiple modes in a"
@@ -56,6 +58,18 @@ def get_quality_script_options(arguments):
 
     parser = filters.get_common_options(parser)
     parser = myimage.get_options(parser)
+    parser = cascade.get_options(parser)
+    parser = sharding.get_options(parser)
+    parser = discovery.get_options(parser)
+    parser = metrics.get_options(parser)
+    parser = batch.get_options(parser)
+    parser = faults.get_options(parser)
+    parser = progress.get_options(parser)
+    parser = summary.get_options(parser)
+    parser = heatmap.get_options(parser)
+    parser = sweep.get_options(parser)
+    parser = report.get_options(parser)
+    parser = thumbnails.get_options(parser)
     return parser.parse_args(arguments)
 
 
@@ -81,6 +95,116 @@ def get_power_script_options(arguments):
         type=int,
         default=512
     )
+    parser.add_argument(
+        "--resize-method",
+        dest="resize_method",
+        choices=resize.resize_methods,
+        default="cubic",
+        help="The method used for resizing the images to --image-size. "
+             "bin, antialias and fourier are much faster than cubic."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for calculating the power spectra"
+    )
+    parser.add_argument(
+        "--output-format",
+        dest="output_format",
+        choices=["csv", "npy", "hdf5", "none"],
+        default="csv",
+        help="Save the spectra in a csv file (one column per image) or in a "
+             "binary (images x frequencies) matrix, with a separate file "
+             "name index. With none only the --summary is saved."
+    )
+    parser = filters.get_common_options(parser)
+    parser = myimage.get_options(parser)
+    parser = summary.get_options(parser)
+    return parser.parse_args(arguments)
+
+
+def get_stream_script_options(arguments):
+    """
+    Command line arguments for the stream.py script that is used to score
+    the frames of a video or a time-lapse series.
+    """
+    parser = argparse.ArgumentParser(
+        description="Command line options for the stream.py script that can "
+                    "be used to calculate a quality time series for the frames "
+                    "of a video or a time-lapse image stack"
+    )
+    parser.add_argument(
+        "--file",
+        help="Path to a multi-frame image (e.g. a TIFF stack), or to a "
+             "directory of frames, that are read in alphabetical order",
+        required=True
+    )
+    parser.add_argument(
+        "--working-directory",
+        dest="working_directory",
+        help="Defines the location of the working directory",
+        default="/home/sami/Pictures/Quality"
+    )
+    parser = filters.get_common_options(parser)
+    parser = myimage.get_options(parser)
+    parser = stream.get_options(parser)
+    return parser.parse_args(arguments)
+
+
+def get_evaluation_script_options(arguments):
+    """
+    Command line arguments for the evaluate.py script that is used to compare
+    the image quality parameter configurations against subjective scores.
+    """
+    parser = argparse.ArgumentParser(
+        description="Command line options for the evaluate.py script that "
+                    "measures the rank correlation of the quality parameters "
+                    "with subjective image quality scores, and the runtime, "
+                    "in various analysis configurations"
+    )
+    parser.add_argument(
+        "--working-directory",
+        dest="working_directory",
+        help="Defines the location of the working directory, that contains "
+             "the images and the subjective ranking results",
+        default="/home/sami/Pictures/Quality"
+    )
+    parser.add_argument(
+        "--scores",
+        help="The subjective scores file, created with the subjective.py "
+             "script. Relative to the working directory.",
+        default="subjective_ranking_scores.csv"
+    )
+    parser.add_argument(
+        "--result",
+        default="average",
+        choices=sorted(analysis.result_columns),
+        help="The ranking variable that is used for choosing the "
+             "Pareto optimal configurations"
+    )
+    parser.add_argument(
+        "--image-size",
+        dest="image_size",
+        type=int,
+        default=512,
+        help="The length of the shorter image side in the downsampled "
+             "configurations"
+    )
+    parser.add_argument(
+        "--resize-method",
+        dest="resize_method",
+        choices=resize.resize_methods,
+        default="auto",
+        help="The method used for downsampling"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Time every configuration this many times (after an untimed "
+             "warm-up run) and record the shortest runtime"
+    )
     parser = filters.get_common_options(parser)
     parser = myimage.get_options(parser)
     return parser.parse_args(arguments)
@@ -102,7 +226,56 @@ def get_subjective_ranking_options(arguments):
         help="Defines the location of the working directory",
         default="/home/sami/Pictures/Quality"
     )
+    parser.add_argument(
+        "--preview-size",
+        dest="preview_size",
+        type=int,
+        default=1024,
+        help="The size of the (cached) preview images that are graded"
+    )
+    parser = thumbnails.get_options(parser)
 
     return parser.parse_args(arguments)
 
 
+
+
+def get_synthetic_dataset_options(arguments):
+    """
+    Command line arguments for the create_synthetic_dataset.py script that
+    is used to generate synthetic test datasets with a known focus ranking.
+    """
+    parser = argparse.ArgumentParser(
+        description="Command line options for the create_synthetic_dataset.py "
+                    "script that can be used to generate synthetic microscopy "
+                    "images and a ground truth focus table, or to check the "
+                    "ranking accuracy of analysis results against the table"
+    )
+    parser.add_argument(
+        "--working-directory",
+        dest="working_directory",
+        help="Defines the location of the working directory",
+        default="/home/sami/Pictures/Quality"
+    )
+    parser.add_argument(
+        "--output-dir",
+        dest="output_dir",
+        default="synthetic",
+        help="The dataset directory, relative to the working directory. The "
+             "ground truth table is saved in it."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes used for creating the images"
+    )
+    parser.add_argument(
+        "--evaluate",
+        default=None,
+        help="Instead of creating a dataset, check the ranking accuracy of a "
+             "directory mode results file (relative to the working directory) "
+             "against the ground truth table of the dataset"
+    )
+    parser = synthetic.get_options(parser)
+    return parser.parse_args(arguments)
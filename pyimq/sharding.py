@@ -0,0 +1,174 @@
+"""
+File:        sharding.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Utilities for distributing a directory mode run over several
+independent processes, e.g. on the nodes of a computing cluster.
+The image files are partitioned into N shards deterministically,
+by a stable hash of their path relative to the working directory,
+so that every node can select its own share of the files without
+any communication. Every shard writes its own output file, and the
+shard output files are finally combined into a single table with
+the merge mode, before running the analyze mode.
+
+Only a shared file system is required.
+"""
+
+import os
+import re
+import glob
+import zlib
+import argparse
+
+import pandas
+
+
+shard_file_pattern = re.compile(r"_shard-(\d+)-of-(\d+)\.(csv|npz)$")
+
+
+def get_options(parser):
+    """
+    Command-line options for sharding
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Sharding", "Options for distributing directory mode runs"
+    )
+    group.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Only analyze the i:th of N shards of the files, given as i/N "
+             "(counting from zero). Use --mode merge to combine the shard "
+             "output files afterwards."
+    )
+    return parser
+
+
+def parse_shard(text):
+    """
+    Parse a i/N shard definition.
+
+    :param text:    A string of the form "i/N"
+    :return:        A tuple (i, N)
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must be given as i/N, not %s" % text)
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("Invalid shard %s" % text)
+    return index, count
+
+
+def get_shard_index(relative_path, count):
+    """
+    Returns the shard that a file belongs to. The hash is calculated from
+    the path with forward slashes, so that the result is the same on
+    every platform and in every process.
+    """
+    key = relative_path.replace(os.sep, "/").encode("utf-8")
+    return zlib.crc32(key) % count
+
+
+def select_shard(paths, root, shard):
+    """
+    Select the files that belong to a shard.
+
+    :param paths:   A list of file paths
+    :param root:    The directory that the relative paths are calculated from
+    :param shard:   A (i, N) tuple, or None for all files
+    :return:        A list of file paths
+    """
+    if shard is None:
+        return paths
+    index, count = shard
+    return [path for path in paths
+            if get_shard_index(os.path.relpath(path, root), count) == index]
+
+
+def get_shard_suffix(shard):
+    """
+    Returns a file name suffix for a shard output file.
+    """
+    if shard is None:
+        return ""
+    return "_shard-%03i-of-%03i" % shard
+
+
+def find_shard_files(pattern):
+    """
+    Find the shard output files that match a glob pattern. If the same
+    shard was written several times, the newest file is used. An error is
+    raised if any of the shards is missing.
+
+    :param pattern: A glob pattern
+    :return:        A list of file paths, in shard order
+    """
+    shards = {}
+    counts = set()
+    for path in glob.glob(pattern):
+        match = shard_file_pattern.search(path)
+        if match is None:
+            continue
+        index, count = int(match.group(1)), int(match.group(2))
+        counts.add(count)
+        if index not in shards or os.path.getmtime(path) > os.path.getmtime(shards[index]):
+            shards[index] = path
+
+    assert len(shards) > 0, "No shard files were found with %s" % pattern
+    assert len(counts) == 1, "Shard files from runs with different shard counts: %s" % sorted(counts)
+    count = counts.pop()
+    missing = [i for i in range(count) if i not in shards]
+    assert not missing, "Missing shards %s of %i" % (missing, count)
+
+    return [shards[i] for i in range(count)]
+
+
+def find_summary_files(file_paths):
+    """
+    Find the dataset summaries (--summary) that were saved together with
+    shard output files, by the same runs.
+
+    :param file_paths:  A list of shard output files, see find_shard_files()
+    :return:            A list of summary files, in shard order, or an empty
+                        list if the shards were analyzed without --summary.
+                        Shards without any results have no summary.
+    """
+    summaries = [re.sub(r"_PyIQ_out(_shard-\d+-of-\d+)\.csv$", r"_PyIQ_summary\1.npz", path)
+                 for path in file_paths]
+    found = [path for path in summaries if os.path.isfile(path)]
+    if not found:
+        return []
+    missing = [summary for path, summary in zip(file_paths, summaries)
+               if not os.path.isfile(summary) and has_results(path)]
+    assert not missing, "Missing shard summaries %s" % ", ".join(missing)
+    return found
+
+
+def has_results(path):
+    """
+    Check whether a shard output file has any result rows after the header.
+    """
+    with open(path) as shard_file:
+        shard_file.readline()
+        return shard_file.readline().strip() != ""
+
+
+def merge_shard_files(file_paths):
+    """
+    Combine shard output files into a single table, sorted by file name.
+
+    :param file_paths:  A list of shard output files
+    :return:            A pandas DataFrame
+    """
+    # Shards without any images may leave an empty output file
+    tables = [pandas.read_csv(path) for path in file_paths if os.path.getsize(path) > 0]
+    assert len(tables) > 0, "All the shard files are empty"
+    columns = list(tables[0].columns)
+    for table in tables:
+        assert list(table.columns) == columns, "Incompatible columns in shard files"
+    merged = pandas.concat(tables, ignore_index=True)
+    merged.sort_values(by="Filename", inplace=True)
+    return merged
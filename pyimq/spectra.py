@@ -0,0 +1,183 @@
+"""
+File:        spectra.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+A batched 1D power spectrum engine for the PyImageQuality software.
+A SpectrumPlan precalculates everything that only depends on the image
+shape, and then calculates the 1D power spectra of a whole stack of
+images (e.g. video frames, or the sliding windows of a large image)
+with a single batched FFT. The spectra are the same as the ones that
+are calculated with the FrequencyQuality filter:
+
+-   additive:   The 2D power spectrum is summed along the rows and the
+                columns. As the power spectrum of a real image is point
+                symmetric, P[k, l] = P[-k, -l], the sums are calculated
+                from the one sided rfft2 spectrum, which halves the work.
+-   radial:     The 2D power spectrum is averaged in radial bins. The
+                bin of every pixel is precalculated, and the bin sums of
+                all the images are calculated at once with
+                numpy.add.reduceat.
+
+The spectral moments measure of the 1D spectra is calculated with
+calculate_spectral_moments(), as a single matrix-vector product for a
+whole stack of spectra.
+"""
+
+import functools
+from math import floor
+
+import numpy
+from scipy import fft
+
+
+def get_radial_labels(shape, bin_size=2):
+    """
+    Calculate the radial bin of every pixel of a (centered) 2D power spectrum,
+    in the same way as in radial_profile.azimuthalAverage()
+
+    :return:    The bin labels (starting from 1), the number of bins that are
+                below the sampling frequency and the bin centers
+    """
+    y, x = numpy.indices(shape)
+    center = numpy.array([(x.max() - x.min()) / 2.0, (y.max() - y.min()) / 2.0])
+    r = numpy.hypot(x - center[0], y - center[1])
+
+    nbins = int((numpy.round(r.max() / bin_size) + 1))
+    bins = numpy.linspace(0, nbins * bin_size, nbins + 1)
+    bin_centers = (bins[1:] + bins[:-1]) / 2.0
+    labels = numpy.digitize(r.flat, bins).reshape(shape)
+
+    nbins_true = int(((x.max() - x.min()) / 2.0) / bin_size)
+    return labels, nbins_true, bin_centers[0:nbins_true]
+
+
+@functools.lru_cache(maxsize=8)
+def get_radial_bins(shape, bin_size=2):
+    """
+    The radial bins of a (centered) 2D power spectrum of a given shape, for
+    kernels.radial_average(). The results are cached, and must not be
+    modified.
+
+    :return:    The bin labels (raveled), the number of bins, the bin centers
+                and the number of pixels in every bin
+    """
+    labels, nbins, bin_centers = get_radial_labels(shape, bin_size)
+    labels = labels.ravel()
+    counts = numpy.bincount(labels, minlength=nbins + 1)[1:nbins + 1]
+    for array in (labels, bin_centers, counts):
+        array.flags.writeable = False
+    return labels, nbins, bin_centers, counts
+
+
+@functools.lru_cache(maxsize=32)
+def get_log_weights(size):
+    """
+    The weights of the spectral moments measure, log10 of the bin index
+    (starting from 1), for spectra of a given length. The results are
+    cached, and must not be modified.
+    """
+    weights = numpy.log10(numpy.arange(1, size + 1))
+    weights.flags.writeable = False
+    return weights
+
+
+def calculate_spectral_moments(power):
+    """
+    The spectral moments measure: the log10 bin index weighted sum of a 1D
+    power spectrum, that is normalized to percents. The normalization is
+    applied to the weighted sum, so the spectrum is not modified.
+
+    :param power:   A 1D power spectrum, or an (n x bins) stack of spectra
+    :return:        The measure, a float or an array of n values
+    """
+    power = numpy.asarray(power)
+    return numpy.dot(power, get_log_weights(power.shape[-1])) / (power.sum(axis=-1) / 100)
+
+
+class SpectrumPlan(object):
+    """
+    Calculates the 1D power spectra of images of a fixed shape.
+    """
+
+    def __init__(self, shape, power_averaging="additive", normalize_power=False,
+                 spacing=(1.0, 1.0), workers=1):
+        self.shape = tuple(shape)
+        self.power_averaging = power_averaging
+        self.normalize_power = normalize_power
+        self.workers = workers
+        dx = spacing[0]
+
+        if power_averaging == "additive":
+            assert self.shape[0] == self.shape[1], \
+                "The additive power spectrum requires a square image"
+            size = self.shape[0]
+            self.negative = -numpy.arange(size) % size
+            self.mirror = numpy.minimum(numpy.arange(size), self.negative)
+            self.inner = slice(1, (size + 1) // 2)
+            length = size - int(floor(float(size) / 2))
+            self.f_k = numpy.linspace(0, 1, length) * (1.0 / (2 * dx))
+        elif power_averaging == "radial":
+            labels, self.nbins, bin_centers = get_radial_labels(self.shape)
+            # The labels are calculated for a centered spectrum, whereas the
+            # power spectrum here is not shifted
+            labels = fft.ifftshift(labels).ravel()
+            selected = numpy.nonzero((labels >= 1) & (labels <= self.nbins))[0]
+            self.order = selected[numpy.argsort(labels[selected], kind="stable")]
+            self.counts = numpy.bincount(labels[self.order], minlength=self.nbins + 1)[1:]
+            assert numpy.all(self.counts > 0), "Empty radial bins"
+            self.starts = numpy.concatenate(([0], numpy.cumsum(self.counts)[:-1]))
+            self.f_k = (bin_centers / int(float(self.shape[0]) / 2)) * (1.0 / (2 * dx))
+        else:
+            raise NotImplementedError
+
+        # Warm up the FFT plan
+        self.calculate(numpy.ones(self.shape))
+
+    def get_normalization(self, data):
+        """
+        The power spectrum normalization factor of every image, see
+        FrequencyQuality.calculate_power_spectrum()
+        """
+        return self.shape[0] * self.shape[1] * numpy.mean(data, axis=(-2, -1))
+
+    def calculate_summed_power(self, data):
+        spectrum = fft.rfft2(data, axes=(-2, -1), workers=self.workers)
+        power = spectrum.real ** 2
+        power += spectrum.imag ** 2
+
+        total = power.sum(axis=-1)
+        total += power[..., self.inner].sum(axis=-1)[..., self.negative]
+        total += power.sum(axis=-2)[..., self.mirror]
+        if self.normalize_power:
+            total /= self.get_normalization(data)[..., numpy.newaxis]
+
+        total = fft.fftshift(total, axes=-1)
+        zero = int(floor(float(total.shape[-1]) / 2))
+        total[..., zero + 1:] += total[..., :zero - 1][..., ::-1]
+        return total[..., zero:]
+
+    def calculate_radial_average(self, data):
+        spectrum = fft.fft2(data, axes=(-2, -1), workers=self.workers)
+        power = spectrum.real ** 2
+        power += spectrum.imag ** 2
+        if self.normalize_power:
+            power /= self.get_normalization(data)[..., numpy.newaxis, numpy.newaxis]
+
+        power = power.reshape(power.shape[:-2] + (-1,))
+        sums = numpy.add.reduceat(power[..., self.order], self.starts, axis=-1)
+        return sums / self.counts
+
+    def calculate(self, data):
+        """
+        Calculate the 1D power spectra.
+
+        :param data:    A Numpy array of shape (..., rows, columns), the
+                        last two dimensions matching the plan shape
+        :return:        An array of shape (..., frequencies). The frequencies
+                        are in self.f_k
+        """
+        assert data.shape[-2:] == self.shape, "The image shape does not match the plan"
+        if self.power_averaging == "additive":
+            return self.calculate_summed_power(data)
+        return self.calculate_radial_average(data)
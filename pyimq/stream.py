@@ -0,0 +1,230 @@
+"""
+File:        stream.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Quality scoring of video and time-lapse streams. In the directory mode
+every image is analyzed from scratch with four filter objects. In a
+stream all the frames usually have the same size, so everything that
+only depends on the frame shape is calculated once and kept in a
+FramePlan: the crop, the 1D power spectrum plan (spectra.SpectrumPlan,
+with the FFT warmed up and the radial bin labels precalculated), the
+spectral moment weights and the work buffers. The quality parameters are the same as in the
+directory mode (see analysis.quality_parameters).
+
+The StreamScorer can optionally analyze only every k:th frame, as long
+as the selected quality parameter stays stable. When the parameter
+changes more than a threshold between two analyzed frames, every frame
+is analyzed until the parameter settles again. Every frame is analyzed
+at most once and no frames are revisited, which keeps the latency per
+frame bounded by the time it takes to analyze a single frame.
+"""
+
+import argparse
+import collections
+import time
+from math import floor
+
+import numpy
+from scipy import ndimage
+
+from pyimq import analysis, filters, kernels, spectra
+
+
+StreamResult = collections.namedtuple(
+    "StreamResult", ["index", "values", "scored", "latency"]
+)
+
+
+def get_options(parser):
+    """
+    Command-line options for the stream scorer
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Stream", "Options for scoring video and time-lapse streams"
+    )
+    group.add_argument(
+        "--stream-step",
+        dest="stream_step",
+        type=int,
+        default=1,
+        help="Analyze only every k:th frame, while the quality stays stable. "
+             "The skipped frames get the values of the previous analyzed frame."
+    )
+    group.add_argument(
+        "--stream-threshold",
+        dest="stream_threshold",
+        type=float,
+        default=0.1,
+        help="Relative change of the --stream-metric between two analyzed "
+             "frames, above which every frame is analyzed"
+    )
+    group.add_argument(
+        "--stream-metric",
+        dest="stream_metric",
+        choices=analysis.quality_parameters,
+        default="fSTD",
+        help="The quality parameter that is followed in the sparse mode"
+    )
+    group.add_argument(
+        "--stream-window",
+        dest="stream_window",
+        type=int,
+        default=100,
+        help="Length of the rolling quality time series"
+    )
+    return parser
+
+
+def get_square_crop(shape):
+    """
+    Returns the slices that crop an image into a square, in the same way
+    as MyImage.crop_to_rectangle()
+    """
+    crop = [slice(None), slice(None)]
+    if shape[0] != shape[1]:
+        axis = 0 if shape[0] > shape[1] else 1
+        diff = 0.5 * abs(shape[0] - shape[1])
+        crop[axis] = slice(int(floor(diff)), shape[axis] - int(numpy.ceil(diff)))
+    return tuple(crop)
+
+
+class FramePlan(object):
+    """
+    The shape dependent parts of the quality analysis of a single frame,
+    with preallocated work buffers.
+    """
+
+    def __init__(self, shape, options, spacing=(1.0, 1.0), kernel=100):
+        self.shape = tuple(shape)
+        self.options = options
+        self.kernel = kernel
+
+        # The Brenner measure (and the additive power spectrum) are calculated
+        # from a square crop of the frame.
+        self.crop = get_square_crop(self.shape)
+        side = min(self.shape)
+        self.square = numpy.empty((side, side), dtype=numpy.float64)
+        self.smoothed = None
+
+        if options.power_averaging == "additive":
+            self.spectrum = spectra.SpectrumPlan(self.square.shape, "additive",
+                                                 options.normalize_power, spacing)
+        elif options.power_averaging == "radial":
+            self.spectrum = spectra.SpectrumPlan(self.shape, "radial",
+                                                 options.normalize_power, spacing)
+            self.frame = numpy.empty(self.shape, dtype=numpy.float64)
+        else:
+            raise NotImplementedError
+        self.f_k = self.spectrum.f_k
+
+    def calculate_entropy(self, frame):
+        """
+        The spatial domain entropy, as in LocalImageQuality
+        """
+        if not self.options.use_mask:
+            return kernels.calculate_entropy(frame)
+
+        if self.smoothed is None or self.smoothed.dtype != frame.dtype:
+            self.smoothed = numpy.empty(self.shape, dtype=frame.dtype)
+        ndimage.uniform_filter(frame, size=self.kernel, output=self.smoothed)
+        peaks = numpy.percentile(self.smoothed, self.options.spatial_threshold)
+        mask = self.smoothed >= peaks
+        if self.options.invert_mask:
+            numpy.invert(mask, out=mask)
+        return kernels.calculate_entropy(frame, mask=mask)
+
+    def score(self, frame):
+        """
+        Analyze a single frame.
+
+        :param frame:   A 2D Numpy array, with the shape of the plan
+        :return:        A list of the quality parameters, in the order of
+                        analysis.quality_parameters
+        """
+        assert frame.shape == self.shape, "The frame shape does not match the plan"
+        entropy_value = self.calculate_entropy(frame)
+
+        self.square[:] = frame[self.crop]
+        difference = self.square[:, :-2] - self.square[:, 2:]
+        brenner = numpy.dot(difference.ravel(), difference.ravel())
+
+        if self.options.power_averaging == "additive":
+            power = self.spectrum.calculate(self.square)
+        else:
+            self.frame[:] = frame
+            power = self.spectrum.calculate(self.frame)
+
+        moments = spectra.calculate_spectral_moments(power)
+        results = filters.calculate_tail_statistics([self.f_k, power],
+                                                    self.options.power_threshold)
+        return [entropy_value, brenner, moments] + results
+
+
+class StreamScorer(object):
+    """
+    Score a stream of frames. The plans are created at the first frame of
+    every new frame shape, and reused for the rest of the stream.
+    """
+
+    def __init__(self, options, spacing=(1.0, 1.0), kernel=100):
+        self.options = options
+        self.spacing = spacing
+        self.kernel = kernel
+        self.plans = {}
+
+        self.step = max(1, getattr(options, "stream_step", 1))
+        self.threshold = getattr(options, "stream_threshold", 0.1)
+        self.metric = analysis.quality_parameters.index(
+            getattr(options, "stream_metric", "fSTD"))
+        self.series = collections.deque(maxlen=getattr(options, "stream_window", 100))
+
+    def get_plan(self, shape):
+        if shape not in self.plans:
+            self.plans[shape] = FramePlan(shape, self.options, self.spacing, self.kernel)
+        return self.plans[shape]
+
+    def score(self, frame):
+        """
+        Analyze a single frame, without the frame skipping logic.
+        """
+        return self.get_plan(frame.shape).score(frame)
+
+    def run(self, frames):
+        """
+        Score a stream of frames.
+
+        :param frames:  An iterable of 2D Numpy arrays
+        :return:        A generator of StreamResult tuples, one for every
+                        frame. The result of a skipped frame repeats the
+                        values of the previous analyzed frame, with
+                        scored=False.
+        """
+        values = None
+        last_scored = None
+        dense = False
+
+        for index, frame in enumerate(frames):
+            start = time.time()
+            scored = values is None or dense or index - last_scored >= self.step
+            if scored:
+                previous = values
+                values = self.score(frame)
+                last_scored = index
+                if previous is not None and self.step > 1:
+                    reference = abs(previous[self.metric])
+                    change = abs(values[self.metric] - previous[self.metric])
+                    dense = change > self.threshold * reference
+            result = StreamResult(index, values, scored, time.time() - start)
+            self.series.append(result)
+            yield result
+
+    def get_series(self):
+        """
+        Returns the rolling quality time series: the frame indexes and a
+        (frames x parameters) array of the latest values.
+        """
+        indexes = numpy.array([result.index for result in self.series])
+        values = numpy.array([result.values for result in self.series])
+        return indexes, values
@@ -0,0 +1,335 @@
+"""
+File:        summary.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Streaming dataset-level statistics for the PyImageQuality software. The
+running mean, variance, minimum and maximum, and the quantiles of a fixed
+number of columns (e.g. the quality parameters of the directory mode, or
+the frequencies of the 1D power spectra) are accumulated one image at a
+time, in constant memory, so that the statistics of millions of images
+can be calculated without keeping the individual results.
+
+The mean and variance are updated with the method of Welford, in the
+pairwise form of Chan et al., which also allows merging the statistics
+of several workers or shards exactly. The quantiles are estimated with a
+sketch of logarithmically spaced buckets (as in DDSketch), that has a
+fixed relative accuracy: every estimated quantile is within
+relative_accuracy of a value of the data at the requested rank. The
+buckets of two sketches are merged by simply adding them together.
+
+A Summary can be saved into a .npz file, and the files of several runs
+or shards merged afterwards.
+"""
+
+import argparse
+
+import numpy
+import pandas
+
+
+def get_options(parser):
+    """
+    Command-line options for the dataset summaries
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Dataset summary", "Options for the streaming dataset statistics"
+    )
+    group.add_argument(
+        "--summary",
+        action="store_true",
+        help="Save the running mean, variance and quantiles of the results "
+             "of all the images into a summary file"
+    )
+    group.add_argument(
+        "--summary-accuracy",
+        dest="summary_accuracy",
+        type=float,
+        default=0.01,
+        help="The relative accuracy of the quantile estimates"
+    )
+    group.add_argument(
+        "--summary-quantiles",
+        dest="summary_quantiles",
+        type=float,
+        nargs="+",
+        default=[0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99],
+        help="The quantiles that are saved into the summary table"
+    )
+    return parser
+
+
+class RunningMoments(object):
+    """
+    The running count, mean, variance, minimum and maximum of a number of
+    columns. NaN values are ignored, so every column has a count of its own.
+    """
+
+    def __init__(self, columns):
+        self.count = numpy.zeros(columns, dtype=numpy.int64)
+        self.mean = numpy.zeros(columns)
+        self.m2 = numpy.zeros(columns)
+        self.minimum = numpy.full(columns, numpy.nan)
+        self.maximum = numpy.full(columns, numpy.nan)
+
+    def combine(self, count, mean, m2):
+        """
+        Combine the moments of another set of values with these.
+        """
+        total = self.count + count
+        weight = numpy.divide(count, total, out=numpy.zeros(len(total)), where=total > 0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def add_batch(self, values):
+        """
+        :param values:  A (samples x columns) array
+        """
+        valid = ~numpy.isnan(values)
+        count = valid.sum(axis=0)
+        total = numpy.where(valid, values, 0.0).sum(axis=0)
+        mean = numpy.divide(total, count, out=numpy.zeros(len(count)), where=count > 0)
+        m2 = numpy.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+        self.combine(count, mean, m2)
+        self.minimum = numpy.fmin(self.minimum, numpy.fmin.reduce(values, axis=0))
+        self.maximum = numpy.fmax(self.maximum, numpy.fmax.reduce(values, axis=0))
+
+    def merge(self, other):
+        assert len(other.count) == len(self.count)
+        self.combine(other.count, other.mean, other.m2)
+        self.minimum = numpy.fmin(self.minimum, other.minimum)
+        self.maximum = numpy.fmax(self.maximum, other.maximum)
+
+    def get_mean(self):
+        return numpy.where(self.count > 0, self.mean, numpy.nan)
+
+    def get_variance(self, ddof=1):
+        count = self.count - ddof
+        return numpy.divide(self.m2, count, out=numpy.full(len(count), numpy.nan),
+                            where=count > 0)
+
+
+class QuantileSketch(object):
+    """
+    A quantile sketch of a number of columns, with logarithmically spaced
+    buckets. A value x > 0 is counted into the bucket
+    ceil(log(x) / log(gamma)), where gamma = (1 + a) / (1 - a) and a is
+    the relative accuracy; negative values into a separate set of buckets
+    by their magnitude. The buckets span about 1e-18...1e18 with the
+    default parameters; values outside the range are counted into the
+    lowest or highest bucket.
+    """
+
+    def __init__(self, columns, relative_accuracy=0.01, bucket_count=4096):
+        assert 0 < relative_accuracy < 1
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.offset = bucket_count // 2
+        self.positive = numpy.zeros((columns, bucket_count), dtype=numpy.int64)
+        self.negative = numpy.zeros((columns, bucket_count), dtype=numpy.int64)
+        self.zeros = numpy.zeros(columns, dtype=numpy.int64)
+
+    def count_buckets(self, magnitudes, columns):
+        """
+        Count the given magnitudes (> 0) into the buckets of their columns.
+        """
+        shape = self.positive.shape
+        keys = numpy.ceil(numpy.log(magnitudes) / numpy.log(self.gamma)).astype(numpy.int64)
+        keys = numpy.clip(keys + self.offset, 0, shape[1] - 1)
+        return numpy.bincount(columns * shape[1] + keys,
+                              minlength=shape[0] * shape[1]).reshape(shape)
+
+    def add_batch(self, values):
+        """
+        :param values:  A (samples x columns) array. NaN and infinite values
+                        are ignored.
+        """
+        columns = numpy.broadcast_to(numpy.arange(values.shape[1]), values.shape)
+        finite = numpy.isfinite(values)
+        positive = finite & (values > 0)
+        negative = finite & (values < 0)
+        self.positive += self.count_buckets(values[positive], columns[positive])
+        self.negative += self.count_buckets(-values[negative], columns[negative])
+        self.zeros += (values == 0).sum(axis=0)
+
+    def merge(self, other):
+        assert other.relative_accuracy == self.relative_accuracy
+        assert other.positive.shape == self.positive.shape
+        self.positive += other.positive
+        self.negative += other.negative
+        self.zeros += other.zeros
+
+    def get_quantiles(self, quantiles):
+        """
+        Estimate quantiles of every column.
+
+        :param quantiles:   A list of quantiles (0...1)
+        :return:            A (columns x quantiles) array. NaN for empty
+                            columns.
+        """
+        keys = numpy.arange(self.positive.shape[1]) - self.offset
+        estimates = 2.0 * self.gamma ** keys / (self.gamma + 1.0)
+        # The buckets in ascending order of the values
+        values = numpy.concatenate([-estimates[::-1], [0.0], estimates])
+        counts = numpy.concatenate(
+            [self.negative[:, ::-1], self.zeros[:, None], self.positive], axis=1)
+        cumulative = numpy.cumsum(counts, axis=1)
+        total = cumulative[:, -1]
+
+        result = numpy.empty((len(total), len(quantiles)))
+        for i, quantile in enumerate(quantiles):
+            assert 0 <= quantile <= 1
+            rank = quantile * (total - 1)
+            result[:, i] = values[numpy.argmax(cumulative > rank[:, None], axis=1)]
+        result[total == 0] = numpy.nan
+        return result
+
+
+class Summary(object):
+    """
+    Streaming statistics of named columns. The values are added one row
+    (image) at a time; the rows are buffered and added in batches.
+    """
+
+    batch_size = 256
+
+    def __init__(self, names, relative_accuracy=0.01, bucket_count=4096):
+        self.names = list(names)
+        self.moments = RunningMoments(len(self.names))
+        self.sketch = QuantileSketch(len(self.names), relative_accuracy, bucket_count)
+        self.buffer = []
+
+    def add(self, values):
+        """
+        Add the values of a single row (e.g. the results of an image)
+        """
+        assert len(values) == len(self.names)
+        self.buffer.append(values)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def add_batch(self, values):
+        """
+        Add a (rows x columns) array of values
+        """
+        self.flush()
+        values = numpy.asarray(values, dtype=numpy.float64)
+        assert values.ndim == 2 and values.shape[1] == len(self.names)
+        self.moments.add_batch(values)
+        self.sketch.add_batch(values)
+
+    def flush(self):
+        if self.buffer:
+            values = numpy.array(self.buffer, dtype=numpy.float64)
+            self.buffer = []
+            self.add_batch(values)
+
+    def merge(self, other):
+        """
+        Merge the statistics of another Summary (e.g. of another worker or
+        shard) into this one.
+        """
+        assert other.names == self.names, "The summaries have different columns"
+        self.flush()
+        other.flush()
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        return self
+
+    def get_count(self):
+        self.flush()
+        return self.moments.count
+
+    def get_mean(self):
+        self.flush()
+        return self.moments.get_mean()
+
+    def get_variance(self, ddof=1):
+        self.flush()
+        return self.moments.get_variance(ddof)
+
+    def get_quantiles(self, quantiles):
+        """
+        Estimate quantiles of every column. The estimates (the bucket
+        midpoints) are limited to the observed range of the column, which
+        can only make them more accurate.
+        """
+        self.flush()
+        return numpy.clip(self.sketch.get_quantiles(quantiles),
+                          self.moments.minimum[:, None], self.moments.maximum[:, None])
+
+    def to_frame(self, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        """
+        Returns the statistics as a pandas DataFrame, with a row for every
+        column name.
+        """
+        variance = self.get_variance()
+        table = pandas.DataFrame({
+            "Count": self.moments.count,
+            "Mean": self.moments.get_mean(),
+            "Variance": variance,
+            "Std": numpy.sqrt(variance),
+            "Min": self.moments.minimum,
+            "Max": self.moments.maximum
+        }, index=pandas.Index(self.names, name="Name"))
+        estimates = self.get_quantiles(quantiles)
+        for i, quantile in enumerate(quantiles):
+            table["Q%g" % (100 * quantile)] = estimates[:, i]
+        return table
+
+    def save(self, path):
+        """
+        Save the state of the summary into a .npz file
+        """
+        self.flush()
+        numpy.savez_compressed(
+            path, names=numpy.array(self.names), count=self.moments.count,
+            mean=self.moments.mean, m2=self.moments.m2, minimum=self.moments.minimum,
+            maximum=self.moments.maximum, relative_accuracy=self.sketch.relative_accuracy,
+            positive=self.sketch.positive, negative=self.sketch.negative,
+            zeros=self.sketch.zeros)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a summary that was saved with save()
+        """
+        with numpy.load(path) as data:
+            summary = cls([str(name) for name in data["names"]],
+                          float(data["relative_accuracy"]), data["positive"].shape[1])
+            summary.moments.count = data["count"]
+            summary.moments.mean = data["mean"]
+            summary.moments.m2 = data["m2"]
+            summary.moments.minimum = data["minimum"]
+            summary.moments.maximum = data["maximum"]
+            summary.sketch.positive = data["positive"]
+            summary.sketch.negative = data["negative"]
+            summary.sketch.zeros = data["zeros"]
+        return summary
+
+
+def merge_summary_files(paths):
+    """
+    Merge the summaries saved in several .npz files
+
+    :return:    A Summary
+    """
+    assert len(paths) > 0
+    summary = Summary.load(paths[0])
+    for path in paths[1:]:
+        summary.merge(Summary.load(path))
+    return summary
+
+
+def save_summary(summary, base_name, quantiles):
+    """
+    Save a summary both as a mergeable .npz file, and as a csv table.
+
+    :return:    The path of the csv file
+    """
+    summary.save(base_name + ".npz")
+    summary.to_frame(quantiles).to_csv(base_name + ".csv")
+    return base_name + ".csv"
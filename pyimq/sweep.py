@@ -0,0 +1,89 @@
+"""
+File:        sweep.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Parameter sweeps for tuning the PyImageQuality software. The tail
+threshold of the power spectrum (--power-threshold) and the mask of the
+entropy calculation (--spatial-threshold, --invert-mask) only affect the
+final, cheap steps of the analysis. In the sweep mode every image is
+therefore decoded, transformed and smoothed once, and the quality
+parameters are then calculated for every combination of the swept
+settings from the shared intermediate results (see
+metrics.MetricGraph.evaluate_sweep). The results are saved with one row
+per image and setting.
+"""
+
+import argparse
+import itertools
+
+# The swept options and the names of their output columns
+swept_options = [
+    ("power_threshold", "PowerThreshold"),
+    ("spatial_threshold", "SpatialThreshold"),
+    ("invert_mask", "InvertMask")
+]
+
+
+def get_options(parser):
+    """
+    Command-line options for the parameter sweeps
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Sweep", "Options for the parameter sweep mode"
+    )
+    group.add_argument(
+        "--sweep-power-thresholds",
+        dest="sweep_power_thresholds",
+        type=float,
+        nargs="+",
+        default=None,
+        help="The --power-threshold values of the sweep"
+    )
+    group.add_argument(
+        "--sweep-spatial-thresholds",
+        dest="sweep_spatial_thresholds",
+        type=int,
+        nargs="+",
+        default=None,
+        help="The --spatial-threshold values of the sweep (requires --use-mask)"
+    )
+    group.add_argument(
+        "--sweep-invert-mask",
+        dest="sweep_invert_mask",
+        action="store_true",
+        help="Sweep the mask both as it is and inverted (requires --use-mask)"
+    )
+    return parser
+
+
+def get_settings(options):
+    """
+    Returns the settings of a parameter sweep: every combination of the
+    swept values. The options that are not swept keep their values.
+
+    :return:    A list of {option name: value} dictionaries
+    """
+    if (options.sweep_spatial_thresholds is not None or options.sweep_invert_mask) and \
+            not options.use_mask:
+        raise ValueError("Sweeping the mask settings requires --use-mask")
+    values = [
+        options.sweep_power_thresholds or [options.power_threshold],
+        options.sweep_spatial_thresholds or [options.spatial_threshold],
+        [False, True] if options.sweep_invert_mask else [options.invert_mask]
+    ]
+    names = [name for name, column in swept_options]
+    return [dict(zip(names, setting)) for setting in itertools.product(*values)]
+
+
+def get_header(metrics):
+    return ["Filename"] + [column for name, column in swept_options] + list(metrics)
+
+
+def get_rows(filename, settings, results):
+    """
+    Returns the output rows of an image: one for every setting.
+    """
+    return [[filename] + [setting[name] for name, column in swept_options] + values
+            for setting, values in zip(settings, results)]
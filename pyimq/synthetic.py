@@ -0,0 +1,315 @@
+"""
+File:        synthetic.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Synthetic microscopy datasets with a known focus ranking, for load
+testing the PyImageQuality software and for checking the ranking
+accuracy of the quality parameters without real data.
+
+Every field of view is an image of randomly placed, textured cells
+(an elliptical body with a brighter nucleus) on a dim background. The
+same field is rendered at every --blur-sigmas level with a Gaussian
+blur, so that within a field the images can be ranked by their focus.
+The optical blur is followed by vignetting of the illumination, and by
+the shot and read noise of the camera.
+
+Everything is generated from the --seed: the cells of a field only
+depend on the seed and the field index, and the noise of an image on
+the seed, the field and the blur level. The dataset is therefore the
+same regardless of the number of worker processes or of the order in
+which the images are written. The image size and file format are
+chosen for every field in turn from the --image-sizes and
+--image-formats lists.
+
+The ground truth table lists the file name, field, blur level, blur
+sigma and the generation parameters of every image. The ranking
+accuracy of an analysis can be checked against it with
+evaluate_ranking().
+"""
+
+import argparse
+import itertools
+import os
+
+import numpy
+import pandas
+from PIL import Image
+from scipy import ndimage, stats
+
+image_formats = ["tif", "png", "jpg"]
+
+ground_truth_columns = ["Filename", "Field", "BlurLevel", "Sigma", "Cells", "Size",
+                        "Format", "BitDepth", "Photons", "ReadNoise", "Vignetting"]
+
+# The fields are divided into subdirectories of this many fields, to keep
+# the directories of large datasets reasonably small
+fields_per_directory = 1000
+
+
+def get_options(parser):
+    """
+    Command-line options for the synthetic dataset generator
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Synthetic dataset", "Options for generating synthetic microscopy images"
+    )
+    group.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The random seed. The same seed always creates the same dataset."
+    )
+    group.add_argument(
+        "--fields",
+        type=int,
+        default=10,
+        help="Number of fields of view. Every field is rendered at all the "
+             "blur levels."
+    )
+    group.add_argument(
+        "--blur-sigmas",
+        dest="blur_sigmas",
+        type=float,
+        nargs="+",
+        default=[0, 0.5, 1, 2, 3, 4],
+        help="The standard deviations (in pixels) of the Gaussian blur levels. "
+             "Zero means an image in focus."
+    )
+    group.add_argument(
+        "--image-sizes",
+        dest="image_sizes",
+        type=int,
+        nargs="+",
+        default=[512],
+        help="The sizes of the (square) images, used for the fields in turn"
+    )
+    group.add_argument(
+        "--image-formats",
+        dest="image_formats",
+        choices=image_formats,
+        nargs="+",
+        default=["tif"],
+        help="The file formats, used for the fields in turn"
+    )
+    group.add_argument(
+        "--bit-depth",
+        dest="bit_depth",
+        type=int,
+        choices=[8, 16],
+        default=16,
+        help="The bit depth of the TIFF and PNG images. JPEG images are "
+             "always 8-bit."
+    )
+    group.add_argument(
+        "--cell-density",
+        dest="cell_density",
+        type=float,
+        default=1.0,
+        help="The average number of cells per 100x100 pixels"
+    )
+    group.add_argument(
+        "--cell-radius",
+        dest="cell_radius",
+        type=float,
+        default=12.0,
+        help="The average radius of the cells, in pixels"
+    )
+    group.add_argument(
+        "--photons",
+        type=float,
+        default=1000.0,
+        help="The expected photon count at the brightest parts of the cells. "
+             "Fewer photons mean more shot noise."
+    )
+    group.add_argument(
+        "--read-noise",
+        dest="read_noise",
+        type=float,
+        default=5.0,
+        help="The standard deviation of the camera read noise, in photons"
+    )
+    group.add_argument(
+        "--vignetting",
+        type=float,
+        default=0.3,
+        help="The relative decrease of the illumination from the center to "
+             "the corners of the image"
+    )
+    return parser
+
+
+def get_field_generator(seed, field, level=None):
+    """
+    Returns the random generator of a field, or of the noise of a single
+    image of the field.
+    """
+    entropy = [seed, field] if level is None else [seed, field, level + 1]
+    return numpy.random.default_rng(numpy.random.SeedSequence(entropy))
+
+
+def render_cells(shape, generator, density=1.0, radius=12.0):
+    """
+    Render the cells of a field of view, without blur or noise.
+
+    :param shape:       The image shape
+    :param generator:   A numpy.random.Generator
+    :param density:     The average number of cells per 100x100 pixels
+    :param radius:      The average cell radius, in pixels
+    :return:            A float32 Numpy array with values in [0, 1], and
+                        the number of cells
+    """
+    count = generator.poisson(density * shape[0] * shape[1] / 1e4)
+    cells = numpy.zeros(shape, dtype=numpy.float32)
+    for i in range(count):
+        center = generator.uniform(0, shape[0]), generator.uniform(0, shape[1])
+        axes = radius * generator.uniform(0.7, 1.3) * \
+            numpy.array([1.0, generator.uniform(0.6, 1.0)])
+        angle = generator.uniform(0, numpy.pi)
+        brightness = generator.uniform(0.3, 0.7)
+
+        # Only the bounding box of the cell is calculated
+        extent = int(numpy.ceil(axes[0])) + 2
+        rows = slice(max(0, int(center[0]) - extent), min(shape[0], int(center[0]) + extent + 1))
+        columns = slice(max(0, int(center[1]) - extent), min(shape[1], int(center[1]) + extent + 1))
+        if rows.start >= rows.stop or columns.start >= columns.stop:
+            continue
+        y, x = numpy.ogrid[rows, columns]
+        y = y - center[0]
+        x = x - center[1]
+        u = (x * numpy.cos(angle) + y * numpy.sin(angle)) / axes[0]
+        v = (-x * numpy.sin(angle) + y * numpy.cos(angle)) / axes[1]
+        distance = numpy.sqrt(u * u + v * v)
+        # Soft edged cell body, and a brighter nucleus in the middle
+        body = 1.0 / (1.0 + numpy.exp((distance - 1.0) * 12.0))
+        nucleus = 1.0 / (1.0 + numpy.exp((distance - 0.45) * 20.0))
+        cells[rows, columns] = numpy.maximum(
+            cells[rows, columns], brightness * body + (1.0 - brightness) * nucleus)
+
+    # Fine granular texture, which is the first detail to disappear with blur
+    texture = ndimage.gaussian_filter(generator.standard_normal(shape, dtype=numpy.float32), 1.0)
+    texture /= max(texture.std(), 1e-12)
+    cells *= numpy.clip(1.0 + 0.25 * texture, 0.0, None)
+    return numpy.clip(cells, 0.0, 1.0), count
+
+
+def get_vignetting(shape, strength):
+    """
+    The relative illumination of the image: 1 at the center, 1 - strength
+    at the corners.
+    """
+    y, x = numpy.ogrid[:shape[0], :shape[1]]
+    y = (y - (shape[0] - 1) / 2.0) / (shape[0] / 2.0)
+    x = (x - (shape[1] - 1) / 2.0) / (shape[1] / 2.0)
+    return (1.0 - strength * (x * x + y * y) / 2.0).astype(numpy.float32)
+
+
+def render_image(cells, sigma, generator, photons=1000.0, read_noise=5.0, illumination=None,
+                 bit_depth=16, background=0.05):
+    """
+    Render a single image of a field: blur, vignetting and camera noise.
+    The shot noise is approximated with a normal distribution (the photon
+    counts are large), which is several times faster to draw than Poisson
+    distributed values.
+
+    :param cells:           The cells of the field, see render_cells()
+    :param sigma:           Standard deviation of the Gaussian blur, in pixels
+    :param generator:       A numpy.random.Generator for the noise
+    :param photons:         The expected photon count at intensity 1
+    :param read_noise:      Standard deviation of the read noise, in photons
+    :param illumination:    The relative illumination, see get_vignetting()
+    :param bit_depth:       8 or 16
+    :param background:      The background intensity
+    :return:                An uint8 or uint16 Numpy array
+    """
+    signal = cells if sigma <= 0 else ndimage.gaussian_filter(cells, sigma)
+    signal = (signal + background) * photons
+    if illumination is not None:
+        signal *= illumination
+    noise = generator.standard_normal(cells.shape, dtype=numpy.float32)
+    noise *= numpy.sqrt(signal + read_noise ** 2)
+    signal += noise
+    if bit_depth == 8:
+        # The full scale is a little above the brightest expected signal
+        signal *= 255.0 / (1.25 * (1.0 + background) * photons)
+        return numpy.clip(numpy.rint(signal), 0, 255).astype(numpy.uint8)
+    return numpy.clip(numpy.rint(signal), 0, 65535).astype(numpy.uint16)
+
+
+def get_field_format(field, options):
+    """
+    Returns the image size and the file format of a field
+    """
+    combinations = list(itertools.product(options.image_sizes, options.image_formats))
+    return combinations[field % len(combinations)]
+
+
+def get_image_name(field, level, image_format):
+    """
+    The path of an image, relative to the dataset directory
+    """
+    return "part-%04i/field-%07i_blur-%02i.%s" % (
+        field // fields_per_directory, field, level, image_format)
+
+
+def create_field(field, directory, options):
+    """
+    Create and save all the images of a field.
+
+    :param field:       The index of the field
+    :param directory:   The dataset directory
+    :param options:     Command line options
+    :return:            The ground truth rows of the images
+    """
+    size, image_format = get_field_format(field, options)
+    bit_depth = 8 if image_format == "jpg" else options.bit_depth
+    cells, count = render_cells((size, size), get_field_generator(options.seed, field),
+                                options.cell_density, options.cell_radius)
+    illumination = get_vignetting(cells.shape, options.vignetting)
+    rows = []
+    for level, sigma in enumerate(options.blur_sigmas):
+        data = render_image(cells, sigma, get_field_generator(options.seed, field, level),
+                            options.photons, options.read_noise, illumination, bit_depth)
+        path = os.path.join(directory, get_image_name(field, level, image_format))
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if image_format == "jpg":
+            Image.fromarray(data).save(path, quality=95)
+        else:
+            Image.fromarray(data).save(path)
+        rows.append([path, field, level, sigma, count, size, image_format, bit_depth,
+                     options.photons, options.read_noise, options.vignetting])
+    return rows
+
+
+def evaluate_ranking(ground_truth, results, columns=None):
+    """
+    Check how well the quality parameters rank the images of every field by
+    their focus. The rank correlation (Spearman) of every parameter with the
+    blur level is calculated separately for every field. A good focus
+    measure correlates negatively with the blur level; the correlations
+    are reported with the sign changed, so that 1 means a perfect ranking.
+
+    :param ground_truth:    The ground truth table, a pandas DataFrame
+    :param results:         The results of the directory mode, a pandas
+                            DataFrame with a Filename column
+    :param columns:         The names of the quality parameters. By default
+                            all the numeric result columns are used.
+    :return:                A pandas DataFrame with a row per field, and a
+                            column per quality parameter
+    """
+    if columns is None:
+        columns = [name for name in results.select_dtypes("number").columns
+                   if name not in ground_truth_columns]
+    data = pandas.merge(ground_truth[["Filename", "Field", "BlurLevel"]],
+                        results[["Filename"] + list(columns)], on="Filename")
+    assert len(data) > 0, "None of the result file names are in the ground truth table"
+
+    correlations = {}
+    for field, images in data.groupby("Field"):
+        if len(images) < 2:
+            continue
+        correlations[field] = [-stats.spearmanr(images["BlurLevel"], images[name])[0]
+                               for name in columns]
+    return pandas.DataFrame.from_dict(correlations, orient="index", columns=columns)
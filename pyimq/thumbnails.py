@@ -0,0 +1,284 @@
+"""
+File:        thumbnails.py
+Author:      Sami Koho (sami.koho@gmail.com)
+
+Description:
+Small preview images for plots and reports. The thumbnails are made by
+block averaging and scaled to 8-bit with robust (percentile) limits,
+so that also 16-bit and floating point images can be shown. JPEG
+images are decoded directly at a reduced size, when possible.
+
+The ThumbnailCache keeps the thumbnails on disk between sessions, so
+that the full resolution images need to be read only once. The cache
+entries are keyed by a hash of the path, the size and the modification
+time of the file, and of the beginning and the end of the file, which is
+fast to calculate also on network storage. Different files with the same
+headers and padding, or a file that is rewritten in place, therefore
+never share an entry. Every image can have
+thumbnails of several sizes (a small pyramid): a smaller thumbnail is
+made from a cached larger one, when possible. The least recently used
+thumbnails are removed when the total size of the cache exceeds a
+limit.
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import time
+from math import ceil
+
+import numpy
+from PIL import Image
+
+from pyimq import archives, decoders
+
+
+# The default length of the longer side of a thumbnail
+thumbnail_size = 256
+
+# The number of bytes read from both ends of a file for the cache key
+hash_block_size = 1 << 16
+
+
+def get_options(parser):
+    """
+    Command-line options for the image thumbnails
+    """
+    assert isinstance(parser, argparse.ArgumentParser)
+    group = parser.add_argument_group(
+        "Thumbnails", "Options for the image previews in plots and reports"
+    )
+    group.add_argument(
+        "--thumbnail-size",
+        dest="thumbnail_size",
+        type=int,
+        default=thumbnail_size,
+        help="The size of the image thumbnails in the plots"
+    )
+    group.add_argument(
+        "--thumbnail-cache",
+        dest="thumbnail_cache",
+        default=os.path.join(os.path.expanduser("~"), ".cache", "pyimq", "thumbnails"),
+        help="A directory for keeping the thumbnails between sessions. "
+             "Give none to disable the cache."
+    )
+    group.add_argument(
+        "--thumbnail-cache-size",
+        dest="thumbnail_cache_size",
+        type=float,
+        default=256,
+        help="Maximum size of the thumbnail cache (MB)"
+    )
+    return parser
+
+
+def get_cache_dir(options):
+    """
+    Returns the thumbnail cache directory, or None if the cache is disabled.
+    """
+    if options.thumbnail_cache is None or options.thumbnail_cache.lower() == "none":
+        return None
+    return options.thumbnail_cache
+
+
+def get_cache(options):
+    """
+    Open the thumbnail cache defined by the command line options, or
+    return None if the cache is disabled.
+    """
+    if get_cache_dir(options) is None:
+        return None
+    return ThumbnailCache(get_cache_dir(options), int(options.thumbnail_cache_size * 1024 * 1024))
+
+
+def get_draft_factor(path, size):
+    """
+    Find the largest JPEG draft factor (1, 2, 4 or 8) that still decodes the
+    image at least at the thumbnail size.
+    """
+    if not path.lower().endswith((".jpg", ".jpeg")):
+        return 1
+    with Image.open(archives.open_source(path)) as image:
+        longest = max(image.size)
+    factor = 1
+    while factor < 8 and longest // (2 * factor) >= size:
+        factor *= 2
+    return factor
+
+
+def make_thumbnail(data, size=thumbnail_size):
+    """
+    Downscale an image by block averaging, so that its longer side is at most
+    size pixels, and convert it to 8-bit.
+
+    :param data:    A 2D or a 3D (channels last) Numpy array
+    :param size:    Maximum length of the longer side
+    :return:        A uint8 Numpy array
+    """
+    dtype = data.dtype
+    factor = int(ceil(float(max(data.shape[:2])) / size))
+    if factor > 1:
+        rows = data.shape[0] // factor
+        columns = data.shape[1] // factor
+        blocks = data[:rows * factor, :columns * factor].reshape(
+            (rows, factor, columns, factor) + data.shape[2:])
+        data = blocks.mean(axis=(1, 3))
+
+    # 8-bit images are shown as they are, others are scaled
+    if dtype == numpy.uint8:
+        return numpy.round(data).astype(numpy.uint8)
+    low, high = numpy.percentile(data, [0.5, 99.5])
+    if high <= low:
+        high = low + 1
+    scaled = (data.astype(numpy.float32) - low) * (255.0 / (high - low))
+    return numpy.clip(scaled, 0, 255).astype(numpy.uint8)
+
+
+def load_thumbnail(path, size=thumbnail_size):
+    """
+    Read an image from disk as a thumbnail.
+
+    :param path:    Path to an image
+    :param size:    Maximum length of the longer side
+    :return:        A uint8 Numpy array
+    """
+    data = decoders.decode(path, draft=get_draft_factor(path, size))
+    # Multi-channel images with other than 3 channels are shown by the
+    # first channel
+    if data.ndim == 3 and data.shape[2] not in (3, 4):
+        data = data[:, :, 0]
+    elif data.ndim == 3 and data.shape[2] == 4:
+        data = data[:, :, :3]
+    return make_thumbnail(data, size)
+
+
+def get_file_key(path):
+    """
+    Calculate the cache key of a file, from the absolute path, the size
+    and the modification time, and the first and the last hash_block_size
+    bytes of the file. The key of an archive member or a frame is
+    calculated from the file that contains it, and the rest of the
+    virtual path.
+    """
+    container, name = archives.get_source_key(path)
+    if name:
+        digest = hashlib.sha1(get_file_key(container).encode())
+        digest.update(name.encode())
+        return digest.hexdigest()
+    status = os.stat(path)
+    size = status.st_size
+    digest = hashlib.sha1(("%s\0%i\0%i" % (
+        os.path.abspath(path), size, status.st_mtime_ns)).encode())
+    with open(path, "rb") as image_file:
+        digest.update(image_file.read(hash_block_size))
+        if size > 2 * hash_block_size:
+            image_file.seek(-hash_block_size, os.SEEK_END)
+        digest.update(image_file.read(hash_block_size))
+    return digest.hexdigest()
+
+
+class ThumbnailCache(object):
+    """
+    A persistent, size limited cache of image thumbnails. The thumbnails
+    are saved as .npy files, and the entries are tracked in an SQLite
+    database in the cache directory.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.connection = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=30)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                key TEXT, size INTEGER, bytes INTEGER, accessed REAL,
+                PRIMARY KEY (key, size));
+            CREATE INDEX IF NOT EXISTS thumbnails_accessed ON thumbnails (accessed);
+            """
+        )
+
+    def get_file_name(self, key, size):
+        return os.path.join(self.path, key[:2], "%s_%i.npy" % (key, size))
+
+    def load(self, path, size=thumbnail_size):
+        """
+        Returns a thumbnail of an image, from the cache if possible.
+
+        :param path:    Path to an image
+        :param size:    Maximum length of the longer side
+        :return:        A uint8 Numpy array
+        """
+        key = get_file_key(path)
+        # The smallest cached thumbnail that is at least of the requested size
+        row = self.connection.execute(
+            "SELECT size FROM thumbnails WHERE key = ? AND size >= ? ORDER BY size LIMIT 1",
+            (key, size)).fetchone()
+        thumbnail = None
+        if row is not None:
+            try:
+                thumbnail = numpy.load(self.get_file_name(key, row[0]))
+            except (IOError, ValueError):
+                self.remove(key, row[0])
+        if thumbnail is not None and row[0] == size:
+            self.touch(key, size)
+            return thumbnail
+
+        if thumbnail is not None:
+            self.touch(key, row[0])
+            thumbnail = make_thumbnail(thumbnail, size)
+        else:
+            thumbnail = load_thumbnail(path, size)
+        self.store(key, size, thumbnail)
+        return thumbnail
+
+    def touch(self, key, size):
+        self.connection.execute(
+            "UPDATE thumbnails SET accessed = ? WHERE key = ? AND size = ?",
+            (time.time(), key, size))
+        self.connection.commit()
+
+    def store(self, key, size, thumbnail):
+        file_name = self.get_file_name(key, size)
+        if not os.path.exists(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        numpy.save(file_name, thumbnail)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO thumbnails VALUES (?, ?, ?, ?)",
+            (key, size, os.path.getsize(file_name), time.time()))
+        self.connection.commit()
+        self.evict()
+
+    def remove(self, key, size):
+        file_name = self.get_file_name(key, size)
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        self.connection.execute(
+            "DELETE FROM thumbnails WHERE key = ? AND size = ?", (key, size))
+
+    def get_total_bytes(self):
+        return self.connection.execute(
+            "SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+
+    def evict(self):
+        """
+        Remove the least recently used thumbnails, until the total size of
+        the cache is below the limit.
+        """
+        total = self.get_total_bytes()
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute(
+            "SELECT key, size, bytes FROM thumbnails ORDER BY accessed").fetchall()
+        for key, size, size_bytes in rows:
+            if total <= self.max_bytes:
+                break
+            self.remove(key, size)
+            total -= size_bytes
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
@@ -8,16 +8,19 @@ Contains all kinds of code snippets that did not find a home in
 the main modules.
 """
 
-from scipy import ndimage
 import numpy
 from matplotlib import pyplot as plt
 import os
 
+from pyimq import normalize, kernels, thumbnails, report
+
 
 def rescale_to_min_max(data, data_min, data_max):
     """
     A function to rescale image intensities to range, define by
-    data_min and data_max input parameters.
+    data_min and data_max input parameters. Please see the normalize
+    module for the vectorized implementation, that can also write
+    the result into a preallocated output buffer.
 
     :param data:        Input image (Numpy array)
     :param data_min:    Minimum pixel value. Can be any type of a number
@@ -25,20 +28,7 @@ def rescale_to_min_max(data, data_min, data_max):
     :param data_max:    Maximum pixel value
     :return:            Return the rescaled array
     """
-    # Check if image is an RGB image
-    if len(data.shape) == 3:
-        for i in range(data.shape[2]):
-            if abs(data[:, :, i].max()) > abs(data[:, :, i].min()) or data_min == 0:
-                data[:, :, i] = data_max / data.max()*data[:, :, i]
-            else:
-                data[:, :, i] = data_min / data.min()*data[:, :, i]
-        return data
-
-    else:
-        if abs(data.max()) > abs(data.min()) or data_min == 0:
-            return data_max / data.max()*data
-        else:
-            return data_min / data.min()*data
+    return normalize.rescale_to_min_max(data, data_min, data_max, dtype=numpy.float64)
 
 
 def analyze_accumulation(x, fraction):
@@ -53,31 +43,38 @@ def analyze_accumulation(x, fraction):
     return index
 
 
-def calculate_entropy(data):
+def calculate_entropy(data, mask=None):
     """
-    Calculate the Shannon entropy for data
+    Calculate the Shannon entropy for data. An optional boolean mask can be
+    used to limit the calculation to a part of the data. See the entropy
+    and kernels modules for details.
     """
-    # Calculate histogram
-    histogram = ndimage.histogram(
-        data,
-        data.min(),
-        data.max(), 50)
-    # Exclude zeros
-    histogram = histogram[numpy.nonzero(histogram)]
-    # Normalize histogram bins to sum to one
-    histogram = histogram.astype(float)/histogram.sum()
-    return -numpy.sum(histogram*numpy.log2(histogram))
-
-
-def show_pics_from_disk(filenames, title="Image collage"):
+    return kernels.calculate_entropy(data, bins=50, mask=mask)
+
+
+def show_pics_from_disk(filenames, title="Image collage", size=thumbnails.thumbnail_size,
+                        cache=None):
     """
     A utility for creating a collage of images, to be shown
     in a single plot. The images are loaded from disk according
-    to the provided filenames:
+    to the provided filenames, as downsampled thumbnails. In the
+    headless report mode the collage is rendered into a file
+    instead (see the report module).
     :param filenames:   A list containing the image filenames
     :param title:       Name of the plot
+    :param size:        Size of the thumbnails
+    :param cache:       An optional ThumbnailCache
     :return:            Nothing
     """
+    def load(filename):
+        if cache is not None:
+            return cache.load(filename, size)
+        return thumbnails.load_thumbnail(filename, size)
+
+    if report.is_active():
+        report.show_collage(filenames, title)
+        return
+
     if len(filenames) > 1:
         if 4 < len(filenames) <= 9:
             fig, subplots = plt.subplots(3, 3)
@@ -97,8 +94,8 @@ def show_pics_from_disk(filenames, title="Image collage"):
         while k < len(filenames):
             j = 0
             while j < subplots.shape[1] and k < len(filenames):
-                print(filenames[i+j])
-                subplots[i, j].imshow(plt.imread(filenames[k]), cmap=plt.cm.hot)
+                print(filenames[k])
+                subplots[i, j].imshow(load(filenames[k]), cmap=plt.cm.hot)
                 subplots[i, j].set_title(os.path.basename(filenames[k]))
                 subplots[i, j].axis("off")
                 k += 1
@@ -109,6 +106,6 @@ def show_pics_from_disk(filenames, title="Image collage"):
         plt.show()
 
     else:
-        plt.imshow(plt.imread(filenames))
+        plt.imshow(load(filenames[0]))
         plt.axis("off")
-        plt.show()
\ No newline at end of file
+        plt.show()
@@ -5,13 +5,21 @@ setup(
     version='0.1',
     packages=find_packages(),
     install_requires=['numpy', 'scipy', 'pandas', 'matplotlib'],
+    extras_require={
+        'tiff': ['tifffile'],
+        'hdf5': ['h5py'],
+        'jit': ['numba'],
+    },
     entry_points={
         'console_scripts': [
             'pyimq.main = pyimq.bin.main:main',
             'pyimq.util.blurseq = pyimq.bin.utils.create_blur_sequence:main',
             'pyimq.util.imseq = pyimq.bin.utils.create_photo_test_set:main',
+            'pyimq.util.synthetic = pyimq.bin.utils.create_synthetic_dataset:main',
             'pyimq.subjective = pyimq.bin.subjective:main',
-            'pyimq.power = pyimq.bin.power:main'
+            'pyimq.power = pyimq.bin.power:main',
+            'pyimq.stream = pyimq.bin.stream:main',
+            'pyimq.evaluate = pyimq.bin.evaluate:main'
         ]
     },
     platforms=["any"],